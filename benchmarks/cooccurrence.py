@@ -0,0 +1,131 @@
+"""Benchmarks for the co-occurrence vectorizer family.
+
+For each vectorizer a fit suite times fit_transform and records its peak
+resident memory, and a separate transform suite times transform on a model
+fitted during setup, over a grid of thread counts, EM iterations, window
+orientations and kernels. Run with asv (see asv.conf.json in the repository
+root), e.g.
+
+    asv run --bench cooccurrence
+    asv continuous master HEAD --bench cooccurrence
+"""
+from vectorizers import (
+    TokenCooccurrenceVectorizer,
+    TimedTokenCooccurrenceVectorizer,
+    NgramCooccurrenceVectorizer,
+    MultiSetCooccurrenceVectorizer,
+)
+
+from .corpora import (
+    zipfian_token_corpus,
+    zipfian_timed_corpus,
+    zipfian_multiset_corpus,
+)
+
+
+class _CooccurrenceSuite:
+    params = (
+        [1, 4],
+        [0, 2],
+        ["directional", "after"],
+        ["flat", "geometric"],
+    )
+    param_names = ["n_threads", "n_iter", "window_orientations", "kernel_functions"]
+    timeout = 600
+
+    vectorizer_class = None
+    vectorizer_kwargs = {}
+
+    def make_corpus(self):
+        return zipfian_token_corpus()
+
+    def make_vectorizer(self, n_threads, n_iter, window_orientations, kernel_functions):
+        return self.vectorizer_class(
+            n_threads=n_threads,
+            n_iter=n_iter,
+            window_orientations=window_orientations,
+            kernel_functions=kernel_functions,
+            **self.vectorizer_kwargs,
+        )
+
+    def setup(self, *params):
+        self.corpus = self.make_corpus()
+        # Compile the numba kernels outside of the timed region
+        self.make_vectorizer(*params).fit(self.corpus[:10])
+
+
+class _FitSuite(_CooccurrenceSuite):
+    def time_fit_transform(self, *params):
+        self.make_vectorizer(*params).fit_transform(self.corpus)
+
+    def peakmem_fit_transform(self, *params):
+        self.make_vectorizer(*params).fit_transform(self.corpus)
+
+
+class _TransformSuite(_CooccurrenceSuite):
+    def setup(self, *params):
+        super().setup(*params)
+        # Only transform needs a model fitted on the full corpus; keeping this out of
+        # the fit suites stops it from inflating their peak memory
+        self.fitted = self.make_vectorizer(*params).fit(self.corpus)
+
+    def time_transform(self, *params):
+        self.fitted.transform(self.corpus)
+
+
+class _TokenCooccurrence:
+    vectorizer_class = TokenCooccurrenceVectorizer
+    vectorizer_kwargs = {"window_functions": "variable", "window_radii": 5}
+
+
+class _TimedTokenCooccurrence:
+    vectorizer_class = TimedTokenCooccurrenceVectorizer
+    vectorizer_kwargs = {"window_radii": 5}
+
+    def make_corpus(self):
+        return zipfian_timed_corpus()
+
+
+class _NgramCooccurrence:
+    vectorizer_class = NgramCooccurrenceVectorizer
+    vectorizer_kwargs = {"ngram_size": 2, "window_radii": 5, "min_occurrences": 2}
+
+
+class _MultiSetCooccurrence:
+    vectorizer_class = MultiSetCooccurrenceVectorizer
+    vectorizer_kwargs = {"window_radii": 2}
+
+    def make_corpus(self):
+        return zipfian_multiset_corpus()
+
+
+class TokenCooccurrenceFit(_TokenCooccurrence, _FitSuite):
+    pass
+
+
+class TokenCooccurrenceTransform(_TokenCooccurrence, _TransformSuite):
+    pass
+
+
+class TimedTokenCooccurrenceFit(_TimedTokenCooccurrence, _FitSuite):
+    pass
+
+
+class TimedTokenCooccurrenceTransform(_TimedTokenCooccurrence, _TransformSuite):
+    pass
+
+
+class NgramCooccurrenceFit(_NgramCooccurrence, _FitSuite):
+    pass
+
+
+class NgramCooccurrenceTransform(_NgramCooccurrence, _TransformSuite):
+    pass
+
+
+class MultiSetCooccurrenceFit(_MultiSetCooccurrence, _FitSuite):
+    pass
+
+
+class MultiSetCooccurrenceTransform(_MultiSetCooccurrence, _TransformSuite):
+    pass
@@ -0,0 +1,75 @@
+"""Synthetic corpora for benchmarking.
+
+Token frequencies in natural language are roughly Zipfian, and that skew is
+what drives both the vocabulary pruning and the variable window sizes of the
+co-occurrence vectorizers, so benchmarks draw tokens from a Zipf distribution
+over a fixed vocabulary. The corpus size can be scaled with environment
+variables so the same suite serves quick local checks and large regression
+runs:
+
+    VECTORIZERS_BENCH_DOCUMENTS     number of documents (default 2000)
+    VECTORIZERS_BENCH_LENGTH        mean document length (default 200)
+    VECTORIZERS_BENCH_VOCABULARY    vocabulary size (default 10000)
+"""
+import os
+
+import numpy as np
+
+N_DOCUMENTS = int(os.environ.get("VECTORIZERS_BENCH_DOCUMENTS", 2000))
+DOCUMENT_LENGTH = int(os.environ.get("VECTORIZERS_BENCH_LENGTH", 200))
+VOCABULARY_SIZE = int(os.environ.get("VECTORIZERS_BENCH_VOCABULARY", 10000))
+
+
+def zipfian_token_corpus(
+    n_documents=N_DOCUMENTS,
+    document_length=DOCUMENT_LENGTH,
+    vocabulary_size=VOCABULARY_SIZE,
+    exponent=1.1,
+    random_state=0,
+):
+    """Generate a list of documents, each a list of string tokens, whose token
+    frequencies follow a Zipf distribution with the given exponent. Document
+    lengths are Poisson distributed around document_length."""
+    rng = np.random.RandomState(random_state)
+    probabilities = 1.0 / np.power(np.arange(1, vocabulary_size + 1), exponent)
+    probabilities /= probabilities.sum()
+    vocabulary = np.array([f"token{i}" for i in range(vocabulary_size)])
+    lengths = np.maximum(rng.poisson(document_length, size=n_documents), 1)
+    tokens = vocabulary[
+        rng.choice(vocabulary_size, size=lengths.sum(), p=probabilities)
+    ].tolist()
+    boundaries = np.concatenate(([0], np.cumsum(lengths)))
+    return [
+        tokens[boundaries[i] : boundaries[i + 1]] for i in range(n_documents)
+    ]
+
+
+def zipfian_timed_corpus(random_state=0, **kwargs):
+    """Generate a Zipfian corpus of (token, timestamp) documents with exponentially
+    distributed gaps between consecutive timestamps."""
+    corpus = zipfian_token_corpus(random_state=random_state, **kwargs)
+    rng = np.random.RandomState(random_state + 1)
+    result = []
+    for document in corpus:
+        times = np.cumsum(rng.exponential(size=len(document))).tolist()
+        result.append(list(zip(document, times)))
+    return result
+
+
+def zipfian_multiset_corpus(mean_set_size=3, random_state=0, **kwargs):
+    """Generate a Zipfian corpus of multiset documents by cutting the token documents
+    into consecutive sets of Poisson distributed size (empty sets included)."""
+    corpus = zipfian_token_corpus(random_state=random_state, **kwargs)
+    rng = np.random.RandomState(random_state + 2)
+    result = []
+    for document in corpus:
+        sizes = rng.poisson(mean_set_size, size=len(document))
+        boundaries = np.concatenate(([0], np.cumsum(sizes)))
+        boundaries = boundaries[boundaries <= len(document)]
+        result.append(
+            [
+                document[boundaries[i] : boundaries[i + 1]]
+                for i in range(len(boundaries) - 1)
+            ]
+        )
+    return result
@@ -19,6 +19,7 @@ from .mixed_gram_vectorizer import LZCompressionVectorizer, BytePairEncodingVect
 from .signature_vectorizer import SignatureVectorizer
 
 from .utils import cast_tokens_to_strings
+from .preprocessing import EncodedCorpus, LabelledForest
 
 from ._version import __version__
 
@@ -38,5 +39,7 @@ __all__ = [
     "ApproximateWassersteinVectorizer",
     "EdgeListVectorizer",
     "SignatureVectorizer",
+    "EncodedCorpus",
+    "LabelledForest",
     "__version__",
 ]
@@ -42,6 +42,28 @@ def fixed_window_radii(window_size, token_frequency, mask_index=None):
     return radii
 
 
+def window_radii_table(window_radii):
+    """Interleave the per token radii of several window functions into a single
+    (n_tokens, n_windows) array, so that all the radii of a token are adjacent in
+    memory. The array is stored as uint16 unless some radius does not fit, in which
+    case uint32 is used.
+
+    Parameters
+    ----------
+    window_radii: list of numpy.ndarray
+        The radii per token of each window function.
+
+    Returns
+    -------
+    table: numpy.ndarray of shape (n_tokens, n_windows)
+        The interleaved window radii.
+    """
+    table = np.stack(window_radii, axis=1)
+    if table.size > 0 and table.max() > np.iinfo(np.uint16).max:
+        return np.ascontiguousarray(table, dtype=np.uint32)
+    return np.ascontiguousarray(table, dtype=np.uint16)
+
+
 # Kernel functions
 
 
@@ -1,24 +1,30 @@
 from .preprocessing import (
     preprocess_token_sequences,
+    EncodedCorpus,
 )
 from sklearn.utils.validation import check_is_fitted
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing import normalize
-from sklearn.utils.extmath import randomized_svd, svd_flip
+from sklearn.utils.extmath import svd_flip
 from collections.abc import Iterable
 from scipy.sparse.linalg import svds
 
 import vectorizers.distances as distances
 
 from .utils import (
-    validate_homogeneous_token_types,
+    validate_token_data,
     flatten,
     str_to_bytes,
 )
 
 from .coo_utils import CooArray, COO_QUICKSORT_LIMIT
+from .svd_utils import NormalizedPowerCSROperator, blocked_randomized_svd
 
+import os
+import pickle
+import time
 import numpy as np
+import pandas as pd
 import numba
 from numba.typed import List
 import dask
@@ -26,6 +32,14 @@ import scipy.sparse
 from ._window_kernels import (
     _KERNEL_FUNCTIONS,
     _WINDOW_FUNCTIONS,
+    window_radii_table,
+)
+
+_PERSISTED_ARRAYS = (
+    "_window_len_array",
+    "_token_frequencies_",
+    "_ngram_frequencies",
+    "reduced_matrix_",
 )
 
 
@@ -131,8 +145,10 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         When processing token sequences to build the matrix, break the list of sequences into
         n_threads equal sized chunks to process in parallel with Dask.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the
@@ -220,6 +236,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         # Set attributes
         self.metric_ = distances.sparse_hellinger
         self._preprocessing = preprocess_token_sequences
+        self._accepts_encoded_corpus = True
 
         # Set params to be fit
         self._token_frequencies_ = np.array([])
@@ -420,18 +437,78 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
     def _set_row_information(self, token_sequences):
         self._n_rows = len(self.token_label_dictionary_)
 
+    def _preprocessing_params(self):
+        # Any additional keyword arguments to pass to the _preprocessing function
+        return {}
+
+    def _validate_input(self, X):
+        if isinstance(X, EncodedCorpus):
+            if not self._accepts_encoded_corpus:
+                raise TypeError(
+                    f"{type(self).__name__} cannot consume an EncodedCorpus; "
+                    "pass the raw sequences instead"
+                )
+        else:
+            validate_token_data(X, self.validate_data)
+
+    def _window_row_frequencies(self):
+        # The row frequencies and row mask index the window functions are based on
+        return self._token_frequencies_, self._mask_index
+
     def _set_window_len_array(self):
+        row_frequencies, mask_index = self._window_row_frequencies()
         window_array = []
         for i, win_fn in enumerate(self._window_functions):
             window_array.append(
                 win_fn(
                     self._window_radii[i],
-                    self._token_frequencies_,
-                    self._mask_index,
+                    row_frequencies,
+                    mask_index,
                     *self._window_args[i],
                 )
             )
-        self._window_len_array = np.array(window_array)
+        self._window_len_array = window_radii_table(window_array)
+
+    def window_size_distribution(self):
+        """Profile the effective window radii of a fitted model. For each window this
+        reports how many rows (tokens, or ngrams) get each radius, their total
+        frequency, and the share of the window's skip-grams they account for, i.e.
+        where the skip-gram volume (and hence the build time and memory) comes from.
+
+        Returns
+        -------
+        distribution: pandas.DataFrame
+            A frame with columns "window", "radius", "n_rows", "frequency" and
+            "skipgram_share", with one row per window and distinct radius.
+        """
+        check_is_fitted(self, ["_window_len_array"])
+        row_frequencies, mask_index = self._window_row_frequencies()
+        row_frequencies = np.asarray(row_frequencies, dtype=np.float64)
+        frames = []
+        for i in range(self._window_len_array.shape[1]):
+            radii = self._window_len_array[: row_frequencies.shape[0], i]
+            unique_radii, inverse, counts = np.unique(
+                radii, return_inverse=True, return_counts=True
+            )
+            frequency = np.bincount(
+                inverse, weights=row_frequencies, minlength=unique_radii.shape[0]
+            )
+            volume = frequency * unique_radii
+            total_volume = volume.sum()
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "window": i,
+                        "radius": unique_radii.astype(np.int64),
+                        "n_rows": counts,
+                        "frequency": frequency,
+                        "skipgram_share": volume / total_volume
+                        if total_volume > 0
+                        else np.zeros_like(volume),
+                    }
+                )
+            )
+        return pd.concat(frames, ignore_index=True)
 
     def _set_mask_indices(self):
         if self.nullify_mask:
@@ -454,9 +531,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
 
     def _set_coo_sizes(self, token_sequences):
         # Set the coo_array size
-        approx_coo_size = 0
-        for t in token_sequences:
-            approx_coo_size += len(t)
+        approx_coo_size = self._n_total_tokens(token_sequences)
         approx_coo_size *= (max(self.window_radii) + 1) * (20 * self._n_wide)
         if approx_coo_size < self.coo_initial_bytes:
             self._coo_sizes = np.repeat(
@@ -472,6 +547,15 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
 
         self._coo_sizes = np.divmod(self._coo_sizes, self.n_threads)[0]
 
+    def _n_total_tokens(self, token_sequences):
+        result = 0
+        for t in token_sequences:
+            result += len(t)
+        return result
+
+    def _sequence_chunk(self, token_sequences, chunk_start, chunk_end):
+        return token_sequences[chunk_start:chunk_end]
+
     def _generate_chunk_boundaries(self, data, n_threads):
         token_list_sizes = np.array([len(x) for x in data])
         cumulative_sizes = np.cumsum(token_list_sizes)
@@ -539,7 +623,9 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         if self.n_threads > 1:
             matrix_per_chunk = [
                 dask.delayed(self._build_coo)(
-                    token_sequences=token_sequences[chunk_start:chunk_end],
+                    token_sequences=self._sequence_chunk(
+                        token_sequences, chunk_start, chunk_end
+                    ),
                 )
                 for chunk_start, chunk_end in self._generate_chunk_boundaries(
                     token_sequences, self.n_threads
@@ -565,7 +651,9 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             if self.n_threads > 1:
                 new_data_per_chunk = [
                     dask.delayed(self._em_cooccurrence_iteration)(
-                        token_sequences=token_sequences[chunk_start:chunk_end],
+                        token_sequences=self._sequence_chunk(
+                            token_sequences, chunk_start, chunk_end
+                        ),
                         cooccurrence_matrix=cooccurrence_matrix,
                     )
                     for chunk_start, chunk_end in self._generate_chunk_boundaries(
@@ -590,8 +678,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
 
     def fit_transform(self, X, y=None, **fit_params):
 
-        if self.validate_data:
-            validate_homogeneous_token_types(X)
+        self._validate_input(X)
 
         # noinspection PyTupleAssignmentBalance
         (
@@ -614,6 +701,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             ignored_tokens=self.excluded_tokens,
             excluded_token_regex=self.excluded_token_regex,
             masking=self.mask_string,
+            **self._preprocessing_params(),
         )
 
         if len(self.token_label_dictionary_) == 0:
@@ -650,8 +738,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         return self.cooccurrences_
 
     def fit(self, X, y=None, **fit_params):
-        if self.validate_data:
-            validate_homogeneous_token_types(X)
+        self._validate_input(X)
 
         # noinspection PyTupleAssignmentBalance
         (
@@ -674,6 +761,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             ignored_tokens=self.excluded_tokens,
             excluded_token_regex=self.excluded_token_regex,
             masking=self.mask_string,
+            **self._preprocessing_params(),
         )
 
         if len(self.token_label_dictionary_) == 0:
@@ -722,8 +810,7 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         """
         check_is_fitted(self, ["column_label_dictionary_"])
 
-        if self.validate_data:
-            validate_homogeneous_token_types(X)
+        self._validate_input(X)
 
         # noinspection PyTupleAssignmentBalance
         (
@@ -732,7 +819,10 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             column_index_dictionary,
             token_frequencies,
         ) = self._preprocessing(
-            X, token_dictionary=self.token_label_dictionary_, masking=self.mask_string
+            X,
+            token_dictionary=self.token_label_dictionary_,
+            masking=self.mask_string,
+            **self._preprocessing_params(),
         )
 
         cooccurrences_ = self._build_token_cooccurrence_matrix(
@@ -741,33 +831,195 @@ class BaseCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
 
         return cooccurrences_
 
+    def _get_persistent_state(self):
+        # Numba typed containers can't be pickled; they are rebuilt on load
+        state = self.__dict__.copy()
+        state.pop("_full_kernel_args", None)
+        return state
+
+    def _set_persistent_state(self, state):
+        self.__dict__.update(state)
+        self._set_full_kernel_args()
+
+    def save(self, path):
+        """Save a fitted model to the directory ``path``. The co-occurrence matrix CSR
+        arrays, window arrays and token frequencies are stored as raw ``.npy`` files
+        (so they can be memory-mapped by ``load``), the vocabulary is stored as a
+        sorted token array with the corresponding token indices, and the remaining
+        (small) state of the model is pickled.
+
+        Parameters
+        ----------
+        path: str
+            The directory to save the model in; it will be created if need be.
+        """
+        check_is_fitted(self, ["column_label_dictionary_"])
+        os.makedirs(path, exist_ok=True)
+
+        state = self._get_persistent_state()
+        state.pop("column_label_dictionary_", None)
+        state.pop("column_index_dictionary_", None)
+
+        arrays = {}
+        cooccurrences = state.pop("cooccurrences_").tocsr()
+        state["_cooccurrences_shape"] = cooccurrences.shape
+        arrays["cooccurrences_data"] = cooccurrences.data
+        arrays["cooccurrences_indices"] = cooccurrences.indices
+        arrays["cooccurrences_indptr"] = cooccurrences.indptr
+        for name in _PERSISTED_ARRAYS:
+            if isinstance(state.get(name), np.ndarray):
+                arrays[name] = state.pop(name)
+
+        tokens = list(self.token_label_dictionary_.keys())
+        token_array = np.asarray(tokens)
+        if (
+            len(tokens) > 0
+            and token_array.ndim == 1
+            and token_array.dtype != object
+            and token_array.tolist() == tokens
+        ):
+            order = np.argsort(token_array, kind="stable")
+            arrays["vocabulary_tokens"] = token_array[order]
+            arrays["vocabulary_indices"] = np.fromiter(
+                self.token_label_dictionary_.values(),
+                dtype=np.int64,
+                count=len(tokens),
+            )[order]
+            state.pop("token_label_dictionary_")
+            state.pop("token_index_dictionary_")
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), array)
+        with open(os.path.join(path, "estimator.pkl"), "wb") as f:
+            pickle.dump((type(self), state, list(arrays.keys())), f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a model previously stored with ``save``.
+
+        Parameters
+        ----------
+        path: str
+            The directory the model was saved in.
+
+        mmap: bool (optional, default=True)
+            Whether to memory-map the stored arrays (read only) rather than reading
+            them into memory. Memory-mapped models load near instantly and share
+            pages between processes loading the same files.
+
+        Returns
+        -------
+        model: BaseCooccurrenceVectorizer
+            The fitted model.
+        """
+        with open(os.path.join(path, "estimator.pkl"), "rb") as f:
+            model_class, state, array_names = pickle.load(f)
+        if not issubclass(model_class, cls):
+            raise ValueError(
+                f"The model stored in {path} is a {model_class.__name__}, not a {cls.__name__}"
+            )
+
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in array_names
+        }
+
+        state["cooccurrences_"] = scipy.sparse.csr_matrix(
+            (
+                arrays.pop("cooccurrences_data"),
+                arrays.pop("cooccurrences_indices"),
+                arrays.pop("cooccurrences_indptr"),
+            ),
+            shape=state.pop("_cooccurrences_shape"),
+            copy=False,
+        )
+        if "vocabulary_tokens" in arrays:
+            tokens = arrays.pop("vocabulary_tokens").tolist()
+            indices = arrays.pop("vocabulary_indices").tolist()
+            state["token_label_dictionary_"] = dict(zip(tokens, indices))
+            state["token_index_dictionary_"] = dict(zip(indices, tokens))
+        state.update(arrays)
+
+        model = model_class.__new__(model_class)
+        model._set_persistent_state(state)
+        model._set_column_dicts()
+        return model
+
     def reduce_dimension(
         self,
         dimension=150,
         algorithm="arpack",
         n_iter=10,
         power=0.25,
+        block_size=65536,
+        random_state=None,
     ):
-        check_is_fitted(self, ["column_label_dictionary_"])
+        """Produce a dense embedding of the rows of the fitted co-occurrence matrix via
+        a truncated SVD of the L1 normalized co-occurrences raised to ``power``.
 
-        if self.n_iter < 1:
-            self.reduced_matrix_ = normalize(self.cooccurrences_, axis=0, norm="l1")
-            self.reduced_matrix_ = normalize(self.reduced_matrix_, axis=1, norm="l1")
-        else:
-            self.reduced_matrix_ = normalize(self.cooccurrences_, axis=1, norm="l1")
+        The normalization and power transform are applied on the fly, one block of
+        rows at a time, inside the matrix products of the SVD, so no normalized copy
+        of ``cooccurrences_`` is ever materialized. This also means
+        ``cooccurrences_`` may be backed by memory-mapped arrays.
+
+        Parameters
+        ----------
+        dimension: int (optional, default=150)
+            The dimension of the embedding.
+
+        algorithm: str (optional, default="arpack")
+            The SVD algorithm; one of "arpack" or "randomized" (a blocked
+            randomized SVD).
+
+        n_iter: int (optional, default=10)
+            The number of power iterations of the randomized SVD.
+
+        power: float (optional, default=0.25)
+            The power to raise the normalized co-occurrences to.
 
-        self.reduced_matrix_.data = np.power(self.reduced_matrix_.data, power)
+        block_size: int (optional, default=65536)
+            The number of rows of the co-occurrence matrix to process at a time.
+
+        random_state: int, numpy.random.RandomState or None (optional, default=None)
+            The random state for the randomized SVD.
+
+        Returns
+        -------
+        reduced_matrix_: array of shape (n_rows, dimension)
+            The embedding; the wall time in seconds of each stage of the reduction
+            is recorded in ``reduction_timings_``.
+        """
+        check_is_fitted(self, ["column_label_dictionary_"])
+
+        self.reduction_timings_ = {}
+        start_time = time.perf_counter()
+        operator = NormalizedPowerCSROperator.from_csr(
+            self.cooccurrences_,
+            power=power,
+            column_normalize=self.n_iter < 1,
+            block_size=block_size,
+        )
+        self.reduction_timings_["normalization"] = time.perf_counter() - start_time
 
+        start_time = time.perf_counter()
         if algorithm == "arpack":
-            u, s, v = svds(self.reduced_matrix_, k=dimension)
+            u, s, v = svds(operator, k=dimension)
         elif algorithm == "randomized":
-            u, s, v = randomized_svd(
-                self.reduced_matrix_, n_components=dimension, n_iter=n_iter
+            u, s, v = blocked_randomized_svd(
+                operator,
+                n_components=dimension,
+                n_iter=n_iter,
+                random_state=random_state,
+                timings=self.reduction_timings_,
             )
         else:
             raise ValueError("algorithm should be one of 'arpack' or 'randomized'")
+        self.reduction_timings_["svd"] = time.perf_counter() - start_time
 
+        start_time = time.perf_counter()
         u, v = svd_flip(u, v)
         self.reduced_matrix_ = u * np.power(s, 0.5)
+        self.reduction_timings_["embedding"] = time.perf_counter() - start_time
 
         return self.reduced_matrix_
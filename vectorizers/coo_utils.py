@@ -218,22 +218,44 @@ def coo_append(coo, tup):
 
 
 @numba.njit(nogil=True)
-def sum_coo_entries(seq):
-    seq.sort()
-    this_coord = (seq[0][0], seq[0][1])
-    this_sum = 0
-    reduced_data = []
-    for entry in seq:
-        if (entry[0], entry[1]) == this_coord:
-            this_sum += entry[2]
-        else:
-            reduced_data.append((this_coord[0], this_coord[1], this_sum))
-            this_sum = entry[2]
-            this_coord = (entry[0], entry[1])
+def sum_coo_entries_by_key(keys, values):
+    """Sum the values of entries with equal integer keys, such as the combined
+    row * n_cols + col key of a COO entry.
+
+    Parameters
+    ----------
+    keys: array of int64
+        The key of each entry.
+
+    values: array
+        The value of each entry.
 
-    reduced_data.append((this_coord[0], this_coord[1], this_sum))
+    Returns
+    -------
+    unique_keys: array of int64
+        The distinct keys in increasing order.
+
+    sums: array
+        The sum of the values of the entries with each key.
+    """
+    n_entries = keys.shape[0]
+    order = np.argsort(keys, kind="mergesort")
+    n_unique = 0
+    for i in range(n_entries):
+        if i == 0 or keys[order[i]] != keys[order[i - 1]]:
+            n_unique += 1
+
+    unique_keys = np.empty(n_unique, dtype=np.int64)
+    sums = np.zeros(n_unique, dtype=values.dtype)
+    k = -1
+    for i in range(n_entries):
+        if i == 0 or keys[order[i]] != keys[order[i - 1]]:
+            k += 1
+            unique_keys[k] = keys[order[i]]
+        sums[k] += values[order[i]]
+
+    return unique_keys, sums
 
-    return reduced_data
 
 @numba.njit(nogil=True)
 def em_update_matrix(
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from collections.abc import Iterable
 from .coo_utils import (
     coo_append,
@@ -9,17 +10,124 @@ from .coo_utils import (
 from .base_cooccurrence_vectorizer import BaseCooccurrenceVectorizer
 import numpy as np
 import numba
-import scipy.sparse
 from .preprocessing import preprocess_multi_token_sequences
 from .utils import flatten
 from ._window_kernels import (
     _MULTI_KERNEL_FUNCTIONS,
 )
 
+# A two level flat (CSR-like) representation of a list of documents, each of which is
+# a sequence of multisets of tokens. The tokens of multiset j are
+# tokens[set_indptr[j]:set_indptr[j + 1]] and the multisets of document d are
+# multisets doc_indptr[d] up to (but not including) doc_indptr[d + 1].
+MultiSetSequences = namedtuple(
+    "MultiSetSequences", ["tokens", "set_indptr", "doc_indptr"]
+)
+
+
+@numba.njit(nogil=True)
+def flatten_multiset_sequences(token_sequences):
+    """Convert a (numba typed) list of lists of token index arrays into the flat
+    token buffer, multiset offsets and document offsets of a MultiSetSequences.
+
+    Parameters
+    ----------
+    token_sequences: List of List of numpy.array
+        The documents, each of which is a sequence of multisets of token indices.
+
+    Returns
+    -------
+    tokens: numpy.array
+        All the token indices of the documents, concatenated.
+
+    set_indptr: numpy.array
+        The offsets into tokens of each multiset.
+
+    doc_indptr: numpy.array
+        The offsets into set_indptr of each document.
+    """
+    n_docs = len(token_sequences)
+    doc_indptr = np.zeros(n_docs + 1, dtype=np.int64)
+    for d_i in range(n_docs):
+        doc_indptr[d_i + 1] = doc_indptr[d_i] + len(token_sequences[d_i])
+
+    set_indptr = np.zeros(doc_indptr[-1] + 1, dtype=np.int64)
+    s_i = 0
+    for doc in token_sequences:
+        for mset in doc:
+            set_indptr[s_i + 1] = set_indptr[s_i] + len(mset)
+            s_i += 1
+
+    tokens = np.empty(set_indptr[-1], dtype=np.int32)
+    s_i = 0
+    for doc in token_sequences:
+        for mset in doc:
+            tokens[set_indptr[s_i] : set_indptr[s_i + 1]] = mset
+            s_i += 1
+
+    return tokens, set_indptr, doc_indptr
+
+
+def preprocess_flat_multi_token_sequences(token_sequences, token_dictionary=None, **kwargs):
+    """Run ``preprocess_multi_token_sequences`` and return the resulting documents
+    as a MultiSetSequences flat representation rather than nested lists. All other
+    return values are as for ``preprocess_multi_token_sequences``.
+    """
+    (
+        result_sequences,
+        token_dictionary,
+        inverse_token_dictionary,
+        token_frequencies,
+    ) = preprocess_multi_token_sequences(
+        token_sequences, token_dictionary=token_dictionary, flat=True, **kwargs
+    )
+    return (
+        MultiSetSequences(*result_sequences),
+        token_dictionary,
+        inverse_token_dictionary,
+        token_frequencies,
+    )
+
+
+@numba.njit(nogil=True)
+def multiset_window_at_index(
+    tokens, set_indptr, doc_start, doc_end, set_index, window_size, reverse=False
+):
+    """Produce the multi-window of a given multiset within a document of a
+    MultiSetSequences, along with the flattened tokens of that window. The window
+    starts with the multiset at ``set_index`` and extends ``window_size``
+    multisets forwards (or backwards if ``reverse``) without leaving the document.
+    The multisets of the window are views into the shared token buffer.
+    """
+    if not reverse:
+        window_end = min(doc_end, set_index + window_size + 1)
+        multi_window = [
+            tokens[set_indptr[j] : set_indptr[j + 1]]
+            for j in range(set_index, window_end)
+        ]
+        flat_window = tokens[set_indptr[set_index] : set_indptr[window_end]]
+    else:
+        window_end = max(doc_start, set_index - window_size) - 1
+        multi_window = [
+            tokens[set_indptr[j] : set_indptr[j + 1]]
+            for j in range(set_index, window_end, -1)
+        ]
+        flat_window = np.empty(
+            set_indptr[set_index + 1] - set_indptr[window_end + 1], dtype=tokens.dtype
+        )
+        k = 0
+        for mset in multi_window:
+            flat_window[k : k + len(mset)] = mset
+            k += len(mset)
+
+    return multi_window, flat_window
+
 
 @numba.njit(nogil=True)
 def numba_build_multi_skip_grams(
-    token_sequences,
+    tokens,
+    set_indptr,
+    doc_indptr,
     window_size_array,
     window_reversals,
     kernel_functions,
@@ -37,13 +145,20 @@ def numba_build_multi_skip_grams(
 
     Parameters
     ----------
-    token_sequences: Iterable of Iterables
-        The collection of sequences of multisets of tokens to generate skip-gram data for.
+    tokens: numpy.array
+        The flat token buffer of a MultiSetSequences.
+
+    set_indptr: numpy.array
+        The offsets into tokens of each multiset.
+
+    doc_indptr: numpy.array
+        The offsets into set_indptr of each document to generate skip-gram data for;
+        this may be a slice of the full document offsets.
 
     n_unique_tokens: int
         The number of unique tokens in the token_dictionary.
 
-    window_size_array: numpy.ndarray(float, size = (n_windows, n_unique_tokens))
+    window_size_array: numpy.ndarray(uint16, size = (n_unique_tokens, n_windows))
         A collection of window sizes per vocabulary index per window function
 
     window_reversals: numpy.array(bool, size = (n_windows,))
@@ -70,7 +185,7 @@ def numba_build_multi_skip_grams(
     cooccurrence_matrix: CooArray
         Weight counts of values (kernel weighted counts) that token_head[i] cooccurred with token_tail[i]
     """
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     array_mul = n_windows * n_unique_tokens + 1
 
     coo_data = [
@@ -85,55 +200,47 @@ def numba_build_multi_skip_grams(
         )
         for i in range(n_windows)
     ]
-    for d_i, seq in enumerate(token_sequences):
-        for w_i, target_word in enumerate(seq):
-            windows = []
-            kernels = []
-            for i in range(n_windows):
-                if not window_reversals[i]:
-                    multi_window = token_sequences[
-                        d_i : min(
-                            [len(token_sequences), d_i + window_size_array[i, 0] + 1]
-                        )
-                    ]
-                else:
-                    multi_window = token_sequences[
-                        max([0, d_i - window_size_array[i, 0]]) : d_i + 1
-                    ]
-                    multi_window.reverse()
-
-                result_len = 0
-                for mset in multi_window:
-                    result_len += len(mset)
-
-                this_window = np.zeros(result_len, dtype=np.int64)
-                j = 0
-                for mset in multi_window:
-                    for x in mset:
-                        this_window[j] = x
-                        j += 1
-
-                this_kernel = kernel_functions[i](multi_window, w_i, *kernel_args[i])
-
-                windows.append(this_window)
-                kernels.append(mix_weights[i] * this_kernel)
-
-            total = 0
-            if normalize_windows:
-                sums = np.array([np.sum(ker) for ker in kernels])
-                total = np.sum(sums)
-            if total <= 0:
-                total = 1
-
-            for i, window in enumerate(windows):
-                this_ker = kernels[i]
-                for j, context in enumerate(window):
-                    val = np.float32(this_ker[j] / total)
-                    if val > 0:
-                        row = target_word
-                        col = context + i * n_unique_tokens
-                        key = col + array_mul * row
-                        coo_append(coo_data[i], (row, col, val, key))
+    for doc in range(len(doc_indptr) - 1):
+        doc_start = doc_indptr[doc]
+        doc_end = doc_indptr[doc + 1]
+        for d_i in range(doc_start, doc_end):
+            for w_i in range(set_indptr[d_i + 1] - set_indptr[d_i]):
+                target_word = tokens[set_indptr[d_i] + w_i]
+                windows = []
+                kernels = []
+                for i in range(n_windows):
+                    multi_window, this_window = multiset_window_at_index(
+                        tokens,
+                        set_indptr,
+                        doc_start,
+                        doc_end,
+                        d_i,
+                        window_size_array[0, i],
+                        window_reversals[i],
+                    )
+                    this_kernel = kernel_functions[i](
+                        multi_window, w_i, *kernel_args[i]
+                    )
+
+                    windows.append(this_window)
+                    kernels.append(mix_weights[i] * this_kernel)
+
+                total = 0
+                if normalize_windows:
+                    sums = np.array([np.sum(ker) for ker in kernels])
+                    total = np.sum(sums)
+                if total <= 0:
+                    total = 1
+
+                for i, window in enumerate(windows):
+                    this_ker = kernels[i]
+                    for j, context in enumerate(window):
+                        val = np.float32(this_ker[j] / total)
+                        if val > 0:
+                            row = target_word
+                            col = context + i * n_unique_tokens
+                            key = col + array_mul * row
+                            coo_data[i] = coo_append(coo_data[i], (row, col, val, key))
 
     for coo in coo_data:
         coo_sum_duplicates(coo)
@@ -144,7 +251,9 @@ def numba_build_multi_skip_grams(
 
 @numba.njit(nogil=True)
 def numba_multi_em_cooccurrence_iteration(
-    token_sequences,
+    tokens,
+    set_indptr,
+    doc_indptr,
     window_size_array,
     window_reversals,
     kernel_functions,
@@ -164,10 +273,17 @@ def numba_multi_em_cooccurrence_iteration(
     Parameters
     ----------
 
-    token_sequences: Iterable of Iterables of numpy.arrays
-        The collection of multi set sequences to generate skip-gram data for.
+    tokens: numpy.array
+        The flat token buffer of a MultiSetSequences.
 
-    window_size_array : numpy.ndarray of shape(n, n_vocab)
+    set_indptr: numpy.array
+        The offsets into tokens of each multiset.
+
+    doc_indptr: numpy.array
+        The offsets into set_indptr of each document to process; this may be a slice
+        of the full document offsets.
+
+    window_size_array : numpy.ndarray of shape(n_vocab, n)
         The collection of window sizes per token per directed cooccurrence
 
     window_reversals: numpy.array(bool)
@@ -202,49 +318,41 @@ def numba_multi_em_cooccurrence_iteration(
     """
 
     posterior_data = np.zeros_like(prior_data)
-    n_windows = window_size_array.shape[0]
-    for d_i, seq in enumerate(token_sequences):
-        for w_i, target_word in enumerate(seq):
-            windows = []
-            kernels = []
-            for i in range(n_windows):
-                if not window_reversals[i]:
-                    multi_window = token_sequences[
-                        d_i : min(
-                            [len(token_sequences), d_i + window_size_array[i, 0] + 1]
-                        )
-                    ]
-                else:
-                    multi_window = token_sequences[
-                        max([0, d_i - window_size_array[i, 0]]) : d_i + 1
-                    ]
-                    multi_window.reverse()
-
-                this_kernel = kernel_functions[i](multi_window, w_i, *kernel_args[i])
-
-                result_len = 0
-                for mset in multi_window:
-                    result_len += len(mset)
-
-                this_window = np.zeros(result_len, dtype=np.int64)
-                j = 0
-                for mset in multi_window:
-                    for x in mset:
-                        this_window[j] = x
-                        j += 1
-                windows.append(this_window)
-                kernels.append(mix_weights[i] * this_kernel)
-
-            posterior_data = em_update_matrix(
-                posterior_data,
-                prior_indices,
-                prior_indptr,
-                prior_data,
-                n_unique_tokens,
-                target_word,
-                windows,
-                kernels,
-            )
+    n_windows = window_size_array.shape[1]
+    for doc in range(len(doc_indptr) - 1):
+        doc_start = doc_indptr[doc]
+        doc_end = doc_indptr[doc + 1]
+        for d_i in range(doc_start, doc_end):
+            for w_i in range(set_indptr[d_i + 1] - set_indptr[d_i]):
+                target_word = tokens[set_indptr[d_i] + w_i]
+                windows = []
+                kernels = []
+                for i in range(n_windows):
+                    multi_window, this_window = multiset_window_at_index(
+                        tokens,
+                        set_indptr,
+                        doc_start,
+                        doc_end,
+                        d_i,
+                        window_size_array[0, i],
+                        window_reversals[i],
+                    )
+                    this_kernel = kernel_functions[i](
+                        multi_window, w_i, *kernel_args[i]
+                    )
+                    windows.append(this_window)
+                    kernels.append(mix_weights[i] * this_kernel)
+
+                posterior_data = em_update_matrix(
+                    posterior_data,
+                    prior_indices,
+                    prior_indptr,
+                    prior_data,
+                    n_unique_tokens,
+                    target_word,
+                    windows,
+                    kernels,
+                )
 
     return posterior_data
 
@@ -350,8 +458,10 @@ class MultiSetCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         When processing token sequences to build the matrix, break the list of sequences into
         n_threads equal sized chunks to process in parallel with Dask.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the
@@ -435,32 +545,32 @@ class MultiSetCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
             epsilon=epsilon,
             coo_initial_memory=coo_initial_memory,
         )
-        self._preprocessing = preprocess_multi_token_sequences
+        self._preprocessing = preprocess_flat_multi_token_sequences
+        self._accepts_encoded_corpus = False
 
     def _em_cooccurrence_iteration(self, token_sequences, cooccurrence_matrix):
         # call the numba function to return the new matrix.data
-        result = [np.zeros_like(cooccurrence_matrix.data)]
-        for seq in token_sequences:
-            result.append(
-                numba_multi_em_cooccurrence_iteration(
-                    token_sequences=seq,
-                    n_unique_tokens=len(self.token_label_dictionary_),
-                    window_size_array=self._window_len_array,
-                    window_reversals=self._window_reversals,
-                    kernel_functions=self._kernel_functions,
-                    kernel_args=self._full_kernel_args,
-                    mix_weights=self._mix_weights,
-                    prior_data=cooccurrence_matrix.data,
-                    prior_indices=cooccurrence_matrix.indices,
-                    prior_indptr=cooccurrence_matrix.indptr,
-                )
-            )
-        return sum(result)
+        return numba_multi_em_cooccurrence_iteration(
+            tokens=token_sequences.tokens,
+            set_indptr=token_sequences.set_indptr,
+            doc_indptr=token_sequences.doc_indptr,
+            n_unique_tokens=len(self.token_label_dictionary_),
+            window_size_array=self._window_len_array,
+            window_reversals=self._window_reversals,
+            kernel_functions=self._kernel_functions,
+            kernel_args=self._full_kernel_args,
+            mix_weights=self._mix_weights,
+            prior_data=cooccurrence_matrix.data,
+            prior_indices=cooccurrence_matrix.indices,
+            prior_indptr=cooccurrence_matrix.indptr,
+        )
 
     def _build_skip_grams(self, token_sequences):
         # call the numba function for returning the list of CooArrays
         return numba_build_multi_skip_grams(
-            token_sequences=token_sequences,
+            tokens=token_sequences.tokens,
+            set_indptr=token_sequences.set_indptr,
+            doc_indptr=token_sequences.doc_indptr,
             window_size_array=self._window_len_array,
             window_reversals=self._window_reversals,
             kernel_functions=self._kernel_functions,
@@ -471,43 +581,32 @@ class MultiSetCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
             array_lengths=self._coo_sizes,
         )
 
-    def _build_coo(self, token_sequences):
-        result = []
-        for seq in token_sequences:
-            coo_data = self._build_skip_grams(seq)
-            result.append(
-                scipy.sparse.coo_matrix(
-                    (
-                        np.hstack([coo.val[: coo.ind[0]] for coo in coo_data]),
-                        (
-                            np.hstack([coo.row[: coo.ind[0]] for coo in coo_data]),
-                            np.hstack([coo.col[: coo.ind[0]] for coo in coo_data]),
-                        ),
-                    ),
-                    shape=(
-                        self._n_rows,
-                        len(self.token_label_dictionary_) * self._n_wide,
-                    ),
-                    dtype=np.float32,
-                )
-            )
-        return sum(result)
-
     def _get_default_kernel_functions(self):
         return _MULTI_KERNEL_FUNCTIONS
 
+    def _n_total_tokens(self, token_sequences):
+        return token_sequences.tokens.shape[0]
+
+    def _sequence_chunk(self, token_sequences, chunk_start, chunk_end):
+        # Chunks share the token and multiset buffers; only the document offsets
+        # are sliced (as a view), so nothing is copied per thread.
+        return MultiSetSequences(
+            token_sequences.tokens,
+            token_sequences.set_indptr,
+            token_sequences.doc_indptr[chunk_start : chunk_end + 1],
+        )
+
     def _generate_chunk_boundaries(self, data, n_threads):
-        token_list_sizes = np.array([sum([len(x) for x in seq]) for seq in data])
-        cumulative_sizes = np.cumsum(token_list_sizes)
+        n_docs = data.doc_indptr.shape[0] - 1
+        cumulative_sizes = (
+            data.set_indptr[data.doc_indptr[1:]] - data.set_indptr[data.doc_indptr[0]]
+        )
+        if n_docs == 0 or cumulative_sizes[-1] == 0:
+            return [(0, n_docs)]
         chunk_size = np.ceil(cumulative_sizes[-1] / n_threads)
-        chunks = []
-        last_chunk_end = 0
-        last_chunk_cumulative_size = 0
-        for chunk_index, size in enumerate(cumulative_sizes):
-            if size - last_chunk_cumulative_size >= chunk_size:
-                chunks.append((last_chunk_end, chunk_index))
-                last_chunk_end = chunk_index
-                last_chunk_cumulative_size = size
-
-        chunks.append((last_chunk_end, len(data)))
-        return chunks
+        chunk_ends = np.searchsorted(
+            cumulative_sizes, chunk_size * np.arange(1, n_threads), side="left"
+        )
+        boundaries = np.unique(np.hstack([[0], chunk_ends + 1, [n_docs]]))
+        boundaries = boundaries[boundaries <= n_docs]
+        return list(zip(boundaries[:-1], boundaries[1:]))
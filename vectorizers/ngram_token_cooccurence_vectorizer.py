@@ -21,9 +21,20 @@ from .coo_utils import (
 )
 import numpy as np
 import numba
+from numba.np.numpy_support import as_dtype
 from ._window_kernels import window_at_index
 
 
+@numba.njit()
+def _ngram_dictionary_to_arrays(ngram_dictionary, ngrams, indices):
+    # Copy the keys and values of a typed n-gram dictionary into arrays; reading
+    # them from Python would box each key as an int64 tuple and re-type it on lookup
+    for i, (ngram, index) in enumerate(ngram_dictionary.items()):
+        for j in range(ngrams.shape[1]):
+            ngrams[i, j] = ngram[j]
+        indices[i] = index
+
+
 @numba.njit(nogil=True)
 def numba_build_skip_grams(
     token_sequences,
@@ -53,7 +64,7 @@ def numba_build_skip_grams(
     n_unique_tokens: int
         The number of unique tokens in the token_dictionary.
 
-    window_size_array: numpy.ndarray(float, size = (n_windows, n_unique_tokens))
+    window_size_array: numpy.ndarray(uint16, size = (n_unique_tokens, n_windows))
         A collection of window sizes per vocabulary index per window function
 
     window_reversals: numpy.array(bool, size = (n_windows,))
@@ -89,7 +100,7 @@ def numba_build_skip_grams(
         Weight counts of values (kernel weighted counts) that token_head[i] cooccurred with token_tail[i]
     """
 
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     array_mul = n_windows * n_unique_tokens + 1
     window_reversal_const = np.zeros(len(window_reversals)).astype(np.int32)
     window_reversal_const[window_reversals] = 1
@@ -113,7 +124,7 @@ def numba_build_skip_grams(
                 windows = [
                     window_at_index(
                         seq,
-                        window_size_array[i][target_gram_ind],
+                        window_size_array[target_gram_ind, i],
                         w_i - window_reversal_const[i] * (ngram_size - 1),
                         reverse=window_reversals[i],
                     )
@@ -177,7 +188,7 @@ def numba_em_cooccurrence_iteration(
     token_sequences: Iterable of Iterables
         The collection of token sequences to generate skip-gram data for.
 
-    window_size_array : numpy.ndarray of shape(n, n_vocab)
+    window_size_array : numpy.ndarray of shape(n_vocab, n)
         The collection of window sizes per token per directed cooccurrence
 
     window_reversals: numpy.array(bool)
@@ -221,7 +232,7 @@ def numba_em_cooccurrence_iteration(
     """
 
     posterior_data = np.zeros_like(prior_data)
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     window_reversal_const = np.zeros(len(window_reversals)).astype(np.int32)
     window_reversal_const[window_reversals] = 1
 
@@ -233,7 +244,7 @@ def numba_em_cooccurrence_iteration(
                 windows = [
                     window_at_index(
                         seq,
-                        window_size_array[i][target_gram_ind],
+                        window_size_array[target_gram_ind, i],
                         w_i - window_reversal_const[i] * (ngram_size - 1),
                         reverse=window_reversals[i],
                     )
@@ -364,8 +375,10 @@ class NgramCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         When processing token sequences to build the matrix, break the list of sequences into
         n_threads equal sized chunks to process in parallel with Dask.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the
@@ -552,7 +565,7 @@ class NgramCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
     def _set_mask_indices(self):
         if self.nullify_mask:
             self._mask_index = np.int32(len(self._token_frequencies_))
-            mask_ngram = tuple(self._mask_index * np.ones(self.ngram_size))
+            mask_ngram = (self._mask_index,) * self.ngram_size
             if mask_ngram in self._raw_ngram_dictionary_:
                 self._mask_ngram_index = self._raw_ngram_dictionary_[mask_ngram]
             else:
@@ -561,18 +574,34 @@ class NgramCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
             self._mask_index = None
             self._mask_ngram_index = None
 
-    def _set_window_len_array(self):
-        window_array = []
-        for i, win_fn in enumerate(self._window_functions):
-            window_array.append(
-                win_fn(
-                    self._window_radii[i],
-                    self._ngram_frequencies,
-                    self._mask_ngram_index,
-                    *self._window_args[i],
-                )
-            )
-        self._window_len_array = np.array(window_array)
+    def _window_row_frequencies(self):
+        return self._ngram_frequencies, self._mask_ngram_index
 
     def _set_additional_params(self, token_sequences):
         self._array_to_tuple = make_tuple_converter(self.ngram_size)
+
+    def _get_persistent_state(self):
+        state = super()._get_persistent_state()
+        dict_type = self._raw_ngram_dictionary_._dict_type
+        ngrams = np.empty(
+            (len(self._raw_ngram_dictionary_), self.ngram_size),
+            dtype=as_dtype(dict_type.key_type.dtype),
+        )
+        indices = np.empty(
+            len(self._raw_ngram_dictionary_), dtype=as_dtype(dict_type.value_type)
+        )
+        _ngram_dictionary_to_arrays(self._raw_ngram_dictionary_, ngrams, indices)
+        state["_raw_ngram_dictionary_"] = (ngrams, indices)
+        state.pop("_array_to_tuple", None)
+        return state
+
+    def _set_persistent_state(self, state):
+        # Rebuild the keys and values with the integer types they had at fit time
+        ngrams, indices = state.pop("_raw_ngram_dictionary_")
+        raw_ngram_dictionary = numba.typed.Dict()
+        raw_ngram_dictionary.update(
+            {tuple(ngram): index for ngram, index in zip(ngrams, indices)}
+        )
+        state["_raw_ngram_dictionary_"] = raw_ngram_dictionary
+        super()._set_persistent_state(state)
+        self._array_to_tuple = make_tuple_converter(self.ngram_size)
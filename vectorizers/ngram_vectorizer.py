@@ -1,5 +1,6 @@
 import numpy as np
 import numba
+import dask
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils.validation import check_is_fitted
@@ -8,16 +9,14 @@ import scipy.linalg
 import scipy.stats
 import scipy.sparse
 
-from .utils import (
-    flatten,
-    validate_homogeneous_token_types,
-)
+from .utils import validate_token_data
 
 from .preprocessing import (
     prune_token_dictionary,
-    construct_token_dictionary_and_frequency,
-    construct_document_frequency,
+    frequency_bounds,
+    select_top_k,
     preprocess_token_sequences,
+    EncodedCorpus,
 )
 
 
@@ -60,6 +59,353 @@ def ngrams_of(sequence, ngram_size, ngram_behaviour="exact"):
     return result
 
 
+@numba.njit(nogil=True)
+def learn_ngrams(codes, indptr, ngram_size, subgrams, n_tokens):
+    """Find the distinct n-grams of a flat collection of encoded sequences, in order
+    of first appearance. N-grams are found by walking a trie keyed by
+    ``node * n_tokens + code``, so each n-gram costs ngram_size dictionary lookups
+    regardless of the vocabulary size.
+
+    Parameters
+    ----------
+    codes: array of shape (n_total_tokens,)
+        The token codes of all sequences concatenated.
+
+    indptr: array of shape (n_sequences + 1,)
+        The boundaries of the sequences in codes.
+
+    ngram_size: int
+        The size of n-grams to find.
+
+    subgrams: bool
+        Whether to find all n-grams of size up to ngram_size rather than exactly
+        ngram_size.
+
+    n_tokens: int
+        The number of distinct token codes.
+
+    Returns
+    -------
+    positions: array of shape (n_ngrams,)
+        The position in codes of the first occurrence of each n-gram.
+
+    lengths: array of shape (n_ngrams,)
+        The size of each n-gram.
+
+    counts: array of shape (n_ngrams,)
+        The number of occurrences of each n-gram.
+
+    document_counts: array of shape (n_ngrams,)
+        The number of sequences each n-gram occurs in.
+    """
+    trie = numba.typed.Dict.empty(numba.types.int64, numba.types.int64)
+    node_ngram = [-1]
+    # Empty integer lists; slicing lets numba infer the element type
+    positions = [0][:0]
+    lengths = [0][:0]
+    counts = [0][:0]
+    document_counts = [0][:0]
+    last_document = [0][:0]
+    for d in range(indptr.shape[0] - 1):
+        end = indptr[d + 1]
+        for i in range(indptr[d], end):
+            node = 0
+            for j in range(min(ngram_size, end - i)):
+                key = node * n_tokens + codes[i + j]
+                child = trie.get(key, -1)
+                if child < 0:
+                    child = len(node_ngram)
+                    trie[key] = child
+                    node_ngram.append(-1)
+                node = child
+                if subgrams or j == ngram_size - 1:
+                    ngram = node_ngram[node]
+                    if ngram < 0:
+                        ngram = len(counts)
+                        node_ngram[node] = ngram
+                        positions.append(i)
+                        lengths.append(j + 1)
+                        counts.append(0)
+                        document_counts.append(0)
+                        last_document.append(-1)
+                    counts[ngram] += 1
+                    if last_document[ngram] != d:
+                        last_document[ngram] = d
+                        document_counts[ngram] += 1
+
+    return (
+        np.array(positions, dtype=np.int64),
+        np.array(lengths, dtype=np.int64),
+        np.array(counts, dtype=np.int64),
+        np.array(document_counts, dtype=np.int64),
+    )
+
+
+@numba.njit(nogil=True)
+def build_ngram_trie(ngram_codes, ngram_lengths, ngram_columns, n_tokens):
+    """Build the trie used by ngram_count_matrix_data from the token codes of a
+    set of n-grams, one n-gram per row of ngram_codes."""
+    trie = numba.typed.Dict.empty(numba.types.int64, numba.types.int64)
+    node_columns = [-1]
+    for k in range(ngram_codes.shape[0]):
+        node = 0
+        for j in range(ngram_lengths[k]):
+            key = node * n_tokens + ngram_codes[k, j]
+            child = trie.get(key, -1)
+            if child < 0:
+                child = len(node_columns)
+                trie[key] = child
+                node_columns.append(-1)
+            node = child
+        node_columns[node] = ngram_columns[k]
+    return trie, np.array(node_columns, dtype=np.int64)
+
+
+_GOLDEN_RATIO = np.uint64(0x9E3779B97F4A7C15)
+_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+
+
+@numba.njit(nogil=True)
+def _compress_row_counts(indices, data, start, n_found):
+    # Sort the n_found columns emitted for a row at indices[start:], collapse
+    # repeats into counts in data, and return the end of the compressed row
+    found = np.sort(indices[start : start + n_found])
+    end = start
+    for m in range(n_found):
+        if m == 0 or found[m] != found[m - 1]:
+            indices[end] = found[m]
+            data[end] = 1
+            end += 1
+        else:
+            data[end - 1] += 1
+    return end
+
+
+@numba.njit(nogil=True)
+def ngram_count_matrix_data(
+    codes, indptr, ngram_size, subgrams, n_tokens, trie, node_columns, skip_column
+):
+    """Count the n-grams of a flat collection of encoded sequences directly into the
+    indptr, indices and data arrays of a CSR matrix with one row per sequence,
+    with the columns of each row sorted. N-grams not in the trie, and n-grams
+    of column skip_column, are not counted.
+
+    Parameters
+    ----------
+    codes: array of shape (n_total_tokens,)
+        The token codes of all sequences concatenated.
+
+    indptr: array of shape (n_sequences + 1,)
+        The boundaries of the sequences in codes.
+
+    ngram_size: int
+        The size of n-grams to count.
+
+    subgrams: bool
+        Whether to count all n-grams of size up to ngram_size rather than exactly
+        ngram_size.
+
+    n_tokens: int
+        The number of distinct token codes.
+
+    trie: numba.typed.Dict
+        The trie of n-grams to count, as built by build_ngram_trie.
+
+    node_columns: array
+        The column of each trie node, or -1 for nodes that are not n-grams.
+
+    skip_column: int
+        A column that is not counted, or -1.
+
+    Returns
+    -------
+    indptr, indices, data: arrays
+        The CSR arrays of the count matrix.
+    """
+    n_sequences = indptr.shape[0] - 1
+    result_indptr = np.zeros(n_sequences + 1, dtype=np.int64)
+    capacity = codes.shape[0] * (ngram_size if subgrams else 1)
+    indices = np.empty(capacity, dtype=np.int32)
+    data = np.zeros(capacity, dtype=np.int32)
+    nnz = 0
+    for d in range(n_sequences):
+        end = indptr[d + 1]
+        n_found = 0
+        for i in range(indptr[d], end):
+            node = 0
+            for j in range(min(ngram_size, end - i)):
+                key = node * n_tokens + codes[i + j]
+                if key not in trie:
+                    break
+                node = trie[key]
+                if subgrams or j == ngram_size - 1:
+                    column = node_columns[node]
+                    if column >= 0 and column != skip_column:
+                        indices[nnz + n_found] = column
+                        n_found += 1
+
+        nnz = _compress_row_counts(indices, data, nnz, n_found)
+        result_indptr[d + 1] = nnz
+
+    return result_indptr, indices[:nnz].copy(), data[:nnz].copy()
+
+
+@numba.njit(nogil=True)
+def _hash_step(h, code):
+    # Combine a token code into a running 64 bit n-gram hash
+    return (h ^ (np.uint64(code) + _GOLDEN_RATIO)) * _MULTIPLIER_1
+
+
+@numba.njit(nogil=True)
+def _hash_finalize(h):
+    # The splitmix64 finalizer, mixing all bits of the running hash
+    h = (h ^ (h >> np.uint64(30))) * _MULTIPLIER_1
+    h = (h ^ (h >> np.uint64(27))) * _MULTIPLIER_2
+    return h ^ (h >> np.uint64(31))
+
+
+@numba.njit(nogil=True)
+def hash_ngram(ngram, n_features, seed=0):
+    """The column of an n-gram of token codes under hashed_ngram_count_matrix_data."""
+    h = np.uint64(seed)
+    for code in ngram:
+        h = _hash_step(h, code)
+    return np.int64(_hash_finalize(h) % np.uint64(n_features))
+
+
+@numba.njit(nogil=True)
+def hashed_ngram_count_matrix_data(
+    codes, indptr, ngram_size, subgrams, n_features, seed, skip_column
+):
+    """Count the n-grams of a flat collection of encoded sequences into the CSR
+    arrays of a matrix with n_features columns, the column of each n-gram being
+    a seeded hash of its token codes. Columns of each row are sorted, and
+    n-grams hashing to column skip_column are not counted.
+
+    Parameters
+    ----------
+    codes: array of shape (n_total_tokens,)
+        The token codes of all sequences concatenated.
+
+    indptr: array of shape (n_sequences + 1,)
+        The boundaries of the sequences in codes.
+
+    ngram_size: int
+        The size of n-grams to count.
+
+    subgrams: bool
+        Whether to count all n-grams of size up to ngram_size rather than exactly
+        ngram_size.
+
+    n_features: int
+        The number of columns to hash n-grams into.
+
+    seed: int
+        The seed of the hash function.
+
+    skip_column: int
+        A column that is not counted, or -1.
+
+    Returns
+    -------
+    indptr, indices, data: arrays
+        The CSR arrays of the count matrix.
+    """
+    n_sequences = indptr.shape[0] - 1
+    result_indptr = np.zeros(n_sequences + 1, dtype=np.int64)
+    capacity = codes.shape[0] * (ngram_size if subgrams else 1)
+    indices = np.empty(capacity, dtype=np.int32)
+    data = np.zeros(capacity, dtype=np.int32)
+    modulus = np.uint64(n_features)
+    nnz = 0
+    for d in range(n_sequences):
+        end = indptr[d + 1]
+        n_found = 0
+        for i in range(indptr[d], end):
+            h = np.uint64(seed)
+            for j in range(min(ngram_size, end - i)):
+                h = _hash_step(h, codes[i + j])
+                if subgrams or j == ngram_size - 1:
+                    column = np.int64(_hash_finalize(h) % modulus)
+                    if column != skip_column:
+                        indices[nnz + n_found] = column
+                        n_found += 1
+
+        nnz = _compress_row_counts(indices, data, nnz, n_found)
+        result_indptr[d + 1] = nnz
+
+    return result_indptr, indices[:nnz].copy(), data[:nnz].copy()
+
+
+def parallel_ngram_count_matrix_data(codes, indptr, kernel, kernel_args, n_threads=1):
+    """Count the n-grams of a flat collection of encoded sequences with a counting
+    kernel, splitting the sequences into n_threads chunks of roughly equal
+    numbers of tokens that are counted in parallel with Dask. The per-chunk CSR
+    arrays are stitched together with offsets, so the result is identical to
+    that of a single kernel call.
+
+    Parameters
+    ----------
+    codes: array of shape (n_total_tokens,)
+        The token codes of all sequences concatenated.
+
+    indptr: array of shape (n_sequences + 1,)
+        The boundaries of the sequences in codes.
+
+    kernel: function
+        The counting kernel, either ngram_count_matrix_data or
+        hashed_ngram_count_matrix_data.
+
+    kernel_args: tuple
+        The arguments of the kernel following codes and indptr.
+
+    n_threads: int (optional, default=1)
+        The number of chunks to count in parallel.
+
+    Returns
+    -------
+    indptr, indices, data: arrays
+        The CSR arrays of the count matrix.
+    """
+    n_sequences = indptr.shape[0] - 1
+    if n_threads <= 1 or n_sequences < 2:
+        return kernel(codes, indptr, *kernel_args)
+
+    chunk_boundaries = np.unique(
+        np.concatenate(
+            (
+                [0],
+                np.searchsorted(
+                    indptr, np.linspace(0, indptr[-1], n_threads + 1)[1:-1]
+                ),
+                [n_sequences],
+            )
+        )
+    )
+    chunks = [
+        dask.delayed(kernel)(
+            codes[indptr[start] : indptr[end]],
+            indptr[start : end + 1] - indptr[start],
+            *kernel_args,
+        )
+        for start, end in zip(chunk_boundaries[:-1], chunk_boundaries[1:])
+    ]
+    chunk_results = dask.compute(*chunks)
+
+    offsets = np.cumsum([0] + [chunk_indptr[-1] for chunk_indptr, _, _ in chunk_results])
+    result_indptr = np.concatenate(
+        [[0]]
+        + [
+            chunk_indptr[1:] + offset
+            for (chunk_indptr, _, _), offset in zip(chunk_results, offsets)
+        ]
+    )
+    indices = np.concatenate([chunk_indices for _, chunk_indices, _ in chunk_results])
+    data = np.concatenate([chunk_data for _, _, chunk_data in chunk_results])
+    return result_indptr, indices, data
+
+
 class NgramVectorizer(BaseEstimator, TransformerMixin):
     """Given a sequence, or list of sequences of tokens, produce a
     count matrix of n-grams of successive tokens.  This either produces n-grams for a fixed size or all n-grams
@@ -142,8 +488,30 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
         Sets all cooccurrences with the mask_string equal to zero by skipping over them
         during processing.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
+
+    n_processes: int (optional, default=1)
+        The number of processes to shard the token sequences across when encoding
+        and counting tokens during preprocessing.
+
+    n_threads: int (optional, default=1)
+        When counting n-grams, break the list of sequences into n_threads chunks
+        with roughly equal numbers of tokens to process in parallel with Dask.
+
+    n_features: int or None (optional, default=None)
+        If not None, n-grams are hashed into n_features columns rather than
+        learning an n-gram dictionary, in the manner of sklearn's HashingVectorizer.
+        No n-gram dictionary is built or stored, so column_label_dictionary_ is
+        left empty. For ngram_size > 1 the frequency constraints are applied to
+        the hashed columns, which are masked out if they fail them. The hash is
+        of the n-gram's token codes, so it is specific to the learned token
+        dictionary.
+
+    hash_seed: int (optional, default=0)
+        The seed of the n-gram hash function when n_features is set.
     """
 
     def __init__(
@@ -166,6 +534,10 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
         mask_string=None,
         nullify_mask=False,
         validate_data=True,
+        n_processes=1,
+        n_threads=1,
+        n_features=None,
+        hash_seed=0,
     ):
         self.ngram_size = ngram_size
         self.ngram_behaviour = ngram_behaviour
@@ -185,19 +557,32 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
         self.mask_string = mask_string
         self.nullify_mask = nullify_mask
         self.validate_data = validate_data
+        self.n_processes = n_processes
+        self.n_threads = n_threads
+        self.n_features = n_features
+        self.hash_seed = hash_seed
         self.column_label_dictionary_ = {}
         self.column_index_dictionary_ = {}
         self._mask_index = None
         self._mask_ngram_index = None
+        self._kept_columns = None
+        self._ngram_trie_ = None
+
+    def __getstate__(self):
+        # The n-gram trie is a numba typed dictionary, which cannot be pickled; it is
+        # rebuilt from column_label_dictionary_ on first use instead
+        state = dict(super().__getstate__())
+        state["_ngram_trie_"] = None
+        return state
 
     def fit(self, X, y=None, **fit_params):
 
-        if self.validate_data:
-            validate_homogeneous_token_types(X)
+        if not isinstance(X, EncodedCorpus):
+            validate_token_data(X, self.validate_data)
 
         # noinspection PyTupleAssignmentBalance
         (
-            token_sequences,
+            (codes, indptr),
             self._token_dictionary_,
             self._inverse_token_dictionary_,
             self._token_frequencies_,
@@ -216,25 +601,54 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
             ignored_tokens=self.excluded_tokens,
             excluded_token_regex=self.excluded_token_regex,
             masking=self.mask_string,
+            n_processes=self.n_processes,
+            flat=True,
         )
 
-        ngrams = [
-            list(map(tuple, ngrams_of(sequence, self.ngram_size, self.ngram_behaviour)))
-            for sequence in token_sequences
-        ]
+        if self.ngram_behaviour not in ("exact", "subgrams"):
+            raise ValueError("Unrecognized ngram_behaviour!")
+
+        self._kept_columns = None
+        self._ngram_trie_ = None
+        if self.n_features is not None:
+            return self._fit_hashed(codes, indptr)
 
         if self.ngram_dictionary is not None:
             self.column_label_dictionary_ = self.ngram_dictionary
         elif self.ngram_size == 1:
             self.column_label_dictionary_ = self._token_dictionary_
         else:
-            (
-                raw_ngram_dictionary,
-                ngram_frequencies,
-                total_ngrams,
-            ) = construct_token_dictionary_and_frequency(
-                flatten(ngrams), token_dictionary=None
+            positions, lengths, ngram_counts, ngram_document_counts = learn_ngrams(
+                codes,
+                indptr,
+                self.ngram_size,
+                self.ngram_behaviour == "subgrams",
+                len(self._token_dictionary_),
             )
+            # Order the n-grams by their token codes, and so by their tokens, rather
+            # than by first appearance; padding with -1 puts subgrams before the
+            # n-grams they prefix
+            padded_ngrams = np.full((positions.shape[0], self.ngram_size), -1)
+            for j in range(self.ngram_size):
+                present = lengths > j
+                padded_ngrams[present, j] = codes[positions[present] + j]
+            order = np.lexsort(padded_ngrams.T[::-1])
+            positions = positions[order]
+            lengths = lengths[order]
+            ngram_counts = ngram_counts[order]
+            ngram_document_counts = ngram_document_counts[order]
+            # Label n-grams by their tokens; unigrams are labelled by the bare token
+            inverse_token_dictionary = self._inverse_token_dictionary_
+            raw_ngram_dictionary = {}
+            for position, length in zip(positions.tolist(), lengths.tolist()):
+                ngram = codes[position : position + length].tolist()
+                if length == 1:
+                    label = inverse_token_dictionary[ngram[0]]
+                else:
+                    label = tuple(inverse_token_dictionary[code] for code in ngram)
+                raw_ngram_dictionary[label] = len(raw_ngram_dictionary)
+            total_ngrams = ngram_counts.sum()
+            ngram_frequencies = ngram_counts.astype(np.float32) / total_ngrams
 
             if {
                 self.min_document_frequency,
@@ -242,9 +656,7 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
                 self.max_document_frequency,
                 self.max_document_occurrences,
             } != {None}:
-                ngram_doc_frequencies = construct_document_frequency(
-                    ngrams, raw_ngram_dictionary
-                )
+                ngram_doc_frequencies = ngram_document_counts / (indptr.shape[0] - 1)
             else:
                 ngram_doc_frequencies = np.array([])
 
@@ -262,7 +674,7 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
                 min_document_occurrences=self.min_document_occurrences,
                 max_document_occurrences=self.max_document_occurrences,
                 total_tokens=total_ngrams,
-                total_documents=len(token_sequences),
+                total_documents=indptr.shape[0] - 1,
             )
 
             self.column_label_dictionary_ = raw_ngram_dictionary
@@ -271,57 +683,188 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
             index: token for token, index in self.column_label_dictionary_.items()
         }
 
-        if self.nullify_mask:
+        self._mask_ngram_index = None
+        if self.nullify_mask and self.mask_string is not None:
             self._mask_index = np.int32(len(self._token_frequencies_))
-            mask_ngram = tuple(self._mask_index * np.ones(self.ngram_size))
-            if mask_ngram in self.column_label_dictionary_:
-                self._mask_ngram_index = self.column_label_dictionary_[mask_ngram]
-
-        indptr = [0]
-        indices = []
-        data = []
-        for sequence in ngrams:
-            counter = {}
-            for index_gram in sequence:
-                try:
-                    if len(index_gram) == 1:
-                        token_gram = self._inverse_token_dictionary_[index_gram[0]]
-                    else:
-                        token_gram = tuple(
-                            self._inverse_token_dictionary_[index]
-                            for index in index_gram
-                        )
-                    col_index = self.column_label_dictionary_[token_gram]
-                    if not (self.nullify_mask and col_index is self._mask_ngram_index):
-                        if col_index in counter:
-                            counter[col_index] += 1
-                        else:
-                            counter[col_index] = 1
-                except KeyError:
-                    # Out of predefined ngrams; drop
-                    continue
-
-            indptr.append(indptr[-1] + len(counter))
-            indices.extend(counter.keys())
-            data.extend(counter.values())
+            mask_ngram = (
+                self.mask_string
+                if self.ngram_size == 1
+                else (self.mask_string,) * self.ngram_size
+            )
+            self._mask_ngram_index = self.column_label_dictionary_.get(mask_ngram)
+
+        self._train_matrix = self._count_matrix(codes, indptr)
+
+        return self
+
+    def _fit_hashed(self, codes, indptr):
+        if self.ngram_dictionary is not None:
+            raise ValueError("An ngram_dictionary cannot be used with n_features")
+        if not 0 < self.n_features <= np.iinfo(np.int32).max:
+            raise ValueError("n_features must be a positive integer less than 2**31")
+
+        self.column_label_dictionary_ = {}
+        self.column_index_dictionary_ = {}
 
+        self._mask_ngram_index = None
+        if self.nullify_mask and self.mask_string is not None:
+            self._mask_index = np.int32(len(self._token_frequencies_))
+            self._mask_ngram_index = hash_ngram(
+                np.full(self.ngram_size, self._mask_index, dtype=np.int32),
+                self.n_features,
+                self.hash_seed,
+            )
+
+        self._train_matrix = self._count_matrix(codes, indptr)
+
+        if self.ngram_size > 1 and {
+            self.max_unique_tokens,
+            self.min_occurrences,
+            self.max_occurrences,
+            self.min_frequency,
+            self.max_frequency,
+            self.min_document_occurrences,
+            self.max_document_occurrences,
+            self.min_document_frequency,
+            self.max_document_frequency,
+        } != {None}:
+            # Prune the hashed columns as the n-gram dictionary would be pruned;
+            # columns that never occurred in training are dropped like unseen n-grams
+            columns, column_positions, column_doc_counts = np.unique(
+                self._train_matrix.indices, return_inverse=True, return_counts=True
+            )
+            column_counts = np.bincount(
+                column_positions.ravel(),
+                weights=self._train_matrix.data,
+                minlength=columns.shape[0],
+            )
+            total_ngrams = column_counts.sum()
+            n_documents = self._train_matrix.shape[0]
+            (
+                min_frequency,
+                max_frequency,
+                min_document_frequency,
+                max_document_frequency,
+            ) = frequency_bounds(
+                min_frequency=self.min_frequency,
+                max_frequency=self.max_frequency,
+                min_occurrences=self.min_occurrences,
+                max_occurrences=self.max_occurrences,
+                min_document_frequency=self.min_document_frequency,
+                max_document_frequency=self.max_document_frequency,
+                min_document_occurrences=self.min_document_occurrences,
+                max_document_occurrences=self.max_document_occurrences,
+                total_tokens=total_ngrams,
+                total_documents=n_documents,
+            )
+            column_frequencies = column_counts / total_ngrams
+            column_doc_frequencies = column_doc_counts / n_documents
+            keep = (
+                (column_frequencies >= min_frequency)
+                & (column_frequencies <= max_frequency)
+                & (column_doc_frequencies >= min_document_frequency)
+                & (column_doc_frequencies <= max_document_frequency)
+            )
+            kept_columns = columns[keep]
+            if self.max_unique_tokens is not None:
+                kept_columns = kept_columns[
+                    select_top_k(column_frequencies[keep], self.max_unique_tokens)
+                ]
+
+            self._kept_columns = kept_columns
+            self._train_matrix = self._mask_columns(self._train_matrix)
+
+        return self
+
+    def _mask_columns(self, matrix):
+        # Zero and drop the entries of columns that were pruned in fit
+        matrix.data *= np.isin(matrix.indices, self._kept_columns)
+        matrix.eliminate_zeros()
+        return matrix
+
+    def _count_matrix(self, codes, indptr):
+        if self.n_features is not None:
+            indptr, indices, data = parallel_ngram_count_matrix_data(
+                codes,
+                indptr,
+                hashed_ngram_count_matrix_data,
+                (
+                    self.ngram_size,
+                    self.ngram_behaviour == "subgrams",
+                    self.n_features,
+                    self.hash_seed,
+                    -1 if self._mask_ngram_index is None else self._mask_ngram_index,
+                ),
+                n_threads=self.n_threads,
+            )
+            return self._csr_count_matrix(indptr, indices, data, self.n_features)
+
+        trie, node_columns = self._ngram_trie()
+        indptr, indices, data = parallel_ngram_count_matrix_data(
+            codes,
+            indptr,
+            ngram_count_matrix_data,
+            (
+                self.ngram_size,
+                self.ngram_behaviour == "subgrams",
+                len(self._token_dictionary_),
+                trie,
+                node_columns,
+                -1 if self._mask_ngram_index is None else self._mask_ngram_index,
+            ),
+            n_threads=self.n_threads,
+        )
+        return self._csr_count_matrix(
+            indptr, indices, data, len(self.column_label_dictionary_)
+        )
+
+    def _ngram_trie(self):
+        # The trie matching the columns is built once per fit, and rebuilt only if it
+        # was dropped when the model was pickled
+        if getattr(self, "_ngram_trie_", None) is not None:
+            return self._ngram_trie_
+
+        # Encode the column labels as token codes, dropping any n-gram with a token
+        # outside the token dictionary as it can never be matched
+        ngram_size = max(self.ngram_size, 1)
+        n_columns = len(self.column_label_dictionary_)
+        ngram_codes = np.zeros((n_columns, ngram_size), dtype=np.int64)
+        ngram_lengths = np.zeros(n_columns, dtype=np.int64)
+        ngram_columns = np.zeros(n_columns, dtype=np.int64)
+        n_ngrams = 0
+        for ngram, column in self.column_label_dictionary_.items():
+            if self.ngram_size == 1 or not isinstance(ngram, tuple):
+                ngram = (ngram,)
+            ngram = [self._token_dictionary_.get(token, -1) for token in ngram]
+            if len(ngram) > ngram_size or -1 in ngram:
+                continue
+            ngram_codes[n_ngrams, : len(ngram)] = ngram
+            ngram_lengths[n_ngrams] = len(ngram)
+            ngram_columns[n_ngrams] = column
+            n_ngrams += 1
+
+        self._ngram_trie_ = build_ngram_trie(
+            ngram_codes[:n_ngrams],
+            ngram_lengths[:n_ngrams],
+            ngram_columns[:n_ngrams],
+            len(self._token_dictionary_),
+        )
+        return self._ngram_trie_
+
+    def _csr_count_matrix(self, indptr, indices, data, n_columns):
         if indptr[-1] > np.iinfo(np.int32).max:  # = 2**31 - 1
             indices_dtype = np.int64
         else:
             indices_dtype = np.int32
 
-        indices = np.asarray(indices, dtype=indices_dtype)
-        indptr = np.asarray(indptr, dtype=indices_dtype)
-        data = np.asarray(data, dtype=np.intc)
-
-        self._train_matrix = scipy.sparse.csr_matrix(
-            (data, indices, indptr),
-            shape=(len(indptr) - 1, len(self.column_label_dictionary_)),
+        result = scipy.sparse.csr_matrix(
+            (data, indices.astype(indices_dtype), indptr.astype(indices_dtype)),
+            shape=(len(indptr) - 1, n_columns),
             dtype=np.float32,
         )
-        self._train_matrix.sort_indices()
-
-        return self
+        if self._kept_columns is not None:
+            result = self._mask_columns(result)
+        return result
 
     def fit_transform(self, X, y=None, **fit_params):
         self.fit(X, y, **fit_params)
@@ -337,56 +880,11 @@ class NgramVectorizer(BaseEstimator, TransformerMixin):
             ],
         )
         # noinspection PyTupleAssignmentBalance
-        (token_sequences, _, _, _) = preprocess_token_sequences(
+        ((codes, indptr), _, _, _) = preprocess_token_sequences(
             X,
             self._token_dictionary_,
+            n_processes=self.n_processes,
+            flat=True,
         )
 
-        indptr = [0]
-        indices = []
-        data = []
-
-        for sequence in token_sequences:
-            counter = {}
-            numba_sequence = np.array(sequence)
-            for index_gram in ngrams_of(
-                numba_sequence, self.ngram_size, self.ngram_behaviour
-            ):
-                try:
-                    if len(index_gram) == 1:
-                        token_gram = self._inverse_token_dictionary_[index_gram[0]]
-                    else:
-                        token_gram = tuple(
-                            self._inverse_token_dictionary_[index]
-                            for index in index_gram
-                        )
-                    col_index = self.column_label_dictionary_[token_gram]
-                    if not (self.nullify_mask and col_index is self._mask_ngram_index):
-                        if col_index in counter:
-                            counter[col_index] += 1
-                        else:
-                            counter[col_index] = 1
-                except KeyError:
-                    # Out of predefined ngrams; drop
-                    continue
-
-            indptr.append(indptr[-1] + len(counter))
-            indices.extend(counter.keys())
-            data.extend(counter.values())
-
-        if indptr[-1] > np.iinfo(np.int32).max:  # = 2**31 - 1
-            indices_dtype = np.int64
-        else:
-            indices_dtype = np.int32
-        indices = np.asarray(indices, dtype=indices_dtype)
-        indptr = np.asarray(indptr, dtype=indices_dtype)
-        data = np.asarray(data, dtype=np.intc)
-
-        result = scipy.sparse.csr_matrix(
-            (data, indices, indptr),
-            shape=(len(indptr) - 1, len(self.column_label_dictionary_)),
-            dtype=np.float32,
-        )
-        result.sort_indices()
-
-        return result
+        return self._count_matrix(codes, indptr)
@@ -2,12 +2,36 @@
 This is a module to be used as a reference for building other modules
 """
 import numpy as np
+import numba
+import dask
 from numba.typed import List
 import scipy.linalg
 import scipy.stats
 import scipy.sparse
 import re
-from .utils import flatten, full_flatten, semi_flatten
+import threading
+import itertools
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from .utils import validate_token_data
+
+
+def _document_frequency(codes, lengths, n_tokens):
+    # Build the (document, token) incidence matrix of the encoded documents, with
+    # duplicate pairs collapsed, and count the documents each token occurs in
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    known = codes >= 0
+    if not np.all(known):
+        indptr = np.concatenate(([0], np.cumsum(known)))[indptr]
+        codes = codes[known]
+    incidence = scipy.sparse.csr_matrix(
+        (np.ones(codes.shape[0], dtype=np.int8), codes, indptr),
+        shape=(lengths.shape[0], max(n_tokens, codes.max(initial=-1) + 1)),
+        copy=True,
+    )
+    incidence.sum_duplicates()
+    return np.bincount(incidence.indices, minlength=n_tokens)
 
 
 def construct_document_frequency(token_by_doc_sequence, token_dictionary):
@@ -26,15 +50,11 @@ def construct_document_frequency(token_by_doc_sequence, token_dictionary):
     document_frequency: np.array
         The document frequency of tokens ordered by token_dictionary
     """
-
-    n_tokens = len(token_dictionary)
-    doc_freq = np.zeros(n_tokens)
-    for doc in token_by_doc_sequence:
-        doc_freq += np.bincount(
-            [token_dictionary[token] for token in set(doc)], minlength=n_tokens
-        )
-
-    return doc_freq / len(token_by_doc_sequence)
+    codes, lengths, _, _, _ = encode_token_sequences(
+        token_by_doc_sequence, token_dictionary
+    )
+    doc_counts = _document_frequency(codes, lengths, len(token_dictionary))
+    return doc_counts / len(token_by_doc_sequence)
 
 
 def construct_timed_document_frequency(token_by_doc_sequence, token_dictionary):
@@ -43,7 +63,7 @@ def construct_timed_document_frequency(token_by_doc_sequence, token_dictionary):
     Parameters
     ----------
     token_by_doc_sequence: Iterable
-        A sequence of sequences of tokens
+        A sequence of sequences of (token, timestamp) pairs
 
     token_dictionary: dictionary
         A fixed dictionary providing the mapping of tokens to indices
@@ -53,15 +73,427 @@ def construct_timed_document_frequency(token_by_doc_sequence, token_dictionary):
     document_frequency: np.array
         The document frequency of tokens ordered by token_dictionary
     """
+    codes, lengths, _, _, _ = encode_token_sequences(
+        ([pair[0] for pair in doc] for doc in token_by_doc_sequence),
+        token_dictionary,
+    )
+    doc_counts = _document_frequency(codes, lengths, len(token_dictionary))
+    return doc_counts / len(token_by_doc_sequence)
+
+
+def _encode_sequence(sequence, token_dictionary, learn):
+    # Encode the tokens of one sequence through token_dictionary, adding unseen
+    # tokens to it if learn is True, else coding them as -1
+    if isinstance(sequence, np.ndarray) and sequence.dtype.kind in "iuU":
+        unique_tokens, inverse = np.unique(sequence, return_inverse=True)
+        if learn:
+            unique_codes = [
+                token_dictionary.setdefault(token, len(token_dictionary))
+                for token in unique_tokens.tolist()
+            ]
+        else:
+            unique_codes = [
+                token_dictionary.get(token, -1) for token in unique_tokens.tolist()
+            ]
+        return np.array(unique_codes, dtype=np.int32)[inverse.ravel()]
+
+    if learn:
+        return np.fromiter(
+            (
+                token_dictionary.setdefault(token, len(token_dictionary))
+                for token in sequence
+            ),
+            dtype=np.int32,
+            count=len(sequence),
+        )
+    return np.fromiter(
+        (token_dictionary.get(token, -1) for token in sequence),
+        dtype=np.int32,
+        count=len(sequence),
+    )
+
+
+def _grow(array, size):
+    # Return an array of at least the given size holding the contents of array,
+    # growing the capacity geometrically
+    if size <= array.shape[0]:
+        return array
+    result = np.zeros(max(size, 2 * array.shape[0]), dtype=array.dtype)
+    result[: array.shape[0]] = array
+    return result
+
+
+def encode_token_sequences(
+    token_sequences, token_dictionary=None, document_counts=False
+):
+    """Encode a collection of token sequences as integer codes, hashing each token
+    only once. This streams over the sequences a single time, so apart from the
+    int32 codes themselves the memory used is proportional to the vocabulary
+    rather than to the corpus. If no token_dictionary is given one is built with
+    token indices in sorted token order.
+
+    Parameters
+    ----------
+    token_sequences: Iterable of (tuple | list | numpy.array)
+        The token sequences to encode; this may be a generator.
+
+    token_dictionary: dictionary or None (optional, default=None)
+        Optionally a fixed dictionary providing the mapping of tokens to indices
+
+    document_counts: bool (optional, default=False)
+        Whether to also count the number of sequences each token occurs in.
+
+    Returns
+    -------
+    codes: array of shape (n_tokens,)
+        The index of each token of the concatenated sequences in token_dictionary,
+        or -1 for tokens that are not in a provided token_dictionary.
+
+    lengths: array of shape (n_sequences,)
+        The number of tokens in each sequence.
+
+    token_dictionary: dictionary
+        The dictionary mapping tokens to indices
+
+    token_counts: array
+        The number of occurrences of each token (with index from the token
+        dictionary). For a provided token_dictionary this only extends to the
+        largest index of a token that occurs.
+
+    token_document_counts: array of shape (len(token_dictionary),) or None
+        The number of sequences each token occurs in, if document_counts is True.
+    """
+    learn = token_dictionary is None
+    index = {} if learn else token_dictionary
+    n_codes = None if learn else max(index.values(), default=-1) + 1
+
+    codes = np.zeros(1024, dtype=np.int32)
+    n_tokens = 0
+    lengths = []
+    doc_counts = np.zeros(max(len(index), 1024), dtype=np.int64)
+    for sequence in token_sequences:
+        sequence_codes = _encode_sequence(sequence, index, learn)
+        n_sequence_tokens = sequence_codes.shape[0]
+        codes = _grow(codes, n_tokens + n_sequence_tokens)
+        codes[n_tokens : n_tokens + n_sequence_tokens] = sequence_codes
+        n_tokens += n_sequence_tokens
+        lengths.append(n_sequence_tokens)
+        if document_counts:
+            occurring = np.unique(sequence_codes)
+            occurring = occurring[occurring >= 0]
+            doc_counts = _grow(doc_counts, len(index) if learn else n_codes)
+            doc_counts[occurring] += 1
+
+    codes = codes[:n_tokens]
+    lengths = np.array(lengths, dtype=np.int64)
+
+    if learn:
+        # Codes are in order of first occurrence; relabel them to sorted token order
+        unique_tokens = list(index.keys())
+        n_unique = len(unique_tokens)
+        order = sorted(range(n_unique), key=unique_tokens.__getitem__)
+        relabel = np.empty(n_unique, dtype=np.int32)
+        relabel[order] = np.arange(n_unique, dtype=np.int32)
+        codes = relabel[codes]
+        token_dictionary = {unique_tokens[code]: i for i, code in enumerate(order)}
+        token_counts = np.bincount(codes, minlength=n_unique)
+        if document_counts:
+            token_document_counts = np.empty(n_unique, dtype=np.int64)
+            token_document_counts[relabel] = doc_counts[:n_unique]
+    else:
+        token_counts = np.bincount(codes[codes >= 0])
+        if document_counts:
+            token_document_counts = doc_counts[:n_codes]
+
+    if not document_counts:
+        token_document_counts = None
+
+    return codes, lengths, token_dictionary, token_counts, token_document_counts
+
+
+def _shared_codes(shared_name, n_tokens):
+    shared = SharedMemory(name=shared_name)
+    return shared, np.ndarray((n_tokens,), dtype=np.int32, buffer=shared.buf)
+
+
+def _encode_shard(
+    token_sequences, token_dictionary, document_counts, shared_name, n_tokens, offset
+):
+    # Worker: encode a shard of sequences into its slice of the shared code buffer
+    codes, lengths, token_dictionary, token_counts, doc_counts = encode_token_sequences(
+        token_sequences, token_dictionary, document_counts=document_counts
+    )
+    shared, buffer = _shared_codes(shared_name, n_tokens)
+    buffer[offset : offset + codes.shape[0]] = codes
+    del buffer
+    shared.close()
+    return list(token_dictionary.keys()), lengths, token_counts, doc_counts
+
+
+def _relabel_shard(shared_name, n_tokens, start, end, code_map):
+    # Worker: map the local codes of a shard in the shared buffer to global codes
+    shared, buffer = _shared_codes(shared_name, n_tokens)
+    buffer[start:end] = code_map[buffer[start:end]]
+    del buffer
+    shared.close()
+
+
+def _add_padded(total, values):
+    # Sum arrays of varying length
+    if values.shape[0] > total.shape[0]:
+        total = np.pad(total, (0, values.shape[0] - total.shape[0]))
+    total[: values.shape[0]] += values
+    return total
+
+
+def parallel_encode_token_sequences(
+    token_sequences, token_dictionary=None, document_counts=False, n_processes=2
+):
+    """Encode a collection of token sequences as integer codes, as for
+    encode_token_sequences, sharding the sequences across a pool of processes.
+    Each worker encodes and counts its shard with a local vocabulary, writing the
+    codes into a shared memory buffer; the vocabularies and counts are merged
+    once centrally, and the workers then relabel their shards of the shared
+    buffer to the merged vocabulary.
+
+    Parameters
+    ----------
+    token_sequences: sequence of (tuple | list | numpy.array)
+        The token sequences to encode.
+
+    token_dictionary: dictionary or None (optional, default=None)
+        Optionally a fixed dictionary providing the mapping of tokens to indices
+
+    document_counts: bool (optional, default=False)
+        Whether to also count the number of sequences each token occurs in.
+
+    n_processes: int (optional, default=2)
+        The number of worker processes to shard the sequences across.
+
+    Returns
+    -------
+    As for encode_token_sequences.
+    """
+    learn = token_dictionary is None
+    sequence_lengths = np.array(
+        [len(sequence) for sequence in token_sequences], dtype=np.int64
+    )
+    token_offsets = np.concatenate(([0], np.cumsum(sequence_lengths)))
+    n_tokens = int(token_offsets[-1])
+
+    # Shard boundaries (in sequences) splitting the tokens as evenly as possible
+    boundaries = np.searchsorted(
+        token_offsets, np.linspace(0, n_tokens, n_processes + 1), side="left"
+    )
+    boundaries[0] = 0
+    boundaries[-1] = len(token_sequences)
+    boundaries = np.unique(boundaries)
+    shards = list(zip(boundaries[:-1], boundaries[1:]))
+
+    shared = SharedMemory(create=True, size=max(4 * n_tokens, 1))
+    try:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            shard_results = list(
+                executor.map(
+                    _encode_shard,
+                    [token_sequences[start:end] for start, end in shards],
+                    [token_dictionary] * len(shards),
+                    [document_counts] * len(shards),
+                    [shared.name] * len(shards),
+                    [n_tokens] * len(shards),
+                    [token_offsets[start] for start, end in shards],
+                )
+            )
+
+            token_counts = np.zeros(0, dtype=np.int64)
+            doc_counts = np.zeros(0, dtype=np.int64)
+            if learn:
+                unique_tokens = sorted(
+                    set().union(*[result[0] for result in shard_results])
+                )
+                token_dictionary = dict(zip(unique_tokens, range(len(unique_tokens))))
+                token_counts = np.zeros(len(unique_tokens), dtype=np.int64)
+                doc_counts = np.zeros(len(unique_tokens), dtype=np.int64)
+                code_maps = []
+                for shard_tokens, _, shard_counts, shard_doc_counts in shard_results:
+                    local_to_global = np.array(
+                        [token_dictionary[token] for token in shard_tokens],
+                        dtype=np.int32,
+                    )
+                    token_counts[local_to_global] += shard_counts
+                    if document_counts:
+                        doc_counts[local_to_global] += shard_doc_counts
+                    code_maps.append(local_to_global)
+                list(
+                    executor.map(
+                        _relabel_shard,
+                        [shared.name] * len(shards),
+                        [n_tokens] * len(shards),
+                        [token_offsets[start] for start, end in shards],
+                        [token_offsets[end] for start, end in shards],
+                        code_maps,
+                    )
+                )
+            else:
+                for _, _, shard_counts, shard_doc_counts in shard_results:
+                    token_counts = _add_padded(token_counts, shard_counts)
+                    if document_counts:
+                        doc_counts = _add_padded(doc_counts, shard_doc_counts)
+
+        codes = np.ndarray((n_tokens,), dtype=np.int32, buffer=shared.buf).copy()
+    finally:
+        shared.close()
+        shared.unlink()
+
+    if not document_counts:
+        doc_counts = None
+    lengths = np.concatenate(
+        [result[1] for result in shard_results] + [np.zeros(0, dtype=np.int64)]
+    )
+    return codes, lengths, token_dictionary, token_counts, doc_counts
+
+
+def encode_token_sequence(token_sequence, token_dictionary=None):
+    """Encode a single sequence of tokens as integer codes, hashing each token only
+    once. See encode_token_sequences.
+
+    Parameters
+    ----------
+    token_sequence: Iterable
+        A single long sequence of tokens
+
+    token_dictionary: dictionary or None (optional, default=None)
+        Optionally a fixed dictionary providing the mapping of tokens to indices
+
+    Returns
+    -------
+    codes: array of shape (len(token_sequence),)
+        The index of each token in token_dictionary, or -1 for tokens that are not
+        in a provided token_dictionary.
+
+    token_dictionary: dictionary
+        The dictionary mapping tokens to indices
+
+    token_counts: array
+        The number of occurrences of each token (with index from the token
+        dictionary).
+    """
+    codes, _, token_dictionary, token_counts, _ = encode_token_sequences(
+        [token_sequence], token_dictionary
+    )
+    return codes, token_dictionary, token_counts
+
+
+class EncodedCorpus:
+    """A corpus of token sequences encoded once against its full (unpruned)
+    vocabulary, so that the encoding can be shared by several vectorizers. An
+    EncodedCorpus can be passed in place of the token sequences to the ``fit``
+    and ``transform`` methods of TokenCooccurrenceVectorizer, NgramVectorizer
+    and SkipgramVectorizer (or to preprocess_token_sequences); each vectorizer
+    still applies its own pruning constraints to the shared vocabulary, but
+    the raw tokens are only read and hashed once.
+
+    Parameters
+    ----------
+    token_sequences: Iterable of (tuple | list | numpy.array)
+        The token sequences to encode.
+
+    n_processes: int (optional, default=1)
+        The number of processes to encode the sequences with; see
+        parallel_encode_token_sequences.
+
+    validate_data: bool or int (optional, default=True)
+        Check that all tokens are of a single type before encoding. If an int, only
+        check a random sample of this many sequences.
+
+    Attributes
+    ----------
+    codes: array of shape (n_tokens,)
+        The index of each token of the concatenated sequences in token_dictionary.
+
+    lengths: array of shape (n_sequences,)
+        The number of tokens in each sequence.
+
+    token_dictionary: dictionary
+        The dictionary mapping every token of the corpus to its index, in sorted
+        token order.
+
+    token_counts: array of shape (len(token_dictionary),)
+        The number of occurrences of each token.
+
+    pruning_plans: PruningPlanCache
+        The results of pruning this vocabulary under recently used constraints,
+        shared by the vectorizers fitted on the corpus. Call
+        ``pruning_plans.cache_clear()`` to release them.
+    """
 
-    n_tokens = len(token_dictionary)
-    doc_freq = np.zeros(n_tokens)
-    for doc in token_by_doc_sequence:
-        doc_set = set([token[0] for token in doc])
-        doc_freq += np.bincount(
-            [token_dictionary[token] for token in doc_set], minlength=n_tokens
+    def __init__(self, token_sequences, n_processes=1, validate_data=True):
+        validate_token_data(token_sequences, validate_data)
+        (
+            self.codes,
+            self.lengths,
+            self.token_dictionary,
+            self.token_counts,
+            _,
+        ) = (
+            encode_token_sequences(token_sequences)
+            if n_processes <= 1
+            else parallel_encode_token_sequences(
+                token_sequences, n_processes=n_processes
+            )
+        )
+        self._document_counts = None
+        self.pruning_plans = PruningPlanCache()
+
+    def __len__(self):
+        return self.lengths.shape[0]
+
+    @property
+    def n_tokens(self):
+        return self.codes.shape[0]
+
+    @property
+    def token_frequencies(self):
+        """The frequency of occurrence of each token."""
+        return self.token_counts.astype(np.float32) / self.n_tokens
+
+    @property
+    def document_counts(self):
+        """The number of sequences each token occurs in; computed on first use."""
+        if self._document_counts is None:
+            self._document_counts = _document_frequency(
+                self.codes, self.lengths, len(self.token_dictionary)
+            )
+        return self._document_counts
+
+    def encode(self, token_dictionary=None, document_counts=False):
+        """Return the encoded corpus in the form given by encode_token_sequences,
+        re-indexed against token_dictionary if one is provided."""
+        if token_dictionary is None:
+            return (
+                self.codes,
+                self.lengths,
+                self.token_dictionary,
+                self.token_counts,
+                self.document_counts if document_counts else None,
+            )
+        code_map = _construct_code_map(
+            self.token_dictionary, len(self.token_dictionary), token_dictionary, None
+        )
+        codes = code_map[self.codes]
+        token_counts = np.bincount(codes[codes >= 0])
+        token_document_counts = None
+        if document_counts:
+            token_document_counts = _document_frequency(
+                codes, self.lengths, max(token_dictionary.values(), default=-1) + 1
+            )
+        return (
+            codes,
+            self.lengths,
+            token_dictionary,
+            token_counts,
+            token_document_counts,
         )
-    return doc_freq / len(token_by_doc_sequence)
 
 
 def construct_token_dictionary_and_frequency(token_sequence, token_dictionary=None):
@@ -89,18 +521,123 @@ def construct_token_dictionary_and_frequency(token_sequence, token_dictionary=No
         The total number of tokens in the sequence
     """
     n_tokens = len(token_sequence)
-    if token_dictionary is None:
-        unique_tokens = sorted(list(set(token_sequence)))
-        token_dictionary = dict(zip(unique_tokens, range(len(unique_tokens))))
+    _, token_dictionary, token_counts = encode_token_sequence(
+        token_sequence, token_dictionary
+    )
+    token_frequency = token_counts.astype(np.float32) / n_tokens
 
-    index_list = [
-        token_dictionary[token] for token in token_sequence if token in token_dictionary
-    ]
-    token_counts = np.bincount(index_list).astype(np.float32)
+    return token_dictionary, token_frequency, n_tokens
 
-    token_frequency = token_counts / n_tokens
 
-    return token_dictionary, token_frequency, n_tokens
+@numba.njit(nogil=True)
+def remap_token_codes(codes, indptr, code_map):
+    """Translate encoded tokens through a lookup array in a single pass, dropping
+    tokens that map to -1.
+
+    Parameters
+    ----------
+    codes: array of shape (n_tokens,)
+        The encoded tokens of all sequences concatenated, with -1 for unknown tokens.
+
+    indptr: array of shape (n_sequences + 1,)
+        The offsets into codes of each sequence.
+
+    code_map: array of shape (n_codes + 1,)
+        The new index of each code; the last entry is the new index of unknown
+        tokens. Codes mapped to -1 are dropped.
+
+    Returns
+    -------
+    new_codes: array of shape (n_kept,)
+        The remapped tokens as int32.
+
+    new_indptr: array of shape (n_sequences + 1,)
+        The offsets into new_codes of each sequence.
+
+    kept: array of shape (n_tokens,)
+        Whether each of the input tokens was kept.
+    """
+    n_sequences = indptr.shape[0] - 1
+    unknown = code_map[code_map.shape[0] - 1]
+    new_codes = np.empty(codes.shape[0], dtype=np.int32)
+    new_indptr = np.zeros(n_sequences + 1, dtype=np.int64)
+    kept = np.zeros(codes.shape[0], dtype=np.bool_)
+    n_kept = 0
+    for i in range(n_sequences):
+        for j in range(indptr[i], indptr[i + 1]):
+            code = codes[j]
+            new_code = unknown if code < 0 else code_map[code]
+            if new_code >= 0:
+                new_codes[n_kept] = new_code
+                kept[j] = True
+                n_kept += 1
+        new_indptr[i + 1] = n_kept
+    return new_codes[:n_kept], new_indptr, kept
+
+
+@numba.njit(nogil=True)
+def split_flat_sequences(flat, indptr):
+    """Split a flat array into a list of sequences; the sequences are views of
+    the flat array, which is split along its first axis."""
+    result = List()
+    for i in range(indptr.shape[0] - 1):
+        result.append(flat[indptr[i] : indptr[i + 1]])
+    return result
+
+
+@numba.njit(nogil=True)
+def split_flat_multisets(flat, set_indptr, doc_indptr):
+    """Split a flat array into a list of documents, each a list of multisets; the
+    multisets are views of the flat array."""
+    result = List()
+    for i in range(doc_indptr.shape[0] - 1):
+        result.append(
+            split_flat_sequences(
+                flat, set_indptr[doc_indptr[i] : doc_indptr[i + 1] + 1]
+            )
+        )
+    return result
+
+
+def _construct_code_map(encoding_dictionary, n_codes, token_dictionary, masking):
+    # Map codes of the encoding dictionary to indices of the final dictionary;
+    # tokens not in the final dictionary map to -1, or to the mask index if masking
+    code_map = np.full(
+        n_codes + 1,
+        -1 if masking is None else len(token_dictionary),
+        dtype=np.int32,
+    )
+    for token, index in token_dictionary.items():
+        code = encoding_dictionary.get(token)
+        if code is not None:
+            code_map[code] = index
+    return code_map
+
+
+def remap_encoded_sequences(codes, lengths, code_map):
+    """Translate encoded tokens through a lookup array and split them back into
+    sequences, dropping tokens that map to -1.
+
+    Parameters
+    ----------
+    codes: array of shape (n_tokens,)
+        The encoded tokens of all sequences concatenated, with -1 for unknown tokens.
+
+    lengths: array of shape (n_sequences,)
+        The number of tokens in each sequence.
+
+    code_map: array of shape (n_codes + 1,)
+        The new index of each code; the last entry is the new index of unknown
+        tokens. Codes mapped to -1 are dropped.
+
+    Returns
+    -------
+    result_sequences: numba.typed.List of np.ndarray
+        The remapped sequences as int32 arrays.
+    """
+    indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    new_codes, new_indptr, _ = remap_token_codes(codes, indptr, code_map)
+    return split_flat_sequences(new_codes, new_indptr)
 
 
 def select_tokens_by_regex(tokens, regex):
@@ -115,6 +652,264 @@ def select_tokens_by_regex(tokens, regex):
     return result
 
 
+PruningPlanCacheInfo = namedtuple(
+    "PruningPlanCacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+
+class PruningPlanCache:
+    """A small LRU cache of the results of prune_token_dictionary for a single raw
+    token dictionary, so that repeated pruning of the same data (e.g. sweeps over window
+    parameters) skips the regex pass and dictionary rebuild. Each EncodedCorpus
+    owns one, so the cache lives exactly as long as the encoding it describes.
+
+    Parameters
+    ----------
+    maxsize: int (optional, default=8)
+        The number of pruning plans to keep.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._vocabulary = None
+        self._plans = OrderedDict()
+        self._regex_positions = {}
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def bind(self, token_dictionary):
+        """Tie the cache to token_dictionary on first use. A cache only serves the
+        token dictionary object it was first used with (which must not be modified
+        afterwards), so plans can never leak between vocabularies."""
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = token_dictionary
+            elif token_dictionary is not self._vocabulary:
+                raise ValueError(
+                    "The pruning plan cache is bound to a different token dictionary"
+                )
+
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._plans.move_to_end(key)
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            if len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+
+    def regex_positions(self, vocabulary, regex):
+        with self._lock:
+            positions = self._regex_positions.get(regex)
+        if positions is None:
+            positions = _regex_matching_positions(vocabulary, regex)
+            with self._lock:
+                self._regex_positions[regex] = positions
+        return positions
+
+    def cache_info(self):
+        """Report cache statistics in the manner of functools.lru_cache."""
+        with self._lock:
+            return PruningPlanCacheInfo(
+                self._hits, self._misses, self.maxsize, len(self._plans)
+            )
+
+    def cache_clear(self):
+        """Drop all cached plans, release the token dictionary the cache is bound to
+        and reset the statistics."""
+        with self._lock:
+            self._vocabulary = None
+            self._plans.clear()
+            self._regex_positions.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def __getstate__(self):
+        # Locks cannot be pickled; cached plans are cheap to rebuild
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def _array_digest(values):
+    # A cheap identity for the contents of an array, for use in cache keys
+    return values.dtype.str, values.shape, hash(values.tobytes())
+
+
+def _regex_matching_positions(vocabulary, regex):
+    # Positions in the vocabulary of the tokens fully matching the regex
+    if not isinstance(regex, re.Pattern):
+        regex = re.compile(regex)
+    return np.array(
+        [
+            i
+            for i, token in enumerate(vocabulary)
+            if regex.fullmatch(token) is not None
+        ],
+        dtype=np.int64,
+    )
+
+
+def select_top_k(values, k):
+    """Select the k largest of an array of values in linear time. Ties at the
+    threshold value are broken in favour of earlier entries, so exactly
+    min(k, len(values)) entries are selected.
+
+    Parameters
+    ----------
+    values: array of shape (n,)
+        The values to select from.
+
+    k: int
+        The number of entries to select.
+
+    Returns
+    -------
+    selected: array of shape (min(k, n),)
+        The indices of the selected entries, in increasing order.
+    """
+    n = values.shape[0]
+    if k >= n:
+        return np.arange(n)
+    if k <= 0:
+        return np.arange(0)
+    threshold = np.partition(values, n - k)[n - k]
+    selected = values > threshold
+    tied = np.flatnonzero(values == threshold)
+    selected[tied[: k - np.count_nonzero(selected)]] = True
+    return np.flatnonzero(selected)
+
+
+def _construct_pruning_plan(
+    vocabulary,
+    indices,
+    token_dictionary,
+    token_frequencies,
+    token_doc_frequencies,
+    ignored_tokens,
+    excluded_token_regex,
+    max_unique_tokens,
+    min_frequency,
+    max_frequency,
+    min_document_frequency,
+    max_document_frequency,
+    plan_cache=None,
+):
+    # Flag tokens for pruning by index, then keep the survivors in vocabulary order
+    prune = np.zeros(
+        max(len(token_frequencies), indices.max(initial=-1) + 1), dtype=bool
+    )
+    prune[: len(token_frequencies)] |= (token_frequencies < min_frequency) | (
+        token_frequencies > max_frequency
+    )
+    prune[: len(token_doc_frequencies)] |= (
+        token_doc_frequencies < min_document_frequency
+    ) | (token_doc_frequencies > max_document_frequency)
+
+    if ignored_tokens is not None:
+        for token in ignored_tokens:
+            if token in token_dictionary:
+                prune[token_dictionary[token]] = True
+
+    if excluded_token_regex is not None:
+        if plan_cache is None:
+            positions = _regex_matching_positions(vocabulary, excluded_token_regex)
+        else:
+            positions = plan_cache.regex_positions(vocabulary, excluded_token_regex)
+        prune[indices[positions]] = True
+
+    keep = ~prune[indices]
+
+    if max_unique_tokens is not None:
+        kept_positions = np.flatnonzero(keep)
+        if len(kept_positions) > max_unique_tokens:
+            top = select_top_k(
+                token_frequencies[indices[kept_positions]], max_unique_tokens
+            )
+            keep[:] = False
+            keep[kept_positions[top]] = True
+
+    vocab_tokens = list(itertools.compress(vocabulary, keep))
+    new_token_frequency = token_frequencies[indices[keep]]
+    new_vocabulary = dict(zip(vocab_tokens, range(len(vocab_tokens))))
+
+    return new_vocabulary, new_token_frequency
+
+
+def frequency_bounds(
+    min_frequency=None,
+    max_frequency=None,
+    min_occurrences=None,
+    max_occurrences=None,
+    min_document_frequency=None,
+    max_document_frequency=None,
+    min_document_occurrences=None,
+    max_document_occurrences=None,
+    total_tokens=None,
+    total_documents=None,
+):
+    """Resolve the frequency and occurrence constraints accepted by
+    prune_token_dictionary into bounds on token and document frequencies.
+    Occurrence counts are converted to frequencies using total_tokens and
+    total_documents, and missing constraints become 0.0 or 1.0.
+
+    Returns
+    -------
+    min_frequency, max_frequency, min_document_frequency, max_document_frequency: float
+        The bounds on token frequency and document frequency.
+    """
+    if min_occurrences is None:
+        if min_frequency is None:
+            min_frequency = 0.0
+    else:
+        if min_frequency is not None:
+            assert min_occurrences / total_tokens == min_frequency
+        else:
+            min_frequency = min_occurrences / total_tokens
+
+    if max_occurrences is None:
+        if max_frequency is None:
+            max_frequency = 1.0
+    else:
+        if max_frequency is not None:
+            assert max_occurrences / total_tokens == max_frequency
+        else:
+            max_frequency = min(1.0, max_occurrences / total_tokens)
+
+    # Prune by document frequency
+    if min_document_occurrences is None:
+        if min_document_frequency is None:
+            min_document_frequency = 0.0
+    else:
+        if min_document_frequency is not None:
+            assert min_document_occurrences / total_documents == min_document_frequency
+        else:
+            min_document_frequency = min_document_occurrences / total_documents
+
+    if max_document_occurrences is None:
+        if max_document_frequency is None:
+            max_document_frequency = 1.0
+    else:
+        if max_document_frequency is not None:
+            assert max_document_occurrences / total_documents == max_document_frequency
+        else:
+            max_document_frequency = min(
+                1.0, max_document_occurrences / total_documents
+            )
+
+    return min_frequency, max_frequency, min_document_frequency, max_document_frequency
+
+
 def prune_token_dictionary(
     token_dictionary,
     token_frequencies,
@@ -132,6 +927,7 @@ def prune_token_dictionary(
     max_document_occurrences=None,
     total_tokens=None,
     total_documents=None,
+    plan_cache=None,
 ):
     """Prune the token dictionary based on constraints of tokens to ignore and
     min and max allowable token frequencies. This will remove any tokens that should
@@ -156,7 +952,8 @@ def prune_token_dictionary(
     max_unique_tokens: int or None (optional, default=None)
         The maximal number of elements contained in the vocabulary.  If not None, this
         will prune the vocabulary to the top 'max_vocabulary_size' most frequent remaining tokens
-        after other possible preproccessing.
+        after other possible preproccessing. Ties in frequency are broken in favour of tokens
+        that come earlier in the token dictionary.
 
     min_frequency: float (optional, default=0.0)
         The minimum frequency of occurrence allowed for tokens. Tokens that occur
@@ -199,6 +996,11 @@ def prune_token_dictionary(
     total_documents: int or None (optional, default=None)
         Must be set if you pass in min_document_occurrence and max_document_occurrence.
 
+    plan_cache: PruningPlanCache or None (optional, default=None)
+        A cache of pruning results bound to this token dictionary object (as held by
+        an EncodedCorpus); plans are keyed on the frequencies and constraints. If
+        None the dictionary is pruned afresh.
+
     Returns
     -------
     new_token_dictionary: dictionary
@@ -209,141 +1011,349 @@ def prune_token_dictionary(
         new_token_dictionary.
     """
 
-    if min_occurrences is None:
-        if min_frequency is None:
-            min_frequency = 0.0
-    else:
-        if min_frequency is not None:
-            assert min_occurrences / total_tokens == min_frequency
-        else:
-            min_frequency = min_occurrences / total_tokens
+    (
+        min_frequency,
+        max_frequency,
+        min_document_frequency,
+        max_document_frequency,
+    ) = frequency_bounds(
+        min_frequency=min_frequency,
+        max_frequency=max_frequency,
+        min_occurrences=min_occurrences,
+        max_occurrences=max_occurrences,
+        min_document_frequency=min_document_frequency,
+        max_document_frequency=max_document_frequency,
+        min_document_occurrences=min_document_occurrences,
+        max_document_occurrences=max_document_occurrences,
+        total_tokens=total_tokens,
+        total_documents=total_documents,
+    )
 
-    if max_occurrences is None:
-        if max_frequency is None:
-            max_frequency = 1.0
-    else:
-        if max_frequency is not None:
-            assert max_occurrences / total_tokens == max_frequency
-        else:
-            max_frequency = min(1.0, max_occurrences / total_tokens)
+    token_frequencies = np.asarray(token_frequencies)
+    token_doc_frequencies = np.asarray(token_doc_frequencies)
+    if plan_cache is not None:
+        plan_cache.bind(token_dictionary)
+        key = (
+            _array_digest(token_frequencies),
+            _array_digest(token_doc_frequencies),
+            frozenset(ignored_tokens) if ignored_tokens is not None else None,
+            excluded_token_regex,
+            max_unique_tokens,
+            min_frequency,
+            max_frequency,
+            min_document_frequency,
+            max_document_frequency,
+        )
+        plan = plan_cache.get(key)
+        if plan is not None:
+            # Callers edit the pruned dictionary (e.g. to add a mask token), so hand
+            # out copies
+            new_vocabulary, new_token_frequency = plan
+            return dict(new_vocabulary), new_token_frequency.copy()
+
+    vocabulary = tuple(token_dictionary)
+    indices = np.fromiter(
+        token_dictionary.values(), dtype=np.int64, count=len(vocabulary)
+    )
+    new_vocabulary, new_token_frequency = _construct_pruning_plan(
+        vocabulary,
+        indices,
+        token_dictionary,
+        token_frequencies,
+        token_doc_frequencies,
+        ignored_tokens,
+        excluded_token_regex,
+        max_unique_tokens,
+        min_frequency,
+        max_frequency,
+        min_document_frequency,
+        max_document_frequency,
+        plan_cache=plan_cache,
+    )
+    if plan_cache is not None:
+        plan_cache.put(key, (new_vocabulary, new_token_frequency))
+        return dict(new_vocabulary), new_token_frequency.copy()
 
-    # Prune by document frequency
-    if min_document_occurrences is None:
-        if min_document_frequency is None:
-            min_document_frequency = 0.0
-    else:
-        if min_document_frequency is not None:
-            assert min_document_occurrences / total_documents == min_document_frequency
-        else:
-            min_document_frequency = min_document_occurrences / total_documents
+    return new_vocabulary, new_token_frequency
 
-    if max_document_occurrences is None:
-        if max_document_frequency is None:
-            max_document_frequency = 1.0
+
+def remove_node(adjacency_matrix, node, inplace=True):
+    if not inplace:
+        if scipy.sparse.isspmatrix_lil(adjacency_matrix):
+            adj = adjacency_matrix.copy()
+        else:
+            adj = adjacency_matrix.tolil()
+    elif not scipy.sparse.isspmatrix_lil(adjacency_matrix):
+        raise ValueError("Can only remove node in place from LIL matrices")
     else:
-        if max_document_frequency is not None:
-            assert max_document_occurrences / total_documents == max_document_frequency
+        adj = adjacency_matrix
+    # Copy the row we want to kill
+    row_to_remove = adj.rows[node].copy()
+    data_to_remove = adj.data[node].copy()
+    # Ensure we ignore any self-loops in the row
+    try:
+        index_to_remove = row_to_remove.index(node)
+        row_to_remove = (
+            row_to_remove[:index_to_remove] + row_to_remove[index_to_remove + 1 :]
+        )
+        data_to_remove = (
+            data_to_remove[:index_to_remove] + data_to_remove[index_to_remove + 1 :]
+        )
+    except ValueError:
+        pass
+    # Process all the rows making changes as required
+    for i in range(adj.rows.shape[0]):
+        if i == node:
+            adj.rows[i] = []
+            adj.data[i] = []
         else:
-            max_document_frequency = min(
-                1.0, max_document_occurrences / total_documents
-            )
+            try:
+                # Find out if this node has selected node as a successor
+                index_to_modify = adj.rows[i].index(node)
+                # If so replace the entry for that node with successor entries
+                # from the selected node
+                adj.rows[i][index_to_modify : index_to_modify + 1] = row_to_remove
+                adj.data[i][index_to_modify : index_to_modify + 1] = data_to_remove
+            except ValueError:
+                # We didn't have the selected node in the data; nothing to do
+                pass
 
-    if ignored_tokens is not None:
-        tokens_to_prune = set(ignored_tokens)
+    if not inplace:
+        # Clean up the result
+        result = adj.tocsr()
+        result.eliminate_zeros()
+        result.sort_indices()
+        return result
     else:
-        tokens_to_prune = set([])
+        return adj
 
-    reverse_token_dictionary = {index: word for word, index in token_dictionary.items()}
 
-    infrequent_tokens = np.where(token_frequencies < min_frequency)[0]
-    frequent_tokens = np.where(token_frequencies > max_frequency)[0]
+# A batch of labelled trees held as a single graph. The nodes of tree t are the
+# nodes node_offsets[t] up to (but not including) node_offsets[t + 1]; adjacency is
+# the block diagonal (n_nodes, n_nodes) sparse adjacency matrix of all the trees,
+# with an edge from each parent to each of its children, and labels holds the
+# label of every node. A forest given as an edge list or a parent array can be
+# wrapped with scipy.sparse.coo_matrix((weights, (parents, children))).
+LabelledForest = namedtuple("LabelledForest", ["adjacency", "labels", "node_offsets"])
+
+
+def _forest_adjacency(adjacency_matrices):
+    # Stack the adjacency matrices of a sequence of trees into the block diagonal
+    # CSR adjacency matrix of the forest, offsetting the CSR arrays of each tree
+    adjacency_matrices = [scipy.sparse.csr_matrix(adj) for adj in adjacency_matrices]
+    n_nodes = np.array([adj.shape[0] for adj in adjacency_matrices], dtype=np.int64)
+    n_edges = np.array([adj.nnz for adj in adjacency_matrices], dtype=np.int64)
+    node_offsets = np.concatenate(([0], np.cumsum(n_nodes)))
+    edge_offsets = np.concatenate(([0], np.cumsum(n_edges)))
+    if len(adjacency_matrices) > 0:
+        indptr = np.concatenate(
+            [adj.indptr[:-1] for adj in adjacency_matrices] + [[0]]
+        ) + np.repeat(edge_offsets, np.append(n_nodes, 1))
+        indices = np.concatenate(
+            [adj.indices for adj in adjacency_matrices]
+        ) + np.repeat(node_offsets[:-1], n_edges)
+        data = np.concatenate([adj.data for adj in adjacency_matrices])
+    else:
+        indptr = np.zeros(1, dtype=np.int64)
+        indices = np.zeros(0, dtype=np.int64)
+        data = np.zeros(0, dtype=np.float64)
+    adjacency = scipy.sparse.csr_matrix(
+        (data, indices, indptr), shape=(node_offsets[-1], node_offsets[-1])
+    )
+    return adjacency, node_offsets
 
-    infrequent_doc_tokens = np.where(token_doc_frequencies < min_document_frequency)[0]
-    frequent_doc_tokens = np.where(token_doc_frequencies > max_document_frequency)[0]
 
-    tokens_to_prune.update({reverse_token_dictionary[i] for i in infrequent_tokens})
-    tokens_to_prune.update({reverse_token_dictionary[i] for i in frequent_tokens})
-    tokens_to_prune.update({reverse_token_dictionary[i] for i in infrequent_doc_tokens})
-    tokens_to_prune.update({reverse_token_dictionary[i] for i in frequent_doc_tokens})
+def labelled_forest_from_trees(tree_sequences):
+    """Gather a sequence of labelled trees into a single LabelledForest.
 
-    if excluded_token_regex is not None:
-        tokens_to_prune.update(
-            select_tokens_by_regex(token_dictionary.keys(), excluded_token_regex)
+    Parameters
+    ----------
+    tree_sequences: sequence of tuples (sparse matrix of size (n,n), array of size (n))
+        Each tuple in this sequence represents a labelled tree.
+        The first element is a sparse adjacency matrix
+        The second element is an array of node labels
+
+    Returns
+    -------
+    forest: LabelledForest
+        The trees as a single block diagonal adjacency matrix, the labels of all
+        the trees concatenated, and the node offsets of each tree.
+    """
+    adjacency, node_offsets = _forest_adjacency(
+        [adj_matrix for adj_matrix, _ in tree_sequences]
+    )
+    labels = tuple(
+        itertools.chain.from_iterable(
+            label_sequence for _, label_sequence in tree_sequences
         )
+    )
+    return LabelledForest(adjacency, labels, node_offsets)
+
+
+def forest_chunk_boundaries(node_offsets, n_chunks):
+    """Split a forest into at most n_chunks ranges of whole trees with roughly
+    equal numbers of nodes.
+
+    Parameters
+    ----------
+    node_offsets: array of shape (n_trees + 1,)
+        The offsets of the nodes of each tree of the forest.
+
+    n_chunks: int
+        The number of ranges to split the forest into.
+
+    Returns
+    -------
+    boundaries: array
+        The node offsets of the start of each range, and of the end of the last.
+    """
+    node_offsets = np.asarray(node_offsets)
+    tree_boundaries = np.searchsorted(
+        node_offsets, np.linspace(0, node_offsets[-1], n_chunks + 1)
+    )
+    tree_boundaries[0] = 0
+    tree_boundaries[-1] = node_offsets.shape[0] - 1
+    return np.unique(node_offsets[tree_boundaries])
+
+
+@numba.njit(nogil=True)
+def _contract_tree(
+    indptr, indices, data, keep, node_start, node_end, rows, cols, values, count_only
+):
+    # Link each kept node to its kept children and, through chains of removed
+    # nodes, to its nearest kept descendants; the contracted edge takes the data
+    # of the last edge on the path. Returns the number of contracted edges.
+    visited_from = np.full(node_end - node_start, -1, dtype=np.int64)
+    stack = np.empty(node_end - node_start, dtype=np.int64)
+    n_edges = 0
+    for parent in range(node_start, node_end):
+        if not keep[parent]:
+            continue
+        stack_size = 0
+        node = parent
+        while True:
+            for k in range(indptr[node], indptr[node + 1]):
+                child = indices[k]
+                if keep[child]:
+                    if not count_only:
+                        rows[n_edges] = parent
+                        cols[n_edges] = child
+                        values[n_edges] = data[k]
+                    n_edges += 1
+                elif child != node and visited_from[child - node_start] != parent:
+                    visited_from[child - node_start] = parent
+                    stack[stack_size] = child
+                    stack_size += 1
+            if stack_size == 0:
+                break
+            stack_size -= 1
+            node = stack[stack_size]
+    return n_edges
+
+
+@numba.njit(nogil=True)
+def contract_forest_coo_data(indptr, indices, data, keep, node_start, node_end):
+    """Remove unwanted nodes from a range of whole trees of a forest, reconnecting
+    the parents of removed nodes with their nearest kept descendants.
+
+    Parameters
+    ----------
+    indptr: array
+        The CSR row pointers of the adjacency matrix of the forest.
+
+    indices: array
+        The CSR column indices of the adjacency matrix of the forest.
+
+    data: array
+        The CSR edge data of the adjacency matrix of the forest.
+
+    keep: array of bool
+        Whether each node of the forest is kept.
+
+    node_start: int
+        The first node of the range of trees to contract.
+
+    node_end: int
+        The node following the last node of the range of trees to contract.
+
+    Returns
+    -------
+    rows: array
+        The source node of each contracted edge, in increasing order.
+
+    cols: array
+        The target node of each contracted edge.
+
+    values: array
+        The data of each contracted edge.
+    """
+    rows = np.empty(0, dtype=np.int64)
+    cols = np.empty(0, dtype=np.int64)
+    values = np.empty(0, dtype=data.dtype)
+    n_edges = _contract_tree(
+        indptr, indices, data, keep, node_start, node_end, rows, cols, values, True
+    )
+    rows = np.empty(n_edges, dtype=np.int64)
+    cols = np.empty(n_edges, dtype=np.int64)
+    values = np.empty(n_edges, dtype=data.dtype)
+    _contract_tree(
+        indptr, indices, data, keep, node_start, node_end, rows, cols, values, False
+    )
+    return rows, cols, values
+
 
-    vocab_tokens = [token for token in token_dictionary if token not in tokens_to_prune]
-    new_token_frequency = np.array(
-        [token_frequencies[token_dictionary[token]] for token in vocab_tokens]
-    )
+def parallel_contract_forest(adjacency, keep, node_offsets, n_threads=1):
+    """Remove the unwanted nodes from the trees of a forest, reconnecting the
+    parents of removed nodes with their nearest kept descendants. Removed nodes
+    are left isolated, so the matrix keeps its size.
 
-    if max_unique_tokens is not None:
-        if len(new_token_frequency) > max_unique_tokens:
-            freq = np.sort(new_token_frequency)[-max_unique_tokens - 1]
-            new_inds = new_token_frequency > freq
-            new_token_frequency = new_token_frequency[new_inds]
-            vocab_tokens = [
-                token for i, token in enumerate(vocab_tokens) if new_inds[i]
-            ]
+    Parameters
+    ----------
+    adjacency: scipy.sparse.csr_matrix of shape (n_nodes, n_nodes)
+        The block diagonal adjacency matrix of the forest.
 
-    new_vocabulary = dict(zip(vocab_tokens, range(len(vocab_tokens))))
+    keep: array of bool of shape (n_nodes,)
+        Whether each node of the forest is kept.
 
-    return new_vocabulary, new_token_frequency
+    node_offsets: array of shape (n_trees + 1,)
+        The offsets of the nodes of each tree of the forest.
 
+    n_threads: int (optional, default=1)
+        The number of ranges of trees to contract in parallel with Dask.
 
-def remove_node(adjacency_matrix, node, inplace=True):
-    if not inplace:
-        if scipy.sparse.isspmatrix_lil(adjacency_matrix):
-            adj = adjacency_matrix.copy()
-        else:
-            adj = adjacency_matrix.tolil()
-    elif not scipy.sparse.isspmatrix_lil(adjacency_matrix):
-        raise ValueError("Can only remove node in place from LIL matrices")
-    else:
-        adj = adjacency_matrix
-    # Copy the row we want to kill
-    row_to_remove = adj.rows[node].copy()
-    data_to_remove = adj.data[node].copy()
-    # Ensure we ignore any self-loops in the row
-    try:
-        index_to_remove = row_to_remove.index(node)
-        row_to_remove = (
-            row_to_remove[:index_to_remove] + row_to_remove[index_to_remove + 1 :]
-        )
-        data_to_remove = (
-            data_to_remove[:index_to_remove] + data_to_remove[index_to_remove + 1 :]
+    Returns
+    -------
+    adjacency: scipy.sparse.csr_matrix of shape (n_nodes, n_nodes)
+        The adjacency matrix of the contracted forest.
+    """
+    chunk_boundaries = forest_chunk_boundaries(node_offsets, max(n_threads, 1))
+    if chunk_boundaries.shape[0] <= 2:
+        rows, cols, values = contract_forest_coo_data(
+            adjacency.indptr,
+            adjacency.indices,
+            adjacency.data,
+            keep,
+            0,
+            adjacency.shape[0],
         )
-    except ValueError:
-        pass
-    # Process all the rows making changes as required
-    for i in range(adj.rows.shape[0]):
-        if i == node:
-            adj.rows[i] = []
-            adj.data[i] = []
-        else:
-            try:
-                # Find out if this node has selected node as a successor
-                index_to_modify = adj.rows[i].index(node)
-                # If so replace the entry for that node with successor entries
-                # from the selected node
-                adj.rows[i][index_to_modify : index_to_modify + 1] = row_to_remove
-                adj.data[i][index_to_modify : index_to_modify + 1] = data_to_remove
-            except ValueError:
-                # We didn't have the selected node in the data; nothing to do
-                pass
-
-    if not inplace:
-        # Clean up the result
-        result = adj.tocsr()
-        result.eliminate_zeros()
-        result.sort_indices()
-        return result
     else:
-        return adj
+        chunks = [
+            dask.delayed(contract_forest_coo_data)(
+                adjacency.indptr, adjacency.indices, adjacency.data, keep, start, end
+            )
+            for start, end in zip(chunk_boundaries[:-1], chunk_boundaries[1:])
+        ]
+        chunk_results = dask.compute(*chunks)
+        rows, cols, values = (
+            np.concatenate([chunk[i] for chunk in chunk_results]) for i in range(3)
+        )
+    # The contracted edges come out in increasing order of their source node
+    indptr = np.searchsorted(rows, np.arange(adjacency.shape[0] + 1))
+    return scipy.sparse.csr_matrix((values, cols, indptr), shape=adjacency.shape)
 
 
-def preprocess_tree_sequences(
-    tree_sequences,
-    flat_sequence,
+def preprocess_labelled_forest(
+    forest,
     token_dictionary=None,
     min_occurrences=None,
     max_occurrences=None,
@@ -356,23 +1366,20 @@ def preprocess_tree_sequences(
     ignored_tokens=None,
     excluded_token_regex=None,
     masking=None,
+    n_threads=1,
 ):
-    """Perform a standard set of preprocessing for token sequences. This includes
-    constructing a token dictionary and token frequencies, pruning the dictionary
-    according to frequency and ignored token constraints, and editing the token
-    sequences to only include tokens in the pruned dictionary. Note that either
+    """Perform a standard set of preprocessing for a forest of labelled trees. This
+    includes constructing a token dictionary and token frequencies from the node
+    labels, pruning the dictionary according to frequency and ignored token
+    constraints, and removing the nodes whose labels are not in the pruned
+    dictionary from the trees (or masking their labels). Note that either
     min_occurrences or min_frequency can be provided (respectively
     max_occurences or max_frequency). If both are provided they must agree.
 
     Parameters
     ----------
-    tree_sequences: sequence of tuples (sparse matrix of size (n,n), array of size (n))
-        Each tuple in this sequence represents a labelled tree.
-        The first element is a sparse adjacency matrix
-        The second element is an array of node labels
-
-    flat_sequence: tuple
-        A tuple tokens for processing.
+    forest: LabelledForest
+        The labelled trees to process.
 
     token_dictionary: dictionary or None (optional, default=None)
         A fixed dictionary mapping tokens to indices, constraining the tokens
@@ -421,22 +1428,47 @@ def preprocess_tree_sequences(
     masking: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the provided mask_string.
 
+    n_threads: int (optional, default=1)
+        The number of threads to use when removing the filtered nodes from the trees.
+
     Returns
     -------
-    result_sequences: list of np.ndarray
-        The sequences, pruned of tokens not meeting constraints.
+    result_forest: LabelledForest
+        The forest with the filtered nodes removed, and with the index of each node
+        label in the token dictionary (or -1 for a removed node) as its labels.
 
     token_dictionary: dictionary
         The token dictionary mapping tokens to indices.
 
+    inverse_token_dictionary: dictionary
+        The dictionary mapping indices to tokens.
+
     token_frequencies: array of shape (len(token_dictionary),)
         The frequency of occurrence of the tokens in the token_dictionary.
     """
-    (
-        token_dictionary_,
-        token_frequencies,
-        total_tokens,
-    ) = construct_token_dictionary_and_frequency(flat_sequence, token_dictionary)
+    adjacency = scipy.sparse.csr_matrix(forest.adjacency)
+    node_offsets = np.asarray(forest.node_offsets, dtype=np.int64)
+    n_nodes = node_offsets[-1]
+    if (
+        node_offsets[0] != 0
+        or adjacency.shape != (n_nodes, n_nodes)
+        or len(forest.labels) != n_nodes
+    ):
+        raise ValueError(
+            "The adjacency matrix, labels and node offsets of the forest must "
+            "agree on the number of nodes"
+        )
+    node_trees = np.repeat(np.arange(node_offsets.shape[0] - 1), np.diff(node_offsets))
+    if np.any(
+        node_trees[adjacency.indices]
+        != np.repeat(node_trees, np.diff(adjacency.indptr))
+    ):
+        raise ValueError("The adjacency matrix of the forest links different trees")
+
+    codes, token_dictionary_, token_counts = encode_token_sequence(
+        forest.labels, token_dictionary
+    )
+    token_frequencies = token_counts.astype(np.float32) / n_nodes
 
     if token_dictionary is None:
         if {
@@ -445,9 +1477,9 @@ def preprocess_tree_sequences(
             max_tree_frequency,
             max_tree_occurrences,
         } != {None}:
-            token_doc_frequencies = construct_document_frequency(
-                [tree[1] for tree in tree_sequences], token_dictionary_
-            )
+            token_doc_frequencies = _document_frequency(
+                codes, np.diff(node_offsets), len(token_dictionary_)
+            ) / (node_offsets.shape[0] - 1)
         else:
             token_doc_frequencies = np.array([])
 
@@ -465,49 +1497,177 @@ def preprocess_tree_sequences(
             max_document_frequency=max_tree_frequency,
             min_document_occurrences=min_tree_occurrences,
             max_document_occurrences=max_tree_occurrences,
-            total_tokens=total_tokens,
-            total_documents=len(tree_sequences),
+            total_tokens=n_nodes,
+            total_documents=node_offsets.shape[0] - 1,
         )
+    else:
+        token_dictionary = dict(token_dictionary)
+
+    if masking is not None and masking in token_dictionary:
+        del token_dictionary[masking]
+    code_map = _construct_code_map(
+        token_dictionary_,
+        max(token_dictionary_.values(), default=-1) + 1,
+        token_dictionary,
+        masking,
+    )
+    labels = code_map[codes]
 
     # We will prune the edges from any nodes who's labels are to be filtered and
     # reconnect their parents with their children.
-    # This will remove them from our computation without having to alter the matrix size or label_sequence.
+    # This will remove them from our computation without having to alter the matrix size.
     if masking is None:
-        result_sequence = []
-        for adj_matrix, label_sequence in tree_sequences:
-            node_index_to_remove = [
-                i for i, x in enumerate(label_sequence) if x not in token_dictionary
-            ]
-            result_matrix = adj_matrix.tolil().copy()
-            for node_index in node_index_to_remove:
-                remove_node(result_matrix, node_index)
-
-            #  If we want to eliminate the zero row/columns and trim the label_sequence:
-            #
-            #  label_in_dictionary = np.array([x in token_dictionary for x in label_sequence])
-            #  result_matrix = result_matrix.tocsr()[label_in_dictionary, :]
-            #  result_matrix = result_matrix.T[label_in_dictionary, :].T.tocoo()
-            #  result_labels = label_sequence[label_in_dictionary]
-            #  result_sequence.append((result_matrix, result_labels))
-
-            result_sequence.append((result_matrix, label_sequence))
+        keep = labels >= 0
+        if not np.all(keep):
+            adjacency = parallel_contract_forest(
+                adjacency, keep, node_offsets, n_threads=n_threads
+            )
     else:
-        result_sequence = []
-        if masking in token_dictionary:
-            del token_dictionary[masking]
-
-        for adj_matrix, label_sequence in tree_sequences:
-            new_labels = [
-                label if label in token_dictionary else masking
-                for label in label_sequence
-            ]
-            result_sequence.append((adj_matrix, new_labels))
         token_dictionary[masking] = len(token_dictionary)
 
     inverse_token_dictionary = {
         index: token for token, index in token_dictionary.items()
     }
 
+    return (
+        LabelledForest(adjacency, labels, node_offsets),
+        token_dictionary,
+        inverse_token_dictionary,
+        token_frequencies,
+    )
+
+
+def preprocess_tree_sequences(
+    tree_sequences,
+    flat_sequence,
+    token_dictionary=None,
+    min_occurrences=None,
+    max_occurrences=None,
+    min_frequency=None,
+    max_frequency=None,
+    min_tree_occurrences=None,
+    max_tree_occurrences=None,
+    min_tree_frequency=None,
+    max_tree_frequency=None,
+    ignored_tokens=None,
+    excluded_token_regex=None,
+    masking=None,
+    n_threads=1,
+):
+    """Perform a standard set of preprocessing for token sequences. This includes
+    constructing a token dictionary and token frequencies, pruning the dictionary
+    according to frequency and ignored token constraints, and editing the token
+    sequences to only include tokens in the pruned dictionary. Note that either
+    min_occurrences or min_frequency can be provided (respectively
+    max_occurences or max_frequency). If both are provided they must agree.
+
+    Parameters
+    ----------
+    tree_sequences: sequence of tuples (sparse matrix of size (n,n), array of size (n))
+        Each tuple in this sequence represents a labelled tree.
+        The first element is a sparse adjacency matrix
+        The second element is an array of node labels
+
+    flat_sequence: tuple
+        The labels of all the trees, concatenated.
+
+    token_dictionary: dictionary or None (optional, default=None)
+        A fixed dictionary mapping tokens to indices, constraining the tokens
+        that are allowed. If None then the allowed tokens and a mapping will
+        be learned from the data and returned.
+
+    min_occurrences: int or None (optional, default=None)
+        A constraint on the minimum number of occurrences for a token to be considered
+        valid. If None then no constraint will be applied.
+
+    max_occurrences: int or None (optional, default=None)
+        A constraint on the maximum number of occurrences for a token to be considered
+        valid. If None then no constraint will be applied.
+
+    min_frequency: float or None (optional, default=None)
+        A constraint on the minimum frequency of occurrence for a token to be
+        considered valid. If None then no constraint will be applied.
+
+    max_frequency: float or None (optional, default=None)
+        A constraint on the minimum frequency of occurrence for a token to be
+        considered valid. If None then no constraint will be applied.
+
+    min_tree_occurrences: int or None (optional, default=None)
+        A constraint on the minimum number of trees with occurrences for a token to be considered
+        valid. If None then no constraint will be applied.
+
+    max_tree_occurrences: int or None (optional, default=None)
+        A constraint on the maximum number of trees with occurrences for a token to be considered
+        valid. If None then no constraint will be applied.
+
+    min_tree_frequency: float or None (optional, default=None)
+        A constraint on the minimum frequency of trees with occurrences for a token to be
+        considered valid. If None then no constraint will be applied.
+
+    max_tree_frequency: float or None (optional, default=None)
+        A constraint on the minimum frequency of trees with occurrences for a token to be
+        considered valid. If None then no constraint will be applied.
+
+    excluded_token_regex: str (optional, default=None)
+        A regular expression which constrains the vocabulary to exclude tokens that match the expression.
+
+    ignored_tokens: set or None (optional, default=None)
+        A set of tokens that should be ignored. If None then no tokens will
+        be ignored.
+
+    masking: str (optional, default=None)
+        Prunes the filtered tokens when None, otherwise replaces them with the provided mask_string.
+
+    n_threads: int (optional, default=1)
+        The number of threads to use when removing the filtered nodes from the trees.
+
+    Returns
+    -------
+    result_sequences: list of np.ndarray
+        The sequences, pruned of tokens not meeting constraints.
+
+    token_dictionary: dictionary
+        The token dictionary mapping tokens to indices.
+
+    token_frequencies: array of shape (len(token_dictionary),)
+        The frequency of occurrence of the tokens in the token_dictionary.
+    """
+    adjacency, node_offsets = _forest_adjacency(
+        [adj_matrix for adj_matrix, _ in tree_sequences]
+    )
+    (
+        forest,
+        token_dictionary,
+        inverse_token_dictionary,
+        token_frequencies,
+    ) = preprocess_labelled_forest(
+        LabelledForest(adjacency, flat_sequence, node_offsets),
+        token_dictionary,
+        min_occurrences=min_occurrences,
+        max_occurrences=max_occurrences,
+        min_frequency=min_frequency,
+        max_frequency=max_frequency,
+        min_tree_occurrences=min_tree_occurrences,
+        max_tree_occurrences=max_tree_occurrences,
+        min_tree_frequency=min_tree_frequency,
+        max_tree_frequency=max_tree_frequency,
+        ignored_tokens=ignored_tokens,
+        excluded_token_regex=excluded_token_regex,
+        masking=masking,
+        n_threads=n_threads,
+    )
+
+    result_sequence = []
+    for i, (_, label_sequence) in enumerate(tree_sequences):
+        start, end = node_offsets[i], node_offsets[i + 1]
+        if masking is not None:
+            label_sequence = [
+                inverse_token_dictionary[label] for label in forest.labels[start:end]
+            ]
+        result_sequence.append(
+            (forest.adjacency[start:end, start:end], label_sequence)
+        )
+
     return (
         result_sequence,
         token_dictionary,
@@ -531,6 +1691,8 @@ def preprocess_token_sequences(
     ignored_tokens=None,
     excluded_token_regex=None,
     masking=None,
+    n_processes=1,
+    flat=False,
 ):
     """Perform a standard set of preprocessing for token sequences. This includes
     constructing a token dictionary and token frequencies, pruning the dictionary
@@ -541,9 +1703,9 @@ def preprocess_token_sequences(
 
     Parameters
     ----------
-    token_sequences: Iterable of (tuple | list | numpy.array)
+    token_sequences: Iterable of (tuple | list | numpy.array) or EncodedCorpus
         A list of token sequences. Each sequence should be tuple, list or
-        numpy array of tokens.
+        numpy array of tokens. An EncodedCorpus reuses its existing encoding.
 
     token_dictionary: dictionary or None (optional, default=None)
         A fixed dictionary mapping tokens to indices, constraining the tokens
@@ -597,6 +1759,15 @@ def preprocess_token_sequences(
     masking: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the provided mask_string.
 
+    n_processes: int (optional, default=1)
+        The number of processes to encode and count the token sequences with. If
+        greater than 1 the sequences are sharded across a process pool (see
+        parallel_encode_token_sequences).
+
+    flat: bool (optional, default=False)
+        Whether to return the result sequences as a flat (tokens, indptr) tuple
+        of the concatenated sequences and their boundaries rather than a list.
+
     Returns
     -------
     result_sequences: list of np.ndarray
@@ -609,27 +1780,46 @@ def preprocess_token_sequences(
         The frequency of occurrence of the tokens in the token_dictionary.
     """
 
-    # Get vocabulary and word frequencies
+    # Get vocabulary and word frequencies; the encoded corpus is reused for remapping
 
+    need_document_frequencies = token_dictionary is None and {
+        min_document_frequency,
+        min_document_occurrences,
+        max_document_frequency,
+        max_document_occurrences,
+        max_unique_tokens,
+    } != {None}
     (
+        codes,
+        lengths,
         token_dictionary_,
-        token_frequencies,
-        total_tokens,
-    ) = construct_token_dictionary_and_frequency(
-        flatten(token_sequences), token_dictionary
+        token_counts,
+        token_document_counts,
+    ) = (
+        token_sequences.encode(
+            token_dictionary, document_counts=need_document_frequencies
+        )
+        if isinstance(token_sequences, EncodedCorpus)
+        else encode_token_sequences(
+            token_sequences,
+            token_dictionary,
+            document_counts=need_document_frequencies,
+        )
+        if n_processes <= 1
+        else parallel_encode_token_sequences(
+            token_sequences,
+            token_dictionary,
+            document_counts=need_document_frequencies,
+            n_processes=n_processes,
+        )
     )
+    total_tokens = codes.shape[0]
+    n_codes = max(token_dictionary_.values(), default=-1) + 1
+    token_frequencies = token_counts.astype(np.float32) / total_tokens
 
     if token_dictionary is None:
-        if {
-            min_document_frequency,
-            min_document_occurrences,
-            max_document_frequency,
-            max_document_occurrences,
-            max_unique_tokens,
-        } != {None}:
-            token_doc_frequencies = construct_document_frequency(
-                token_sequences, token_dictionary_
-            )
+        if need_document_frequencies:
+            token_doc_frequencies = token_document_counts / len(token_sequences)
         else:
             token_doc_frequencies = np.array([])
 
@@ -650,38 +1840,23 @@ def preprocess_token_sequences(
             max_document_occurrences=max_document_occurrences,
             total_tokens=total_tokens,
             total_documents=len(token_sequences),
+            plan_cache=token_sequences.pruning_plans
+            if isinstance(token_sequences, EncodedCorpus)
+            else None,
         )
 
-    if masking is None:
-        result_sequences = List()
-        for sequence in token_sequences:
-            result_sequences.append(
-                np.array(
-                    [
-                        token_dictionary[token]
-                        for token in sequence
-                        if token in token_dictionary
-                    ],
-                    dtype=np.int32,
-                )
-            )
+    if masking is not None and masking in token_dictionary:
+        del token_dictionary[masking]
+
+    code_map = _construct_code_map(token_dictionary_, n_codes, token_dictionary, masking)
+    if flat:
+        indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        new_codes, new_indptr, _ = remap_token_codes(codes, indptr, code_map)
+        result_sequences = (new_codes, new_indptr)
     else:
-        result_sequences = List()
-        if masking in token_dictionary:
-            del token_dictionary[masking]
-
-        for sequence in token_sequences:
-            result_sequences.append(
-                np.array(
-                    [
-                        len(token_dictionary)
-                        if not (token in token_dictionary)
-                        else token_dictionary[token]
-                        for token in sequence
-                    ],
-                    dtype=np.int32,
-                )
-            )
+        result_sequences = remap_encoded_sequences(codes, lengths, code_map)
+
+    if masking is not None:
         token_dictionary[masking] = len(token_dictionary)
 
     inverse_token_dictionary = {
@@ -792,24 +1967,31 @@ def preprocess_timed_token_sequences(
 
     # Get vocabulary and word frequencies
 
-    flat_only_tokens = [pair[0] for pair in flatten(token_sequences)]
+    need_document_frequencies = token_dictionary is None and {
+        min_document_frequency,
+        min_document_occurrences,
+        max_document_frequency,
+        max_document_occurrences,
+        max_unique_tokens,
+    } != {None}
     (
+        codes,
+        lengths,
         token_dictionary_,
-        token_frequencies,
-        total_tokens,
-    ) = construct_token_dictionary_and_frequency(flat_only_tokens, token_dictionary)
+        token_counts,
+        token_document_counts,
+    ) = encode_token_sequences(
+        ([pair[0] for pair in sequence] for sequence in token_sequences),
+        token_dictionary,
+        document_counts=need_document_frequencies,
+    )
+    total_tokens = codes.shape[0]
+    n_codes = max(token_dictionary_.values(), default=-1) + 1
+    token_frequencies = token_counts.astype(np.float32) / total_tokens
 
     if token_dictionary is None:
-        if {
-            min_document_frequency,
-            min_document_occurrences,
-            max_document_frequency,
-            max_document_occurrences,
-            max_unique_tokens,
-        } != {None}:
-            token_doc_frequencies = construct_timed_document_frequency(
-                token_sequences, token_dictionary_
-            )
+        if need_document_frequencies:
+            token_doc_frequencies = token_document_counts / len(token_sequences)
         else:
             token_doc_frequencies = np.array([])
 
@@ -832,36 +2014,23 @@ def preprocess_timed_token_sequences(
             total_documents=len(token_sequences),
         )
 
-    if masking is None:
-        result_sequences = List()
-        for i, sequence in enumerate(token_sequences):
-            result_sequences.append(
-                np.array(
-                    [
-                        (token_dictionary[token[0]], token[1])
-                        for token in sequence
-                        if token[0] in token_dictionary
-                    ],
-                    dtype=np.float32,
-                )
-            )
-    else:
-        result_sequences = List()
-        if masking in token_dictionary:
-            del token_dictionary[masking]
-
-        for i, sequence in enumerate(token_sequences):
-            result_sequences.append(
-                np.array(
-                    [
-                        (len(token_dictionary), token[1])
-                        if not (token[0] in token_dictionary)
-                        else (token_dictionary[token[0]], token[1])
-                        for token in sequence
-                    ],
-                    dtype=np.float32,
-                )
-            )
+    if masking is not None and masking in token_dictionary:
+        del token_dictionary[masking]
+
+    code_map = _construct_code_map(token_dictionary_, n_codes, token_dictionary, masking)
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    new_codes, new_indptr, kept = remap_token_codes(codes, indptr, code_map)
+    times = np.fromiter(
+        (pair[1] for sequence in token_sequences for pair in sequence),
+        dtype=np.float32,
+        count=total_tokens,
+    )
+    flat_sequences = np.empty((new_codes.shape[0], 2), dtype=np.float32)
+    flat_sequences[:, 0] = new_codes
+    flat_sequences[:, 1] = times[kept]
+    result_sequences = split_flat_sequences(flat_sequences, new_indptr)
+
+    if masking is not None:
         token_dictionary[masking] = len(token_dictionary)
 
     inverse_token_dictionary = {
@@ -891,6 +2060,7 @@ def preprocess_multi_token_sequences(
     ignored_tokens=None,
     excluded_token_regex=None,
     masking=None,
+    flat=False,
 ):
     """Perform a standard set of preprocessing for sequences of multisets of tokens -- here a 'document'
     is considered a list of multisets of tokens. This includes  constructing a token dictionary and
@@ -957,9 +2127,13 @@ def preprocess_multi_token_sequences(
     masking: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the provided mask_string.
 
+    flat: bool (optional, default=False)
+        Whether to return the result sequences as a flat (tokens, set_indptr, doc_indptr)
+        triple of arrays rather than as a list of lists of arrays.
+
     Returns
     -------
-    result_sequences: list of np.ndarray
+    result_sequences: list of list of np.ndarray or tuple of np.ndarray
         The sequences, pruned of tokens not meeting constraints.
 
     token_dictionary: dictionary
@@ -975,13 +2149,21 @@ def preprocess_multi_token_sequences(
     if not type(seq0[0]) in (list, tuple, np.ndarray):
         token_sequences = [token_sequences]
 
+    set_lengths = np.array([len(doc) for doc in token_sequences], dtype=np.int64)
     (
+        codes,
+        lengths,
         token_dictionary_,
-        token_frequencies,
-        total_tokens,
-    ) = construct_token_dictionary_and_frequency(
-        full_flatten(token_sequences), token_dictionary
+        token_counts,
+        _,
+    ) = encode_token_sequences(
+        (multiset for doc in token_sequences for multiset in doc), token_dictionary
     )
+    total_tokens = codes.shape[0]
+    n_codes = max(token_dictionary_.values(), default=-1) + 1
+    token_frequencies = token_counts.astype(np.float32) / total_tokens
+    set_indptr = np.concatenate(([0], np.cumsum(lengths)))
+    doc_indptr = np.concatenate(([0], np.cumsum(set_lengths)))
 
     if token_dictionary is None:
         if {
@@ -991,9 +2173,9 @@ def preprocess_multi_token_sequences(
             max_document_occurrences,
             max_unique_tokens,
         } != {None}:
-            token_doc_frequencies = construct_document_frequency(
-                semi_flatten(token_sequences), token_dictionary_
-            )
+            token_doc_frequencies = _document_frequency(
+                codes, np.diff(set_indptr[doc_indptr]), n_codes
+            ) / len(token_sequences)
         else:
             token_doc_frequencies = np.array([])
 
@@ -1016,43 +2198,17 @@ def preprocess_multi_token_sequences(
             total_documents=len(token_sequences),
         )
 
-    if masking is None:
-        full_sequence = List()
-        for set_sequence in token_sequences:
-            result_sequences = List()
-            for sequence in set_sequence:
-                result_sequences.append(
-                    np.array(
-                        [
-                            token_dictionary[token]
-                            for token in sequence
-                            if token in token_dictionary
-                        ],
-                        dtype=np.int32,
-                    )
-                )
-            full_sequence.append(result_sequences)
+    if masking is not None and masking in token_dictionary:
+        del token_dictionary[masking]
+
+    code_map = _construct_code_map(token_dictionary_, n_codes, token_dictionary, masking)
+    tokens, set_indptr, _ = remap_token_codes(codes, set_indptr, code_map)
+    if flat:
+        full_sequence = (tokens, set_indptr, doc_indptr)
     else:
-        if masking in token_dictionary:
-            del token_dictionary[masking]
-
-        full_sequence = List()
-        for set_sequence in token_sequences:
-            result_sequences = List()
-            for sequence in set_sequence:
-                result_sequences.append(
-                    np.array(
-                        [
-                            len(token_dictionary)
-                            if not (token in token_dictionary)
-                            else token_dictionary[token]
-                            for token in sequence
-                        ],
-                        dtype=np.int32,
-                    )
-                )
-            full_sequence.append(result_sequences)
+        full_sequence = split_flat_multisets(tokens, set_indptr, doc_indptr)
 
+    if masking is not None:
         token_dictionary[masking] = len(token_dictionary)
 
     inverse_token_dictionary = {
@@ -10,13 +10,12 @@ import scipy.stats
 import scipy.sparse
 
 from .utils import (
-    flatten,
-    validate_homogeneous_token_types,
+    validate_token_data,
 )
 
-from .coo_utils import sum_coo_entries
+from .coo_utils import sum_coo_entries_by_key
 
-from .preprocessing import preprocess_token_sequences
+from .preprocessing import preprocess_token_sequences, EncodedCorpus
 import vectorizers.distances as distances
 
 from ._window_kernels import (
@@ -70,19 +69,133 @@ def build_skip_grams(
         tail token index, and the associated weight of the skip-gram.
     """
 
-    coo_tuples = [(np.float32(0.0), np.float32(0.0), np.float32(0.0))]
+    # Key each skip-gram by head * n_keys + tail so it can be summed exactly
+    n_keys = len(window_sizes)
+    n_entries = 0
+    for i in range(len(token_sequence)):
+        n_entries += len(
+            window_at_index(token_sequence, window_sizes[token_sequence[i]], i, reverse)
+        )
+
+    keys = np.empty(n_entries, dtype=np.int64)
+    values = np.empty(n_entries, dtype=np.float64)
+    k = 0
     for i, head_token in enumerate(token_sequence):
         window = window_at_index(token_sequence, window_sizes[head_token], i, reverse)
         weights = kernel_function(window, *kernel_args)
+        for j in range(len(window)):
+            keys[k] = np.int64(head_token) * n_keys + window[j]
+            values[k] = weights[j]
+            k += 1
+
+    return _skip_grams_from_keys(keys, values, n_keys)
+
+
+@numba.njit(nogil=True)
+def _skip_grams_from_keys(keys, values, n_keys):
+    # Sum the skip-gram weights by key and unpack the keys into an
+    # (n_skip_grams, 3) array of head, tail and weight
+    unique_keys, sums = sum_coo_entries_by_key(keys, values)
+    result = np.empty((unique_keys.shape[0], 3), dtype=np.float64)
+    result[:, 0] = unique_keys // n_keys
+    result[:, 1] = unique_keys % n_keys
+    result[:, 2] = sums
+    return result
 
-        coo_tuples.extend(
-            [
-                (np.float32(head_token), np.float32(window[j]), weights[j])
-                for j in range(len(window))
-            ]
-        )
 
-    return sum_coo_entries(coo_tuples)
+@numba.njit(nogil=True)
+def flat_skip_grams_coo_data(
+    codes,
+    indptr,
+    window_sizes,
+    kernel_function,
+    kernel_args,
+):
+    """Given a flat collection of encoded token sequences construct the data for
+    a sparse matrix representation with a row for each token sequence and a
+    column for each skip-gram, in a single pass over all the sequences. The
+    column of the skip-gram from head token i to tail token j is
+    i * n_unique_tokens + j. Repeated skip-grams of a sequence produce repeated
+    entries, to be summed on conversion of the COO data to another format.
+
+    Parameters
+    ----------
+    codes: array of shape (n_total_tokens,)
+        The token indices of all sequences concatenated.
+
+    indptr: array of shape (n_sequences + 1,)
+        The boundaries of the sequences in codes.
+
+    window_sizes: Iterable
+        A collection of window sizes per vocabulary index
+
+    kernel_function: numba.jitted callable
+        A function producing weights given a window of tokens
+
+    kernel_args: tuple
+        Arguments to pass through to the kernel function
+
+    Returns
+    -------
+    row: array
+        Row data for a COO format sparse matrix representation
+
+    col: array
+        Col data for a COO format sparse matrix representation
+
+    data: array
+        Value data for a COO format sparse matrix representation
+    """
+    n_unique_tokens = window_sizes.shape[0] - 1
+
+    n_entries = 0
+    for d in range(indptr.shape[0] - 1):
+        for i in range(indptr[d], indptr[d + 1]):
+            n_entries += max(min(window_sizes[codes[i]], indptr[d + 1] - i - 1), 0)
+
+    result_row = np.empty(n_entries, dtype=np.int32)
+    result_col = np.empty(n_entries, dtype=np.int64)
+    result_data = np.empty(n_entries, dtype=np.float32)
+    k = 0
+    for d in range(indptr.shape[0] - 1):
+        token_sequence = codes[indptr[d] : indptr[d + 1]]
+        for i in range(token_sequence.shape[0]):
+            head_token = token_sequence[i]
+            window = window_at_index(token_sequence, window_sizes[head_token], i)
+            weights = kernel_function(window, *kernel_args)
+            for j in range(window.shape[0]):
+                result_row[k] = d
+                result_col[k] = np.int64(head_token) * n_unique_tokens + window[j]
+                result_data[k] = weights[j]
+                k += 1
+
+    return result_row, result_col, result_data
+
+
+@numba.njit(nogil=True)
+def kept_column_positions(kept_columns, col, n_unique_tokens):
+    """The position of each skip-gram column in the sorted array kept_columns, or
+    -1 if it is not kept. The kept columns are split by head token first, so each
+    lookup is a binary search among the kept tails of a single head token."""
+    head_indptr = np.searchsorted(
+        kept_columns, np.arange(n_unique_tokens + 1) * np.int64(n_unique_tokens)
+    )
+    result = np.full(col.shape[0], -1, dtype=np.int64)
+    for i in range(col.shape[0]):
+        head = col[i] // n_unique_tokens
+        if head >= n_unique_tokens:
+            continue
+        low = head_indptr[head]
+        high = head_indptr[head + 1]
+        while low < high:
+            middle = (low + high) // 2
+            if kept_columns[middle] < col[i]:
+                low = middle + 1
+            else:
+                high = middle
+        if low < head_indptr[head + 1] and kept_columns[low] == col[i]:
+            result[i] = low
+    return result
 
 
 def skip_grams_matrix_coo_data(
@@ -93,7 +206,7 @@ def skip_grams_matrix_coo_data(
 ):
     """Given a list of token sequences construct the relevant data for a sparse
     matrix representation with a row for each token sequence and a column for each
-    skip-gram.
+    skip-gram. See flat_skip_grams_coo_data.
 
     Parameters
     ----------
@@ -121,27 +234,15 @@ def skip_grams_matrix_coo_data(
     data: array
         Value data for a COO format sparse matrix representation
     """
-    result_row = []
-    result_col = []
-    result_data = []
-
-    n_unique_tokens = len(window_sizes) - 1
-
-    for row_idx in range(len(list_of_token_sequences)):
-        skip_gram_data = build_skip_grams(
-            list_of_token_sequences[row_idx],
-            window_sizes,
-            kernel_function,
-            kernel_args,
-        )
-        for i, skip_gram in enumerate(skip_gram_data):
-            result_row.append(row_idx)
-            result_col.append(
-                np.int32(skip_gram[0]) * n_unique_tokens + np.int32(skip_gram[1])
-            )
-            result_data.append(skip_gram[2])
-
-    return np.asarray(result_row), np.asarray(result_col), np.asarray(result_data)
+    lengths = np.array([len(sequence) for sequence in list_of_token_sequences])
+    codes = np.concatenate(
+        [np.asarray(sequence, dtype=np.int32) for sequence in list_of_token_sequences]
+        + [np.zeros(0, dtype=np.int32)]
+    )
+    indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    return flat_skip_grams_coo_data(
+        codes, indptr, np.asarray(window_sizes), kernel_function, kernel_args
+    )
 
 
 @numba.njit(nogil=True)
@@ -179,19 +280,31 @@ def sequence_skip_grams(
     skip_grams: array of shape (n_skip_grams, 3)
         The skip grams for the combined set of sequences.
     """
-    skip_grams = [(np.float32(0), np.float32(0), np.float32(0))]
-    for i, token_sequence in enumerate(token_sequences):
-        skip_grams.extend(
-            build_skip_grams(
-                token_sequence,
-                window_sizes,
-                kernel_function,
-                kernel_args,
-                reverse,
-            )
+    n_keys = len(window_sizes)
+    per_sequence_skip_grams = [
+        build_skip_grams(
+            token_sequence,
+            window_sizes,
+            kernel_function,
+            kernel_args,
+            reverse,
         )
+        for token_sequence in token_sequences
+    ]
+    n_entries = 0
+    for skip_grams in per_sequence_skip_grams:
+        n_entries += skip_grams.shape[0]
+
+    keys = np.empty(n_entries, dtype=np.int64)
+    values = np.empty(n_entries, dtype=np.float64)
+    k = 0
+    for skip_grams in per_sequence_skip_grams:
+        for i in range(skip_grams.shape[0]):
+            keys[k] = np.int64(skip_grams[i, 0]) * n_keys + np.int64(skip_grams[i, 1])
+            values[k] = skip_grams[i, 2]
+            k += 1
 
-    return np.array(sum_coo_entries(skip_grams))
+    return _skip_grams_from_keys(keys, values, n_keys)
 
 
 class SkipgramVectorizer(BaseEstimator, TransformerMixin):
@@ -280,8 +393,10 @@ class SkipgramVectorizer(BaseEstimator, TransformerMixin):
     token_dictionary: dictionary or None (optional, default=None)
         A dictionary mapping tokens to indices
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the provided mask_string.
@@ -337,12 +452,11 @@ class SkipgramVectorizer(BaseEstimator, TransformerMixin):
 
     def fit(self, X, y=None, **fit_params):
 
-        if self.validate_data:
-            validate_homogeneous_token_types(X)
+        if not isinstance(X, EncodedCorpus):
+            validate_token_data(X, self.validate_data)
 
-        flat_sequence = flatten(X)
         (
-            token_sequences,
+            (codes, indptr),
             self._token_dictionary_,
             self._inverse_token_dictionary_,
             self._token_frequencies_,
@@ -360,6 +474,7 @@ class SkipgramVectorizer(BaseEstimator, TransformerMixin):
             max_document_frequency=self.max_document_frequency,
             ignored_tokens=self.ignored_tokens,
             excluded_token_regex=self.excluded_token_regex,
+            flat=True,
         )
 
         if callable(self.kernel_function):
@@ -400,38 +515,70 @@ class SkipgramVectorizer(BaseEstimator, TransformerMixin):
         )
 
         # Build the matrix
-        row, col, data = skip_grams_matrix_coo_data(
-            token_sequences,
+        row, col, data = flat_skip_grams_coo_data(
+            codes,
+            indptr,
             self._window_sizes,
             self._kernel_function,
             tuple(*self.kernel_args.values()),
         )
 
-        base_matrix = scipy.sparse.coo_matrix((data, (row, col)))
-        column_sums = np.array(base_matrix.sum(axis=0))[0]
-        self._column_is_kept = column_sums > 0
-        self._kept_columns = np.where(self._column_is_kept)[0]
-
-        self.column_label_dictionary_ = {}
-        for i in range(self._kept_columns.shape[0]):
-            raw_val = self._kept_columns[i]
-            first_token = self._inverse_token_dictionary_[
-                raw_val // len(self._token_dictionary_)
-            ]
-            second_token = self._inverse_token_dictionary_[
-                raw_val % len(self._token_dictionary_)
-            ]
-            self.column_label_dictionary_[(first_token, second_token)] = i
-
-        self.column_index_dictionary_ = {
-            index: token for token, index in self.column_label_dictionary_.items()
-        }
-        self._train_matrix = base_matrix.tocsc()[:, self._column_is_kept].tocsr()
+        # Keep the columns with positive total weight
+        columns, column_positions = np.unique(col, return_inverse=True)
+        column_sums = np.bincount(
+            column_positions.ravel(), weights=data, minlength=columns.shape[0]
+        )
+        self._kept_columns = columns[column_sums > 0]
+        self._column_label_dictionary = None
+        self._column_index_dictionary = None
+
+        self._train_matrix = self._compact_columns(row, col, data, indptr.shape[0] - 1)
         self._train_matrix.eliminate_zeros()
         self.metric_ = distances.sparse_hellinger
 
         return self
 
+    def _compact_columns(self, row, col, data, n_rows):
+        # Renumber the skip-gram columns by their position among the kept columns,
+        # dropping entries in columns that are not kept
+        positions = kept_column_positions(
+            self._kept_columns, col, self._window_sizes.shape[0] - 1
+        )
+        is_kept = positions >= 0
+        return scipy.sparse.coo_matrix(
+            (data[is_kept], (row[is_kept], positions[is_kept])),
+            shape=(n_rows, self._kept_columns.shape[0]),
+        ).tocsr()
+
+    @property
+    def column_label_dictionary_(self):
+        """Dictionary mapping (head token, tail token) skip-grams to column indices,
+        built on first access."""
+        if self._column_label_dictionary is None:
+            n_tokens = len(self._token_dictionary_)
+            tokens = [self._inverse_token_dictionary_[i] for i in range(n_tokens)]
+            heads, tails = np.divmod(self._kept_columns, n_tokens)
+            self._column_label_dictionary = dict(
+                zip(
+                    zip(
+                        map(tokens.__getitem__, heads.tolist()),
+                        map(tokens.__getitem__, tails.tolist()),
+                    ),
+                    range(self._kept_columns.shape[0]),
+                )
+            )
+        return self._column_label_dictionary
+
+    @property
+    def column_index_dictionary_(self):
+        """Dictionary mapping column indices to (head token, tail token) skip-grams,
+        built on first access."""
+        if self._column_index_dictionary is None:
+            self._column_index_dictionary = {
+                index: token for token, index in self.column_label_dictionary_.items()
+            }
+        return self._column_index_dictionary
+
     def fit_transform(self, X, y=None, **fit_params):
         self.fit(X, y, **fit_params)
         return self._train_matrix
@@ -441,24 +588,21 @@ class SkipgramVectorizer(BaseEstimator, TransformerMixin):
             self,
             [
                 "_token_dictionary_",
-                "_column_is_kept",
+                "_kept_columns",
             ],
         )
-        (token_sequences, _, _, _) = preprocess_token_sequences(
+        ((codes, indptr), _, _, _) = preprocess_token_sequences(
             X,
             self._token_dictionary_,
+            flat=True,
         )
 
-        n_unique_tokens = len(self._token_dictionary_)
-
-        row, col, data = skip_grams_matrix_coo_data(
-            token_sequences,
+        row, col, data = flat_skip_grams_coo_data(
+            codes,
+            indptr,
             self._window_sizes,
             self._kernel_function,
             tuple(*self.kernel_args.values()),
         )
 
-        base_matrix = scipy.sparse.coo_matrix((data, (row, col)))
-        result = base_matrix.tocsc()[:, self._column_is_kept].tocsr()
-
-        return result
+        return self._compact_columns(row, col, data, indptr.shape[0] - 1)
@@ -0,0 +1,225 @@
+import time
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+from scipy.sparse.linalg import LinearOperator
+from sklearn.utils.validation import check_random_state
+
+
+def csr_row_blocks(n_rows, block_size):
+    """Generate the (start, end) row ranges of consecutive blocks of at most
+    block_size rows covering n_rows rows."""
+    for start in range(0, n_rows, block_size):
+        yield start, min(start + block_size, n_rows)
+
+
+class NormalizedPowerCSROperator(LinearOperator):
+    """A linear operator for an L1 normalized, element-wise powered, sparse matrix
+    that never materializes the transformed matrix. Given the CSR arrays of a
+    non-negative matrix A this represents the matrix with entries
+
+        (A_ij / c_j / r_i) ** power   (column_normalize=True)
+        (A_ij / r_i) ** power         (column_normalize=False)
+
+    where c_j are the column sums of A and r_i the row sums of the (column
+    normalized) matrix. Since the transform factors as a row scaling times the
+    element-wise power of A times a column scaling, matrix products are computed
+    by streaming blocks of rows through the CSR arrays, powering only the data
+    of the current block. The CSR arrays may be numpy memmaps, in which case only
+    one block of rows need be resident in memory at a time.
+
+    Parameters
+    ----------
+    indptr: array of shape (n_rows + 1,)
+        The CSR row pointer array.
+
+    indices: array of shape (nnz,)
+        The CSR column indices.
+
+    data: array of shape (nnz,)
+        The CSR values.
+
+    shape: tuple (n_rows, n_cols)
+        The shape of the matrix.
+
+    power: float (optional, default=0.25)
+        The power to raise the normalized entries to.
+
+    column_normalize: bool (optional, default=True)
+        Whether to L1 normalize the columns before L1 normalizing the rows.
+
+    block_size: int (optional, default=65536)
+        The number of rows to process at a time.
+
+    dtype: numpy dtype or None (optional, default=None)
+        The dtype of matrix products. If None it is the floating point type of data.
+    """
+
+    def __init__(
+        self,
+        indptr,
+        indices,
+        data,
+        shape,
+        power=0.25,
+        column_normalize=True,
+        block_size=65536,
+        dtype=None,
+    ):
+        if dtype is None:
+            dtype = np.result_type(data.dtype, np.float32)
+        super().__init__(dtype=dtype, shape=shape)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.power = power
+        self.column_normalize = column_normalize
+        self.block_size = block_size
+        self._set_scalings()
+
+    @classmethod
+    def from_csr(cls, matrix, **kwargs):
+        """Build the operator over the arrays of a scipy.sparse CSR matrix
+        (without copying them)."""
+        return cls(matrix.indptr, matrix.indices, matrix.data, matrix.shape, **kwargs)
+
+    def _block(self, start, end, data=None):
+        first = self.indptr[start]
+        last = self.indptr[end]
+        if data is None:
+            data = np.power(np.abs(self.data[first:last]), self.power, dtype=self.dtype)
+        return scipy.sparse.csr_matrix(
+            (data, self.indices[first:last], self.indptr[start : end + 1] - first),
+            shape=(end - start, self.shape[1]),
+        )
+
+    def _set_scalings(self):
+        n_rows, n_cols = self.shape
+
+        if self.column_normalize:
+            column_sums = np.zeros(n_cols, dtype=np.float64)
+            for start, end in csr_row_blocks(n_rows, self.block_size):
+                first = self.indptr[start]
+                last = self.indptr[end]
+                column_sums += np.bincount(
+                    self.indices[first:last],
+                    weights=np.abs(self.data[first:last]),
+                    minlength=n_cols,
+                )
+            column_sums[column_sums == 0] = 1.0
+            inverse_column_sums = 1.0 / column_sums
+        else:
+            inverse_column_sums = np.ones(n_cols, dtype=np.float64)
+
+        row_sums = np.zeros(n_rows, dtype=np.float64)
+        for start, end in csr_row_blocks(n_rows, self.block_size):
+            first = self.indptr[start]
+            last = self.indptr[end]
+            block = self._block(
+                start,
+                end,
+                np.abs(self.data[first:last]) * inverse_column_sums[self.indices[first:last]],
+            )
+            row_sums[start:end] = np.asarray(block.sum(axis=1)).ravel()
+        row_sums[row_sums == 0] = 1.0
+
+        self.row_scale_ = np.power(row_sums, -self.power).astype(self.dtype)
+        self.column_scale_ = np.power(inverse_column_sums, self.power).astype(
+            self.dtype
+        )
+
+    def _matmat(self, X):
+        X = self.column_scale_[:, None] * np.asarray(X, dtype=self.dtype)
+        result = np.empty((self.shape[0], X.shape[1]), dtype=self.dtype)
+        for start, end in csr_row_blocks(self.shape[0], self.block_size):
+            result[start:end] = self.row_scale_[start:end, None] * (
+                self._block(start, end) @ X
+            )
+        return result
+
+    def _rmatmat(self, X):
+        X = np.asarray(X, dtype=self.dtype)
+        result = np.zeros((self.shape[1], X.shape[1]), dtype=self.dtype)
+        for start, end in csr_row_blocks(self.shape[0], self.block_size):
+            result += self._block(start, end).T @ (
+                self.row_scale_[start:end, None] * X[start:end]
+            )
+        return self.column_scale_[:, None] * result
+
+    def _matvec(self, x):
+        return self._matmat(np.reshape(x, (-1, 1))).ravel()
+
+    def _rmatvec(self, x):
+        return self._rmatmat(np.reshape(x, (-1, 1))).ravel()
+
+
+def blocked_randomized_svd(
+    operator,
+    n_components,
+    n_oversamples=10,
+    n_iter=4,
+    random_state=None,
+    timings=None,
+):
+    """Compute a truncated randomized SVD (Halko, Martinsson and Tropp) of a linear
+    operator using only block matrix products with it and its transpose. Paired with
+    a NormalizedPowerCSROperator this streams blocks of rows of the underlying
+    sparse matrix and never holds more than a dense (n, n_components + n_oversamples)
+    basis in memory.
+
+    Parameters
+    ----------
+    operator: scipy.sparse.linalg.LinearOperator
+        The operator to decompose; it must support matmat and rmatmat.
+
+    n_components: int
+        The number of singular values and vectors to compute.
+
+    n_oversamples: int (optional, default=10)
+        Additional random vectors used to sample the range of the operator.
+
+    n_iter: int (optional, default=4)
+        The number of power iterations.
+
+    random_state: int, numpy.random.RandomState or None (optional, default=None)
+        The random state used to draw the random test matrix.
+
+    timings: dict or None (optional, default=None)
+        If provided, the wall time in seconds of each stage ("range_finder",
+        "power_iterations", "projection", "small_svd") is recorded in it.
+
+    Returns
+    -------
+    u: array of shape (n_rows, n_components)
+    s: array of shape (n_components,)
+    vt: array of shape (n_components, n_cols)
+    """
+    random_state = check_random_state(random_state)
+    if timings is None:
+        timings = {}
+    n_random = min(n_components + n_oversamples, min(operator.shape))
+
+    start_time = time.perf_counter()
+    omega = random_state.normal(size=(operator.shape[1], n_random)).astype(
+        operator.dtype
+    )
+    Q, _ = scipy.linalg.qr(operator.matmat(omega), mode="economic")
+    timings["range_finder"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for i in range(n_iter):
+        Q, _ = scipy.linalg.qr(operator.rmatmat(Q), mode="economic")
+        Q, _ = scipy.linalg.qr(operator.matmat(Q), mode="economic")
+    timings["power_iterations"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    B = operator.rmatmat(Q).T
+    timings["projection"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    u_hat, s, vt = scipy.linalg.svd(B, full_matrices=False)
+    u = Q @ u_hat
+    timings["small_svd"] = time.perf_counter() - start_time
+
+    return u[:, :n_components], s[:n_components], vt[:n_components]
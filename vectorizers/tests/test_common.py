@@ -1,10 +1,16 @@
 import pytest
+import warnings
+import pickle
 from sklearn.preprocessing import normalize
 
 import scipy.sparse
 import numpy as np
 import pandas as pd
+import numba
+from numba.typed import List
+from numba.core.errors import NumbaTypeSafetyWarning
 
+import vectorizers.utils
 from vectorizers import TokenCooccurrenceVectorizer
 from vectorizers import TimedTokenCooccurrenceVectorizer
 from vectorizers import NgramCooccurrenceVectorizer
@@ -19,18 +25,45 @@ from vectorizers import WassersteinVectorizer
 from vectorizers import ApproximateWassersteinVectorizer
 from vectorizers import SinkhornVectorizer
 from vectorizers import LZCompressionVectorizer, BytePairEncodingVectorizer
+from vectorizers import EncodedCorpus
+from vectorizers import LabelledForest
 
 from vectorizers.ngram_vectorizer import ngrams_of
+from vectorizers.skip_gram_vectorizer import (
+    build_skip_grams,
+    skip_grams_matrix_coo_data,
+)
+from vectorizers.multi_token_cooccurence_vectorizer import flatten_multiset_sequences
+from vectorizers.svd_utils import NormalizedPowerCSROperator
 from vectorizers._vectorizers import find_bin_boundaries
 from vectorizers.tree_token_cooccurrence import (
     build_tree_skip_grams,
 )
-from vectorizers.preprocessing import remove_node
+from vectorizers.preprocessing import (
+    remove_node,
+    preprocess_tree_sequences,
+    labelled_forest_from_trees,
+    encode_token_sequence,
+    encode_token_sequences,
+    construct_document_frequency,
+    construct_timed_document_frequency,
+    preprocess_timed_token_sequences,
+    preprocess_multi_token_sequences,
+    prune_token_dictionary,
+    PruningPlanCache,
+    select_top_k,
+    preprocess_token_sequences,
+)
 from vectorizers._window_kernels import (
     harmonic_kernel,
     flat_kernel,
 )
-from vectorizers.utils import summarize_embedding, categorical_columns_to_list
+from vectorizers.utils import (
+    summarize_embedding,
+    categorical_columns_to_list,
+    validate_homogeneous_token_types,
+    sparse_collapse,
+)
 from vectorizers.mixed_gram_vectorizer import to_unicode
 
 token_data = (
@@ -239,6 +272,83 @@ def test_LabeledTreeCooccurrenceVectorizer_reduced_vocab():
     assert result.shape == (3, 3)
 
 
+@pytest.mark.parametrize("window_orientation", ["after", "directional"])
+def test_LabeledTreeCooccurrenceVectorizer_n_threads(window_orientation):
+    trees = tree_sequence + seq_tree_sequence
+    model = LabelledTreeCooccurrenceVectorizer(
+        window_radius=2, window_orientation=window_orientation
+    )
+    threaded_model = LabelledTreeCooccurrenceVectorizer(
+        window_radius=2, window_orientation=window_orientation, n_threads=3
+    )
+    result = model.fit_transform(trees)
+    threaded_result = threaded_model.fit_transform(trees)
+    assert model.column_label_dictionary_ == threaded_model.column_label_dictionary_
+    assert np.allclose(result.toarray(), threaded_result.toarray())
+    assert np.allclose(
+        model.transform(trees[1:]).toarray(),
+        threaded_model.transform(trees[1:]).toarray(),
+    )
+
+
+@pytest.mark.parametrize("n_threads", [1, 2])
+def test_LabeledTreeCooccurrenceVectorizer_forest(n_threads):
+    trees = tree_sequence + seq_tree_sequence
+    model = LabelledTreeCooccurrenceVectorizer(
+        window_radius=2, min_occurrences=2, n_threads=n_threads
+    )
+    result = model.fit_transform(trees)
+    # The same trees given as a single edge list over all the nodes
+    node_offsets = np.array([0, 4, 8, 10, 12, 15])
+    parents = np.array([0, 1, 2, 4, 5, 6, 8, 10, 12, 13])
+    forest = LabelledForest(
+        scipy.sparse.coo_matrix(
+            (np.ones(10), (parents, parents + 1)), shape=(15, 15)
+        ),
+        np.concatenate([labels for _, labels in trees]),
+        node_offsets,
+    )
+    forest_model = LabelledTreeCooccurrenceVectorizer(
+        window_radius=2, min_occurrences=2, n_threads=n_threads
+    )
+    forest_result = forest_model.fit_transform(forest)
+    assert model.column_label_dictionary_ == forest_model.column_label_dictionary_
+    assert np.allclose(result.toarray(), forest_result.toarray())
+    assert np.allclose(
+        model.transform(trees).toarray(), forest_model.transform(forest).toarray()
+    )
+
+    from_trees = labelled_forest_from_trees(trees)
+    assert np.array_equal(from_trees.node_offsets, node_offsets)
+    assert np.allclose(from_trees.adjacency.toarray(), forest.adjacency.toarray())
+
+    # Edges between trees are rejected
+    with pytest.raises(ValueError):
+        forest_model.transform(forest._replace(node_offsets=np.array([0, 6, 15])))
+
+
+@pytest.mark.parametrize("n_threads", [1, 2])
+def test_preprocess_tree_sequences_contraction(n_threads):
+    # 0 -> 1 -> 2 -> 3 with a second branch 1 -> 4; nodes 1 and 2 are removed
+    adjacency = scipy.sparse.csr_matrix(
+        ([1.0, 2.0, 3.0, 4.0], ([0, 1, 2, 1], [1, 2, 3, 4])), shape=(5, 5)
+    )
+    labels = np.array(["a", "x", "x", "b", "c"])
+    result, token_dictionary, _, _ = preprocess_tree_sequences(
+        [(adjacency, labels), (adjacency, labels)],
+        tuple(labels) * 2,
+        ignored_tokens={"x"},
+        n_threads=n_threads,
+    )
+    assert token_dictionary == {"a": 0, "b": 1, "c": 2}
+    expected = np.zeros((5, 5))
+    expected[0, 3] = 3.0
+    expected[0, 4] = 4.0
+    for result_matrix, result_labels in result:
+        assert np.array_equal(result_matrix.toarray(), expected)
+        assert np.array_equal(result_labels, labels)
+
+
 def test_node_removal():
     graph = scipy.sparse.random(10, 10, 0.1, format="csr")
     graph.data = np.ones_like(graph.data)
@@ -262,6 +372,220 @@ def test_node_removal():
             )
 
 
+@pytest.mark.parametrize(
+    "tokens",
+    [
+        ["c", "a", "b", "a", "c", "c"],
+        np.array(["c", "a", "b", "a", "c", "c"]),
+        [3, 1, 2, 1, 3, 3],
+        np.array([3, 1, 2, 1, 3, 3]),
+    ],
+)
+def test_encode_token_sequence(tokens):
+    codes, token_dictionary, token_counts = encode_token_sequence(tokens)
+    assert list(token_dictionary.keys()) == sorted(set(np.asarray(tokens).tolist()))
+    assert list(token_dictionary.values()) == [0, 1, 2]
+    assert np.array_equal(codes, [2, 0, 1, 0, 2, 2])
+    assert np.array_equal(token_counts, [2, 1, 3])
+
+    fixed_dictionary = {tokens[1]: 1, tokens[0]: 0}
+    codes, token_dictionary, token_counts = encode_token_sequence(
+        tokens, fixed_dictionary
+    )
+    assert token_dictionary is fixed_dictionary
+    assert np.array_equal(codes, [0, 1, -1, 1, 0, 0])
+    assert np.array_equal(token_counts, [3, 2])
+
+
+def test_encode_token_sequences():
+    documents = [["b", "a", "b"], np.array(["c", "a"]), [], ["c"]]
+    (
+        codes,
+        lengths,
+        token_dictionary,
+        token_counts,
+        document_counts,
+    ) = encode_token_sequences(iter(documents), document_counts=True)
+    assert token_dictionary == {"a": 0, "b": 1, "c": 2}
+    assert np.array_equal(codes, [1, 0, 1, 2, 0, 2])
+    assert np.array_equal(lengths, [3, 2, 0, 1])
+    assert np.array_equal(token_counts, [2, 2, 2])
+    assert np.array_equal(document_counts, [2, 1, 2])
+
+
+def test_construct_document_frequency():
+    documents = [["a", "b", "a"], ["b"], [], ["c", "c", "a"]]
+    token_dictionary = {"a": 0, "b": 1, "c": 2}
+    expected = np.array([2, 2, 1]) / 4
+    assert np.allclose(
+        construct_document_frequency(documents, token_dictionary), expected
+    )
+    timed_documents = [[(token, 1.0) for token in doc] for doc in documents]
+    assert np.allclose(
+        construct_timed_document_frequency(timed_documents, token_dictionary),
+        expected,
+    )
+
+
+def test_preprocess_timed_token_sequences_empty_document():
+    documents = [[("a", 1.0), ("b", 2.0)], [("b", 3.0)], [("c", 4.0)]]
+    result, token_dictionary, _, _ = preprocess_timed_token_sequences(
+        documents, min_occurrences=2
+    )
+    assert token_dictionary == {"b": 0}
+    assert np.array_equal(result[0], [[0.0, 2.0]])
+    assert np.array_equal(result[1], [[0.0, 3.0]])
+    assert result[2].shape == (0, 2)
+
+
+def test_preprocess_multi_token_sequences_flat():
+    documents = [[["a", "b"], ["c"], [], ["a", "d", "d"]], [["d"], ["a", "c"]]]
+    nested, token_dictionary, _, _ = preprocess_multi_token_sequences(
+        documents, masking="m", min_occurrences=2
+    )
+    assert token_dictionary == {"a": 0, "c": 1, "d": 2, "m": 3}
+    (tokens, set_indptr, doc_indptr), _, _, _ = preprocess_multi_token_sequences(
+        documents, masking="m", min_occurrences=2, flat=True
+    )
+    assert np.array_equal(tokens, [0, 3, 1, 0, 2, 2, 2, 0, 1])
+    assert np.array_equal(set_indptr, [0, 2, 3, 3, 6, 7, 9])
+    assert np.array_equal(doc_indptr, [0, 4, 6])
+    for result, expected in zip(
+        flatten_multiset_sequences(nested), (tokens, set_indptr, doc_indptr)
+    ):
+        assert np.array_equal(result, expected)
+
+
+def test_prune_token_dictionary_cached():
+    token_dictionary = {"apple": 0, "banana": 1, "cherry": 2, "avocado": 3}
+    token_frequencies = np.array([0.1, 0.4, 0.3, 0.2], dtype=np.float32)
+    plan_cache = PruningPlanCache()
+    for _ in range(3):
+        new_dictionary, new_frequencies = prune_token_dictionary(
+            token_dictionary,
+            token_frequencies,
+            ignored_tokens={"cherry"},
+            excluded_token_regex="a.*",
+            plan_cache=plan_cache,
+        )
+        assert new_dictionary == {"banana": 0}
+        assert np.allclose(new_frequencies, [0.4])
+        # Results handed out from the cache must not share state with it
+        new_dictionary["mask"] = 1
+        new_frequencies[0] = 0.0
+    info = plan_cache.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+    plan_cache.cache_clear()
+    assert plan_cache.cache_info() == (0, 0, plan_cache.maxsize, 0)
+
+
+def test_prune_token_dictionary_cache_bound():
+    plan_cache = PruningPlanCache()
+    token_dictionary = {"a": 0, "b": 1, "c": 2}
+    new_dictionary, _ = prune_token_dictionary(
+        token_dictionary, [0.5, 0.3, 0.2], max_unique_tokens=2, plan_cache=plan_cache
+    )
+    assert new_dictionary == {"a": 0, "b": 1}
+    # Different frequencies for the same dictionary get their own plan
+    new_dictionary, _ = prune_token_dictionary(
+        token_dictionary, [0.1, 0.3, 0.6], max_unique_tokens=2, plan_cache=plan_cache
+    )
+    assert new_dictionary == {"b": 0, "c": 1}
+    assert plan_cache.cache_info().hits == 0
+    # A cache never serves a different vocabulary, even one of the same size
+    with pytest.raises(ValueError):
+        prune_token_dictionary(
+            {"x": 0, "y": 1, "z": 2},
+            [0.5, 0.3, 0.2],
+            max_unique_tokens=2,
+            plan_cache=plan_cache,
+        )
+    plan_cache.cache_clear()
+    new_dictionary, _ = prune_token_dictionary(
+        {"x": 0, "y": 1, "z": 2},
+        [0.5, 0.3, 0.2],
+        max_unique_tokens=2,
+        excluded_token_regex="x",
+        plan_cache=plan_cache,
+    )
+    assert new_dictionary == {"y": 0, "z": 1}
+
+
+@pytest.mark.parametrize(
+    "vectorizer_class",
+    [TimedTokenCooccurrenceVectorizer, MultiSetCooccurrenceVectorizer],
+)
+def test_encoded_corpus_unsupported(vectorizer_class):
+    corpus = EncodedCorpus(text_token_data)
+    model = vectorizer_class()
+    with pytest.raises(TypeError, match="EncodedCorpus"):
+        model.fit(corpus)
+    with pytest.raises(TypeError, match="EncodedCorpus"):
+        model.fit_transform(corpus)
+
+
+def test_encoded_corpus_pruning_plans():
+    corpus = EncodedCorpus(text_token_data)
+    for window_radius in (1, 2, 3):
+        TokenCooccurrenceVectorizer(
+            min_occurrences=2, window_radii=window_radius
+        ).fit(corpus)
+    TokenCooccurrenceVectorizer(min_occurrences=3).fit(corpus)
+    info = corpus.pruning_plans.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (2, 2, 2)
+    # Vectorizers fitted on plain token sequences do not touch the corpus cache
+    TokenCooccurrenceVectorizer(min_occurrences=2).fit(text_token_data)
+    assert corpus.pruning_plans.cache_info().hits == 2
+    restored = pickle.loads(pickle.dumps(corpus))
+    assert restored.pruning_plans.cache_info().currsize == 0
+
+
+def test_max_unique_tokens_ties():
+    values = np.array([3.0, 1.0, 2.0, 2.0, 5.0, 2.0, 0.0])
+    assert np.array_equal(select_top_k(values, 3), [0, 2, 4])
+    assert np.array_equal(select_top_k(values, 4), [0, 2, 3, 4])
+    assert np.array_equal(select_top_k(values, 10), np.arange(7))
+    assert select_top_k(values, 0).shape == (0,)
+
+    _, token_dictionary, _, _ = preprocess_token_sequences(
+        [["a", "b", "b", "c", "c", "d", "d"]], max_unique_tokens=2
+    )
+    assert token_dictionary == {"b": 0, "c": 1}
+
+
+@pytest.mark.parametrize(
+    "vectorizer_class, kwargs",
+    [
+        (TokenCooccurrenceVectorizer, {"min_occurrences": 3, "mask_string": "m"}),
+        (NgramVectorizer, {"ngram_size": 2}),
+        (SkipgramVectorizer, {"max_unique_tokens": 3}),
+    ],
+)
+def test_encoded_corpus(vectorizer_class, kwargs):
+    corpus = EncodedCorpus(text_token_data)
+    assert len(corpus) == len(text_token_data)
+    assert corpus.n_tokens == sum(len(doc) for doc in text_token_data)
+    model = vectorizer_class(**kwargs).fit(corpus)
+    expected_model = vectorizer_class(**kwargs).fit(text_token_data)
+    assert model.column_label_dictionary_ == expected_model.column_label_dictionary_
+    result = model.transform(corpus)
+    expected = expected_model.transform(text_token_data)
+    assert np.allclose(result.toarray(), expected.toarray())
+
+
+def test_preprocessing_n_processes():
+    model = TokenCooccurrenceVectorizer(min_occurrences=2, n_processes=2)
+    expected_model = TokenCooccurrenceVectorizer(min_occurrences=2)
+    result = model.fit_transform(text_token_data)
+    expected = expected_model.fit_transform(text_token_data)
+    assert model.token_label_dictionary_ == expected_model.token_label_dictionary_
+    assert np.allclose(result.toarray(), expected.toarray())
+
+    result = NgramVectorizer(n_processes=2).fit_transform(text_token_data)
+    expected = NgramVectorizer().fit_transform(text_token_data)
+    assert (result != expected).nnz == 0
+
+
 def test_build_tree_skip_grams_contract():
     (result_matrix, result_labels) = build_tree_skip_grams(
         token_sequence=path_graph_labels,
@@ -288,6 +612,28 @@ def test_build_tree_skip_grams_no_contract():
     assert np.array_equal(unique_labels, result_labels)
 
 
+def test_build_tree_skip_grams_matches_adjacency_powers():
+    # Weighted walks on a graph that is not a tree match the sum of the
+    # weighted powers of its adjacency matrix
+    adjacency = scipy.sparse.csr_matrix(
+        path_graph_two_out.multiply(np.arange(1.0, 5.0))
+    )
+    (result_matrix, result_labels) = build_tree_skip_grams(
+        token_sequence=unique_labels,
+        adjacency_matrix=adjacency,
+        kernel_function=harmonic_kernel,
+        kernel_args=dict(),
+        window_size=3,
+    )
+    expected_result = (
+        adjacency
+        + adjacency @ adjacency / 2.0
+        + adjacency @ adjacency @ adjacency / 3.0
+    )
+    assert np.allclose(result_matrix.toarray(), expected_result.toarray())
+    assert np.array_equal(unique_labels, result_labels)
+
+
 def test_harmonic_kernel():
     kernel = harmonic_kernel([0, 0, 0, 0])
     assert kernel[0] == 1.0
@@ -300,6 +646,58 @@ def test_flat_kernel():
     assert np.all(kernel == 1.0)
 
 
+def test_validate_homogeneous_token_types():
+    assert validate_homogeneous_token_types(token_data)
+    assert validate_homogeneous_token_types([np.array(seq) for seq in token_data])
+    assert validate_homogeneous_token_types(text_token_data)
+
+    mixed = list(token_data) + [("a", 1)]
+    with pytest.raises(ValueError), pytest.warns(UserWarning):
+        validate_homogeneous_token_types(mixed)
+    with pytest.raises(ValueError), pytest.warns(UserWarning):
+        validate_homogeneous_token_types([np.array(seq) for seq in token_data] + [[1]])
+    # A sample that misses the offending document passes
+    assert validate_homogeneous_token_types(mixed, sample_size=0)
+    with pytest.raises(ValueError), pytest.warns(UserWarning):
+        validate_homogeneous_token_types(mixed, sample_size=len(mixed))
+
+
+@pytest.mark.parametrize(
+    "vectorizer_class",
+    [TokenCooccurrenceVectorizer, NgramVectorizer, SkipgramVectorizer],
+)
+def test_validate_data_sample_size(vectorizer_class, monkeypatch):
+    sample_sizes = []
+
+    def validate(data, sample_size=None, random_state=None):
+        sample_sizes.append(sample_size)
+        return True
+
+    monkeypatch.setattr(
+        vectorizers.utils, "validate_homogeneous_token_types", validate
+    )
+    vectorizer_class(validate_data=2).fit(text_token_data)
+    vectorizer_class(validate_data=True).fit(text_token_data)
+    vectorizer_class(validate_data=False).fit(text_token_data)
+    assert sample_sizes == [2, None]
+
+    monkeypatch.undo()
+    with pytest.raises(ValueError), pytest.warns(UserWarning):
+        vectorizer_class(validate_data=len(mixed_token_data)).fit(mixed_token_data)
+
+
+@pytest.mark.parametrize("labels", [path_graph_labels, ["a"] * 4, ["b", "a", "b", "a"]])
+def test_sparse_collapse(labels):
+    matrix = scipy.sparse.csr_matrix(path_graph_two_out.multiply(np.arange(1.0, 5.0)))
+    result, result_labels = sparse_collapse(matrix, labels)
+    assert np.array_equal(result_labels, np.unique(labels))
+    indicator = np.array(labels)[:, None] == result_labels[None, :]
+    expected = indicator.T @ matrix.toarray() @ indicator
+    assert np.allclose(result.toarray(), expected)
+    dense_result, _ = sparse_collapse(matrix, labels, sparse=False)
+    assert np.allclose(dense_result, expected)
+
+
 @pytest.mark.parametrize("min_token_occurrences", [None, 2])
 @pytest.mark.parametrize("max_document_frequency", [None, 0.7])
 @pytest.mark.parametrize("window_orientation", ["before", "after"])
@@ -424,6 +822,138 @@ def test_equality_of_CooccurrenceVectorizers(
     )
 
 
+def test_flatten_multiset_sequences():
+    sequences = List()
+    for doc in (([1, 2], [3]), ([], [4, 4, 1]), ()):
+        doc_list = List.empty_list(numba.int32[::1])
+        for mset in doc:
+            doc_list.append(np.array(mset, dtype=np.int32))
+        sequences.append(doc_list)
+    tokens, set_indptr, doc_indptr = flatten_multiset_sequences(sequences)
+    assert np.all(tokens == np.array([1, 2, 3, 4, 4, 1]))
+    assert np.all(set_indptr == np.array([0, 2, 3, 3, 6]))
+    assert np.all(doc_indptr == np.array([0, 2, 4, 4]))
+
+
+@pytest.mark.parametrize("n_iter", [0, 1])
+def test_multiset_cooccurrence_vectorizer_threads(n_iter):
+    data = [
+        [["a", "b"], ["c"], [], ["a", "d", "d"]],
+        [["d"], ["a", "c"]],
+        [["b", "b", "c"], ["a"], ["c", "d"], ["a", "b"], ["d"]],
+        [["c"]],
+    ]
+    serial = MultiSetCooccurrenceVectorizer(window_radii=2, n_iter=n_iter)
+    parallel = MultiSetCooccurrenceVectorizer(
+        window_radii=2, n_iter=n_iter, n_threads=3
+    )
+    assert np.allclose(
+        serial.fit_transform(data).toarray(), parallel.fit_transform(data).toarray()
+    )
+    assert np.allclose(
+        serial.transform(data).toarray(), parallel.transform(data).toarray()
+    )
+
+
+@pytest.mark.parametrize("column_normalize", [True, False])
+def test_normalized_power_csr_operator(column_normalize):
+    matrix = scipy.sparse.random(
+        50, 80, density=0.1, format="csr", random_state=42, dtype=np.float32
+    )
+    operator = NormalizedPowerCSROperator.from_csr(
+        matrix, power=0.25, column_normalize=column_normalize, block_size=7
+    )
+    if column_normalize:
+        expected = normalize(normalize(matrix, axis=0, norm="l1"), axis=1, norm="l1")
+    else:
+        expected = normalize(matrix, axis=1, norm="l1")
+    expected.data = np.power(expected.data, 0.25)
+    assert np.allclose(operator @ np.eye(80), expected.toarray(), atol=1e-6)
+    assert np.allclose(operator.T @ np.eye(50), expected.T.toarray(), atol=1e-6)
+
+
+@pytest.mark.parametrize("algorithm", ["arpack", "randomized"])
+def test_cooccurrence_vectorizer_reduce_dimension(algorithm):
+    vectorizer = TokenCooccurrenceVectorizer(window_radii=2).fit(token_data)
+    embedding = vectorizer.reduce_dimension(
+        dimension=2, algorithm=algorithm, block_size=3, random_state=42
+    )
+    assert embedding.shape == (len(vectorizer.token_label_dictionary_), 2)
+    assert "svd" in vectorizer.reduction_timings_
+
+    expected = normalize(vectorizer.cooccurrences_, axis=0, norm="l1")
+    expected = normalize(expected, axis=1, norm="l1")
+    expected.data = np.power(expected.data, 0.25)
+    singular_values = np.linalg.svd(expected.toarray(), compute_uv=False)[:2]
+    assert np.allclose(
+        np.sort(np.linalg.norm(embedding, axis=0) ** 2)[::-1],
+        singular_values,
+        atol=1e-3,
+    )
+
+
+def test_cooccurrence_vectorizer_window_size_distribution():
+    vectorizer = TokenCooccurrenceVectorizer(
+        window_radii=[2, 6],
+        window_functions=["fixed", "variable"],
+        kernel_functions=["flat", "flat"],
+        window_orientations=["before", "after"],
+    ).fit(text_token_data)
+    n_rows = len(vectorizer.token_label_dictionary_)
+    assert vectorizer._window_len_array.dtype == np.uint16
+    assert vectorizer._window_len_array.shape == (n_rows + 1, 2)
+    assert vectorizer._window_len_array.flags["C_CONTIGUOUS"]
+
+    distribution = vectorizer.window_size_distribution()
+    assert list(distribution.columns) == [
+        "window",
+        "radius",
+        "n_rows",
+        "frequency",
+        "skipgram_share",
+    ]
+    fixed = distribution[distribution.window == 0]
+    assert fixed.radius.tolist() == [2]
+    assert fixed.n_rows.tolist() == [n_rows]
+    for window, group in distribution.groupby("window"):
+        assert group.n_rows.sum() == n_rows
+        assert np.isclose(group.skipgram_share.sum(), 1.0)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize(
+    "vectorizer_class, kwargs",
+    [
+        (TokenCooccurrenceVectorizer, {}),
+        (NgramCooccurrenceVectorizer, {"ngram_size": 2}),
+    ],
+)
+def test_cooccurrence_vectorizer_save_load(tmp_path, vectorizer_class, kwargs, mmap):
+    vectorizer = vectorizer_class(window_radii=2, **kwargs).fit(text_token_data)
+    vectorizer.reduce_dimension(dimension=2, algorithm="randomized", random_state=42)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", NumbaTypeSafetyWarning)
+        vectorizer.save(tmp_path / "model")
+        loaded = type(vectorizer).load(tmp_path / "model", mmap=mmap)
+        loaded_result = loaded.transform(text_token_data)
+    if hasattr(vectorizer, "_raw_ngram_dictionary_"):
+        assert (
+            loaded._raw_ngram_dictionary_._dict_type
+            == vectorizer._raw_ngram_dictionary_._dict_type
+        )
+        assert len(loaded._raw_ngram_dictionary_) == len(
+            vectorizer._raw_ngram_dictionary_
+        )
+    assert type(loaded) is type(vectorizer)
+    assert loaded.token_label_dictionary_ == vectorizer.token_label_dictionary_
+    assert loaded.column_label_dictionary_ == vectorizer.column_label_dictionary_
+    assert (loaded.cooccurrences_ != vectorizer.cooccurrences_).nnz == 0
+    assert np.array_equal(loaded.reduced_matrix_, vectorizer.reduced_matrix_)
+    assert np.allclose(
+        loaded_result.toarray(), vectorizer.transform(text_token_data).toarray()
+    )
+
+
 def test_reverse_cooccurrence_vectorizer():
     seq_model1 = TokenCooccurrenceVectorizer(
         window_radii=2,
@@ -649,6 +1179,75 @@ def test_ngram_vectorizer_text():
     assert len((result[1, :]).data) == 0
 
 
+@pytest.mark.parametrize("ngram_behaviour", ["exact", "subgrams"])
+def test_ngram_vectorizer_counts(ngram_behaviour):
+    vectorizer = NgramVectorizer(ngram_size=2, ngram_behaviour=ngram_behaviour)
+    result = vectorizer.fit_transform(text_token_data)
+    expected = np.zeros(result.shape)
+    for row, sequence in enumerate(text_token_data):
+        for i in range(len(sequence)):
+            if ngram_behaviour == "subgrams":
+                expected[row, vectorizer.column_label_dictionary_[sequence[i]]] += 1
+            if i + 2 <= len(sequence):
+                ngram = tuple(sequence[i : i + 2])
+                expected[row, vectorizer.column_label_dictionary_[ngram]] += 1
+    assert np.all(result.toarray() == expected)
+    assert np.all(vectorizer.transform(text_token_data).toarray() == expected)
+
+
+@pytest.mark.parametrize("ngram_behaviour", ["exact", "subgrams"])
+def test_ngram_vectorizer_trie_reuse(ngram_behaviour):
+    vectorizer = NgramVectorizer(ngram_size=2, ngram_behaviour=ngram_behaviour)
+    result = vectorizer.fit_transform(text_token_data)
+    # Learned columns are in token order, with subgrams before their extensions
+    labels = [
+        label if isinstance(label, tuple) else (label,)
+        for label in vectorizer.column_label_dictionary_
+    ]
+    assert labels == sorted(labels)
+    # The trie built in fit is reused by transform, and rebuilt after unpickling
+    trie = vectorizer._ngram_trie_
+    assert np.all(vectorizer.transform(text_token_data).toarray() == result.toarray())
+    assert vectorizer._ngram_trie_ is trie
+    restored = pickle.loads(pickle.dumps(vectorizer))
+    assert restored._ngram_trie_ is None
+    assert np.all(restored.transform(text_token_data).toarray() == result.toarray())
+
+
+def test_ngram_vectorizer_n_threads():
+    vectorizer = NgramVectorizer(ngram_size=2, ngram_behaviour="subgrams").fit(
+        text_token_data
+    )
+    threaded = NgramVectorizer(
+        ngram_size=2, ngram_behaviour="subgrams", n_threads=3
+    ).fit(text_token_data)
+    result = vectorizer.transform(text_token_data * 3)
+    threaded_result = threaded.transform(text_token_data * 3)
+    assert np.array_equal(result.indptr, threaded_result.indptr)
+    assert np.array_equal(result.indices, threaded_result.indices)
+    assert np.array_equal(result.data, threaded_result.data)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"min_document_occurrences": 2}])
+def test_ngram_vectorizer_hashing(kwargs):
+    vectorizer = NgramVectorizer(ngram_size=2, **kwargs).fit(text_token_data)
+    hashing = NgramVectorizer(ngram_size=2, n_features=2 ** 30, **kwargs).fit(
+        text_token_data
+    )
+    result = hashing.transform(text_token_data)
+    assert result.shape == (len(text_token_data), 2 ** 30)
+    assert len(hashing.column_label_dictionary_) == 0
+    assert (result != hashing._train_matrix).nnz == 0
+    # Without collisions the hashed columns are a permutation of the n-gram columns
+    expected = vectorizer.transform(text_token_data)
+    columns = np.unique(result.indices)
+    assert columns.shape[0] == len(vectorizer.column_label_dictionary_)
+    assert np.array_equal(
+        np.sort(result[:, columns].toarray(), axis=1),
+        np.sort(expected.toarray(), axis=1),
+    )
+
+
 def test_ngram_vectorizer_mixed():
     vectorizer = SkipgramVectorizer()
     with pytest.raises(ValueError):
@@ -683,6 +1282,35 @@ def test_ngram_vectorizer_max_doc_freq():
     assert np.all(count_matrix.toarray() == np.array([[0, 0], [1, 0], [0, 1]]))
 
 
+def test_skip_grams_matrix_coo_data():
+    # Tokens are 1 to 4, so there are five token indices
+    window_sizes = np.full(6, 2)
+    row, col, data = skip_grams_matrix_coo_data(
+        token_data, window_sizes, harmonic_kernel, ()
+    )
+    result = scipy.sparse.coo_matrix((data, (row, col)), shape=(6, 25)).toarray()
+    expected = np.zeros((6, 25))
+    for i, sequence in enumerate(token_data):
+        for head, tail, weight in build_skip_grams(
+            np.array(sequence), window_sizes, harmonic_kernel, ()
+        ):
+            expected[i, int(head) * 5 + int(tail)] += weight
+    assert np.allclose(result, expected)
+
+
+def test_build_skip_grams_large_token_indices():
+    # Token indices above 2**24 are not representable exactly as float32
+    token = 2 ** 24 + 1
+    window_sizes = np.full(token + 2, 2, dtype=np.int8)
+    result = build_skip_grams(
+        np.array([token, token + 1, token]), window_sizes, flat_kernel, ()
+    )
+    expected = np.array(
+        [[token, token, 1.0], [token, token + 1, 1.0], [token + 1, token, 1.0]]
+    )
+    assert np.array_equal(result, expected)
+
+
 def test_skipgram_vectorizer_basic():
     vectorizer = SkipgramVectorizer()
     result = vectorizer.fit_transform(token_data)
@@ -714,6 +1342,22 @@ def test_skipgram_vectorizer_text():
     assert len((result[1, :]).data) == 0
 
 
+def test_skipgram_vectorizer_transform_new_data():
+    vectorizer = SkipgramVectorizer(window_radius=2).fit(text_token_data)
+    result = vectorizer.transform(text_token_data_new_token + ((),))
+    assert result.shape == (3, len(vectorizer.column_label_dictionary_))
+    # The documents are ("foo", "pok") and ("pok", "foo", "foo") once "zaz" is dropped
+    columns = vectorizer.column_label_dictionary_
+    expected = np.zeros(result.shape)
+    expected[0, columns[("foo", "pok")]] = 1
+    expected[1, columns[("pok", "foo")]] = 2
+    expected[1, columns[("foo", "foo")]] = 1
+    assert np.all(result.toarray() == expected)
+    assert vectorizer.column_index_dictionary_[
+        vectorizer.column_label_dictionary_[("foo", "pok")]
+    ] == ("foo", "pok")
+
+
 def test_skipgram_vectorizer_mixed():
     vectorizer = SkipgramVectorizer()
     with pytest.raises(ValueError):
@@ -45,7 +45,7 @@ def numba_build_skip_grams(
     n_unique_tokens: int
         The number of unique tokens in the token_dictionary.
 
-    window_size_array: numpy.ndarray(float, size = (n_windows, n_unique_tokens))
+    window_size_array: numpy.ndarray(uint16, size = (n_unique_tokens, n_windows))
         A collection of window sizes per vocabulary index per window function
 
     window_reversals: numpy.array(bool, size = (n_windows,))
@@ -72,7 +72,7 @@ def numba_build_skip_grams(
         Weight counts of values (kernel weighted counts) that token_head[i] cooccurred with token_tail[i]
     """
 
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     array_mul = n_windows * n_unique_tokens + 1
 
     coo_data = [
@@ -97,7 +97,7 @@ def numba_build_skip_grams(
             for i in range(n_windows):
                 win = window_at_index(
                     seq,
-                    window_size_array[i, target_word],
+                    window_size_array[target_word, i],
                     w_i,
                     reverse=window_reversals[i],
                 )
@@ -161,7 +161,7 @@ def numba_em_cooccurrence_iteration(
     token_sequences: Iterable of Iterables
         The collection of  (token, time_stamp)  sequences to generate skip-gram data for.
 
-    window_size_array : numpy.ndarray of shape(n, n_vocab)
+    window_size_array : numpy.ndarray of shape(n_vocab, n)
         The collection of window sizes per token per directed cooccurrence
 
     window_reversals: numpy.array(bool)
@@ -196,7 +196,7 @@ def numba_em_cooccurrence_iteration(
     """
 
     posterior_data = np.zeros_like(prior_data)
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     window_reversal_const = np.zeros(len(window_reversals)).astype(np.int32)
     window_reversal_const[window_reversals] = 1
 
@@ -209,7 +209,7 @@ def numba_em_cooccurrence_iteration(
             for i in range(n_windows):
                 win = window_at_index(
                     seq,
-                    window_size_array[i, target_word],
+                    window_size_array[target_word, i],
                     w_i,
                     reverse=window_reversals[i],
                 )
@@ -338,8 +338,10 @@ class TimedTokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         When processing token sequences to build the matrix, break the list of sequences into
         n_threads equal sized chunks to process in parallel with Dask.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the
@@ -425,6 +427,7 @@ class TimedTokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         )
         self.delta_mean_ = None
         self._preprocessing = preprocess_timed_token_sequences
+        self._accepts_encoded_corpus = False
 
     def _get_default_kernel_functions(self):
         return _TIMED_KERNEL_FUNCTIONS
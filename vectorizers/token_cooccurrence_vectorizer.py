@@ -41,7 +41,7 @@ def numba_build_skip_grams(
     n_unique_tokens: int
         The number of unique tokens in the token_dictionary.
 
-    window_size_array: numpy.ndarray(float, size = (n_windows, n_unique_tokens))
+    window_size_array: numpy.ndarray(uint16, size = (n_unique_tokens, n_windows))
         A collection of window sizes per vocabulary index per window function
 
     window_reversals: numpy.array(bool, size = (n_windows,))
@@ -68,7 +68,7 @@ def numba_build_skip_grams(
         Weight counts of values (kernel weighted counts) that token_head[i] cooccurred with token_tail[i]
     """
 
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     array_mul = n_windows * n_unique_tokens + 1
 
     coo_data = [
@@ -89,7 +89,7 @@ def numba_build_skip_grams(
             windows = [
                 window_at_index(
                     seq,
-                    window_size_array[i, target_word],
+                    window_size_array[target_word, i],
                     w_i,
                     reverse=window_reversals[i],
                 )
@@ -151,7 +151,7 @@ def numba_em_cooccurrence_iteration(
     token_sequences: Iterable of Iterables
         The collection of token sequences to generate skip-gram data for.
 
-    window_size_array : numpy.ndarray of shape(n, n_vocab)
+    window_size_array : numpy.ndarray of shape(n_vocab, n)
         The collection of window sizes per token per directed cooccurrence
 
     window_reversals: numpy.array(bool)
@@ -186,7 +186,7 @@ def numba_em_cooccurrence_iteration(
     """
 
     posterior_data = np.zeros_like(prior_data)
-    n_windows = window_size_array.shape[0]
+    n_windows = window_size_array.shape[1]
     window_reversal_const = np.zeros(len(window_reversals)).astype(np.int32)
     window_reversal_const[window_reversals] = 1
 
@@ -195,7 +195,7 @@ def numba_em_cooccurrence_iteration(
             windows = [
                 window_at_index(
                     seq,
-                    window_size_array[i, target_word],
+                    window_size_array[target_word, i],
                     w_i,
                     reverse=window_reversals[i],
                 )
@@ -323,8 +323,10 @@ class TokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         When processing token sequences to build the matrix, break the list of sequences into
         n_threads equal sized chunks to process in parallel with Dask.
 
-    validate_data: bool (optional, default=True)
-        Check whether the data is valid (e.g. of homogeneous token type).
+    validate_data: bool or int (optional, default=True)
+        Check whether the data is valid (e.g. of homogeneous token type). If an int,
+        only check a random sample of this many documents, which bounds the cost of
+        validating very large corpora.
 
     mask_string: str (optional, default=None)
         Prunes the filtered tokens when None, otherwise replaces them with the
@@ -347,6 +349,9 @@ class TokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         Optimizations to use significantly less memory are made for data sets with small expected numbers of
         non zeros. More memory will be allocated during processing if need be.
 
+    n_processes: int (optional, default=1)
+        The number of processes to shard the token sequences across when encoding
+        and counting tokens during preprocessing.
     """
 
     def __init__(
@@ -378,6 +383,7 @@ class TokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         n_iter=0,
         epsilon=0,
         coo_initial_memory="0.5 GiB",
+        n_processes=1,
     ):
         super().__init__(
             token_dictionary=token_dictionary,
@@ -410,8 +416,12 @@ class TokenCooccurrenceVectorizer(BaseCooccurrenceVectorizer):
         )
 
         # Other Params
+        self.n_processes = n_processes
         self._preprocessing = preprocess_token_sequences
 
+    def _preprocessing_params(self):
+        return {"n_processes": self.n_processes}
+
     def _em_cooccurrence_iteration(self, token_sequences, cooccurrence_matrix):
         # call the numba function to return the new matrix.data
         return numba_em_cooccurrence_iteration(
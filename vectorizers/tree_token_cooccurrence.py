@@ -1,15 +1,18 @@
 from warnings import warn
 import numpy as np
 import numba
+import dask
 
 from sklearn.base import BaseEstimator, TransformerMixin
 import scipy.linalg
 import scipy.stats
 import scipy.sparse
-from .preprocessing import preprocess_tree_sequences
-from .utils import (
-    flatten,
-    sparse_collapse,
+from .preprocessing import (
+    LabelledForest,
+    encode_token_sequence,
+    forest_chunk_boundaries,
+    labelled_forest_from_trees,
+    preprocess_labelled_forest,
 )
 import vectorizers.distances as distances
 
@@ -19,6 +22,130 @@ MOCK_DICT = numba.typed.Dict()
 MOCK_DICT[(-1, -1)] = -1
 
 
+@numba.njit(nogil=True)
+def _tree_skip_grams(
+    indptr,
+    indices,
+    data,
+    labels,
+    weights,
+    node_start,
+    node_end,
+    rows,
+    cols,
+    values,
+    count_only,
+):
+    # Walk down from every node along all paths of at most len(weights) edges,
+    # keeping the path in fixed size stacks, and emit (source label, target label,
+    # weight) for each path. For a tree these are the descendants within the
+    # window of each node; in general they are the entries of the sum of the
+    # weighted powers of the adjacency matrix. Returns the number of entries.
+    window_size = weights.shape[0]
+    node_stack = np.empty(window_size, dtype=np.int64)
+    edge_stack = np.empty(window_size, dtype=np.int64)
+    value_stack = np.empty(window_size, dtype=np.float64)
+    n_entries = 0
+    if window_size == 0:
+        return n_entries
+    for source in range(node_start, node_end):
+        node_stack[0] = source
+        edge_stack[0] = indptr[source]
+        value_stack[0] = 1.0
+        depth = 0
+        while depth >= 0:
+            k = edge_stack[depth]
+            if k == indptr[node_stack[depth] + 1]:
+                depth -= 1
+                continue
+            edge_stack[depth] = k + 1
+            target = indices[k]
+            value = value_stack[depth] * data[k]
+            if not count_only:
+                rows[n_entries] = labels[source]
+                cols[n_entries] = labels[target]
+                values[n_entries] = value * weights[depth]
+            n_entries += 1
+            if depth + 1 < window_size:
+                depth += 1
+                node_stack[depth] = target
+                edge_stack[depth] = indptr[target]
+                value_stack[depth] = value
+    return n_entries
+
+
+@numba.njit(nogil=True)
+def forest_skip_grams_coo_data(
+    indptr, indices, data, labels, weights, node_start, node_end
+):
+    """Count the weighted skip grams of the labels of a range of whole trees of a
+    forest by walking at most len(weights) edges down from every node, without
+    any sparse matrix products.
+
+    Parameters
+    ----------
+    indptr: array
+        The CSR row pointers of the adjacency matrix of the forest.
+
+    indices: array
+        The CSR column indices of the adjacency matrix of the forest.
+
+    data: array
+        The CSR edge data of the adjacency matrix of the forest.
+
+    labels: array of int
+        The label index of each node of the forest.
+
+    weights: array of shape (window_size,)
+        The kernel weight of a skip gram at each number of hops.
+
+    node_start: int
+        The first node of the range of trees to count.
+
+    node_end: int
+        The node following the last node of the range of trees to count.
+
+    Returns
+    -------
+    rows, cols, values: arrays
+        The COO entries of the skip gram counts; entries with the same row and
+        column are to be summed.
+    """
+    rows = np.empty(0, dtype=np.int64)
+    cols = np.empty(0, dtype=np.int64)
+    values = np.empty(0, dtype=np.float64)
+    n_entries = _tree_skip_grams(
+        indptr,
+        indices,
+        data,
+        labels,
+        weights,
+        node_start,
+        node_end,
+        rows,
+        cols,
+        values,
+        True,
+    )
+    rows = np.empty(n_entries, dtype=np.int64)
+    cols = np.empty(n_entries, dtype=np.int64)
+    values = np.empty(n_entries, dtype=np.float64)
+    _tree_skip_grams(
+        indptr,
+        indices,
+        data,
+        labels,
+        weights,
+        node_start,
+        node_end,
+        rows,
+        cols,
+        values,
+        False,
+    )
+    return rows, cols, values
+
+
 def build_tree_skip_grams(
     token_sequence,
     adjacency_matrix,
@@ -48,37 +175,94 @@ def build_tree_skip_grams(
     labels: array of length (unique_labels)
         This is the array of the labels of the rows and columns of our matrix.
     """
-    weights = kernel_function(-np.ones(window_size), *kernel_args)
-    count_matrix = adjacency_matrix * weights[0]
-    walk = adjacency_matrix
-    for i in range(1, window_size):
-        walk = walk @ adjacency_matrix
-        count_matrix += walk * weights[i]
-
-    # Now collapse the rows and columns with the same label
-    (grouped_matrix, new_labels) = sparse_collapse(count_matrix, token_sequence)
+    weights = np.asarray(
+        kernel_function(-np.ones(window_size), *kernel_args), dtype=np.float64
+    )
+    adjacency_matrix = scipy.sparse.csr_matrix(adjacency_matrix)
+    new_labels, label_codes = np.unique(token_sequence, return_inverse=True)
+    rows, cols, values = forest_skip_grams_coo_data(
+        adjacency_matrix.indptr,
+        adjacency_matrix.indices,
+        adjacency_matrix.data.astype(np.float64),
+        label_codes.astype(np.int64),
+        weights[:window_size],
+        0,
+        adjacency_matrix.shape[0],
+    )
+    grouped_matrix = scipy.sparse.coo_matrix(
+        (values, (rows, cols)), shape=(new_labels.shape[0], new_labels.shape[0])
+    ).tocsr()
 
     return grouped_matrix, new_labels
 
 
-def sequence_tree_skip_grams(
-    tree_sequences,
+def parallel_forest_skip_grams_coo_data(forest, weights, n_threads=1):
+    """Count the weighted skip grams of the labels of a forest of labelled trees
+    as unsummed COO entries over the label indices. The forest is split into
+    n_threads ranges of whole trees with roughly equal numbers of nodes that are
+    counted in parallel with Dask, and the entries of the ranges are concatenated.
+
+    Parameters
+    ----------
+    forest: LabelledForest
+        The trees, with the label index of each node (or -1 for an isolated node)
+        as labels.
+
+    weights: array of shape (window_size,)
+        The kernel weight of a skip gram at each number of hops.
+
+    n_threads: int (optional, default=1)
+        The number of ranges of trees to count in parallel.
+
+    Returns
+    -------
+    rows, cols, data: arrays
+        The COO entries of the skip gram counts; entries with the same row and
+        column are to be summed.
+    """
+    adjacency = scipy.sparse.csr_matrix(forest.adjacency)
+    data = adjacency.data.astype(np.float64)
+    labels = np.asarray(forest.labels, dtype=np.int64)
+    chunk_boundaries = forest_chunk_boundaries(forest.node_offsets, max(n_threads, 1))
+    if chunk_boundaries.shape[0] <= 2:
+        return forest_skip_grams_coo_data(
+            adjacency.indptr,
+            adjacency.indices,
+            data,
+            labels,
+            weights,
+            0,
+            adjacency.shape[0],
+        )
+
+    chunks = [
+        dask.delayed(forest_skip_grams_coo_data)(
+            adjacency.indptr, adjacency.indices, data, labels, weights, start, end
+        )
+        for start, end in zip(chunk_boundaries[:-1], chunk_boundaries[1:])
+    ]
+    chunk_results = dask.compute(*chunks)
+    return tuple(
+        np.concatenate([chunk[i] for chunk in chunk_results]) for i in range(3)
+    )
+
+
+def labelled_forest_skip_grams(
+    forest,
     kernel_function,
     kernel_args,
     window_size,
-    label_dictionary,
+    n_tokens,
     window_orientation,
+    n_threads=1,
 ):
     """
-    Takes a sequence of labelled trees and counts the weighted skip grams of their labels.
-    For our purposes we take a labelled tree to be a tuple containing an adjacency matrix and an
-    array of it's vertex labels.
+    Takes a forest of labelled trees and counts the weighted skip grams of their labels.
     Parameters
     ----------
-    tree_sequences: sequence of tuples (sparse matrix of size (n,n), array of size (n))
-        Each tuple in this sequence represents a labelled tree.
-        The first element is a sparse adjacency matrix
-        The second element is an array of node labels
+    forest: LabelledForest
+        The trees, with the label index of each node (or -1 for an isolated node)
+        as labels.
 
     kernel_function: numba.jitted callable
         A function producing weights given a window of tokens
@@ -90,10 +274,8 @@ def sequence_tree_skip_grams(
     window_size: int
         The number of steps out to look in your tree skip gram
 
-    label_dictionary: dict
-        A dictionary mapping from your valid label set to indices.  This is used as the global
-        alignment for your new label space.  All tokens still present in your tree sequences must
-        exist within your label_dictionary.
+    n_tokens: int
+        The number of label indices.
 
     window_orientation: string (['before', 'after', 'symmetric', 'directional'])
         The orientation of the cooccurrence window.  Whether to return all the tokens that
@@ -101,31 +283,23 @@ def sequence_tree_skip_grams(
         symmetric: counts tokens occurring before and after as the same tokens
         directional: counts tokens before and after as different and returns both counts.
 
+    n_threads: int (optional, default=1)
+        The number of ranges of trees to count the skip grams of in parallel.
+
     Returns
     -------
     skip_gram_matrix: sparse.csr_matrix
         A matrix of weighted graph label co-occurence counts.
     """
-    n_tokens = len(label_dictionary)
-    global_counts = scipy.sparse.coo_matrix((n_tokens, n_tokens))
-    for adj_matrix, token_sequence in tree_sequences:
-        (count_matrix, unique_labels,) = build_tree_skip_grams(
-            token_sequence=token_sequence,
-            adjacency_matrix=adj_matrix,
-            kernel_function=kernel_function,
-            kernel_args=kernel_args,
-            window_size=window_size,
-        )
-        # Reorder these based on the label_dictionary
-        count_matrix = count_matrix.tocoo()
-        rows = [label_dictionary[unique_labels[x]] for x in count_matrix.row]
-        cols = [label_dictionary[unique_labels[x]] for x in count_matrix.col]
-        data = count_matrix.data
-        reordered_matrix = scipy.sparse.coo_matrix(
-            (data, (rows, cols)), shape=(n_tokens, n_tokens)
-        )
-        global_counts += reordered_matrix
-    global_counts = global_counts.tocsr()
+    weights = np.asarray(
+        kernel_function(-np.ones(window_size), *kernel_args), dtype=np.float64
+    )
+    rows, cols, data = parallel_forest_skip_grams_coo_data(
+        forest, weights[:window_size], n_threads=n_threads
+    )
+    global_counts = scipy.sparse.coo_matrix(
+        (data, (rows, cols)), shape=(n_tokens, n_tokens)
+    ).tocsr()
 
     # if nulify mask
     mask_index = kernel_args[0]
@@ -152,6 +326,69 @@ def sequence_tree_skip_grams(
     return global_counts
 
 
+def sequence_tree_skip_grams(
+    tree_sequences,
+    kernel_function,
+    kernel_args,
+    window_size,
+    label_dictionary,
+    window_orientation,
+    n_threads=1,
+):
+    """
+    Takes a sequence of labelled trees and counts the weighted skip grams of their labels.
+    For our purposes we take a labelled tree to be a tuple containing an adjacency matrix and an
+    array of it's vertex labels.
+    Parameters
+    ----------
+    tree_sequences: sequence of tuples (sparse matrix of size (n,n), array of size (n))
+        Each tuple in this sequence represents a labelled tree.
+        The first element is a sparse adjacency matrix
+        The second element is an array of node labels
+
+    kernel_function: numba.jitted callable
+        A function producing weights given a window of tokens
+        Currently this needs to take a window_size parameter.
+
+    kernel_args: tuple
+        Arguments to pass through to the kernel function
+
+    window_size: int
+        The number of steps out to look in your tree skip gram
+
+    label_dictionary: dict
+        A dictionary mapping from your valid label set to indices.  This is used as the global
+        alignment for your new label space.  All tokens still present in your tree sequences must
+        exist within your label_dictionary.
+
+    window_orientation: string (['before', 'after', 'symmetric', 'directional'])
+        The orientation of the cooccurrence window.  Whether to return all the tokens that
+        occurred within a window before, after on either side.
+        symmetric: counts tokens occurring before and after as the same tokens
+        directional: counts tokens before and after as different and returns both counts.
+
+    n_threads: int (optional, default=1)
+        The number of ranges of trees to count the skip grams of in parallel.
+
+    Returns
+    -------
+    skip_gram_matrix: sparse.csr_matrix
+        A matrix of weighted graph label co-occurence counts.
+    """
+    forest = labelled_forest_from_trees(tree_sequences)
+    # Labels of contracted nodes are absent from label_dictionary, but have no edges
+    labels, _, _ = encode_token_sequence(forest.labels, label_dictionary)
+    return labelled_forest_skip_grams(
+        forest._replace(labels=labels),
+        kernel_function,
+        kernel_args,
+        window_size,
+        len(label_dictionary),
+        window_orientation,
+        n_threads=n_threads,
+    )
+
+
 class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
     """
     Takes a sequence of labelled trees and counts and produces a cooccurrence count matrix
@@ -238,6 +475,11 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
     nullify_mask: bool (optional, default=False)
         Sets all cooccurrences with the mask_string equal to zero by skipping over them
         during processing.
+
+    n_threads: int (optional, default=1)
+        When removing filtered nodes from the trees and counting the skip grams,
+        break the list of trees into n_threads equal sized chunks to process in
+        parallel with Dask.
     """
 
     def __init__(
@@ -260,6 +502,7 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         validate_data=True,
         mask_string=None,
         nullify_mask=False,
+        n_threads=1,
     ):
         self.token_dictionary = token_dictionary
         self.min_occurrences = min_occurrences
@@ -281,6 +524,7 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         self.validate_data = validate_data
         self.mask_string = mask_string
         self.nullify_mask = nullify_mask
+        self.n_threads = n_threads
 
     def fit(self, X, y=None, **fit_params):
         """
@@ -292,6 +536,8 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             Each tuple in this sequence represents a labelled tree.
             The first element is a (sparse) adjacency matrix
             The second element is an array of node labels
+            Alternatively a LabelledForest holds all the trees in a single
+            block diagonal adjacency matrix and a single array of labels.
 
         Returns
         -------
@@ -299,16 +545,14 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         """
         # Filter and process the raw token counts and build the token dictionaries.
         # WARNING: We count isolated vertices as an occurrence of a label.  It's a feature.
-        raw_token_sequences = [label_sequence for adjacency, label_sequence in X]
-        flat_sequences = flatten(raw_token_sequences)
+        forest = X if isinstance(X, LabelledForest) else labelled_forest_from_trees(X)
         (
-            clean_tree_sequence,
+            clean_forest,
             self.token_label_dictionary_,
             self.token_index_dictionary_,
             self._token_frequencies_,
-        ) = preprocess_tree_sequences(
-            X,
-            flat_sequences,
+        ) = preprocess_labelled_forest(
+            forest,
             self.token_dictionary,
             min_occurrences=self.min_occurrences,
             max_occurrences=self.max_occurrences,
@@ -321,6 +565,7 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             ignored_tokens=self.ignored_tokens,
             excluded_token_regex=self.excluded_token_regex,
             masking=self.mask_string,
+            n_threads=self.n_threads,
         )
 
         if callable(self.kernel_function):
@@ -343,13 +588,14 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         self._window_size = self.window_radius
 
         # build token_cooccurrence_matrix()
-        self.cooccurrences_ = sequence_tree_skip_grams(
-            clean_tree_sequence,
+        self.cooccurrences_ = labelled_forest_skip_grams(
+            clean_forest,
             kernel_function=self._kernel_function,
             kernel_args=self._kernel_args,
             window_size=self._window_size,
-            label_dictionary=self.token_label_dictionary_,
+            n_tokens=len(self.token_label_dictionary_),
             window_orientation=self.window_orientation,
+            n_threads=self.n_threads,
         )
 
         if self.window_orientation in ["before", "after", "symmetric"]:
@@ -382,6 +628,8 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             Each tuple in this sequence represents a labelled tree.
             The first element is a (sparse) adjacency matrix
             The second element is an array of node labels
+            Alternatively a LabelledForest holds all the trees in a single
+            block diagonal adjacency matrix and a single array of labels.
 
         Returns
         -------
@@ -402,6 +650,8 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             Each tuple in this sequence represents a labelled tree.
             The first element is a (sparse) adjacency matrix
             The second element is an array of node labels
+            Alternatively a LabelledForest holds all the trees in a single
+            block diagonal adjacency matrix and a single array of labels.
 
 
         Returns
@@ -410,15 +660,17 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
             A weighted label cooccurrence count matrix
         """
 
-        raw_token_sequences = [label_sequence for adjacency, label_sequence in X]
-        flat_sequences = flatten(raw_token_sequences)
+        forest = X if isinstance(X, LabelledForest) else labelled_forest_from_trees(X)
         (
-            clean_tree_sequence,
+            clean_forest,
             self.token_label_dictionary_,
             self.token_index_dictionary_,
             self._token_frequencies_,
-        ) = preprocess_tree_sequences(
-            X, flat_sequences, self.token_label_dictionary_, masking=self.mask_string
+        ) = preprocess_labelled_forest(
+            forest,
+            self.token_label_dictionary_,
+            masking=self.mask_string,
+            n_threads=self.n_threads,
         )
 
         if callable(self.kernel_function):
@@ -433,13 +685,14 @@ class LabelledTreeCooccurrenceVectorizer(BaseEstimator, TransformerMixin):
         self._window_size = self.window_radius
 
         # build token_cooccurrence_matrix()
-        cooccurrences = sequence_tree_skip_grams(
-            clean_tree_sequence,
+        cooccurrences = labelled_forest_skip_grams(
+            clean_forest,
             kernel_function=self._kernel_function,
             kernel_args=self._kernel_args,
             window_size=self._window_size,
-            label_dictionary=self.token_label_dictionary_,
+            n_tokens=len(self.token_label_dictionary_),
             window_orientation=self.window_orientation,
+            n_threads=self.n_threads,
         )
         cooccurrences.eliminate_zeros()
 
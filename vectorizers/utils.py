@@ -6,7 +6,8 @@ import scipy.sparse
 import itertools
 from collections.abc import Iterable
 from sklearn.mixture import GaussianMixture
-from sklearn.preprocessing import normalize, LabelBinarizer
+from sklearn.preprocessing import normalize
+from sklearn.utils.validation import check_random_state
 from collections import Counter
 import re
 from warnings import warn
@@ -124,17 +125,17 @@ def sparse_collapse(matrix, labels, sparse=True):
     if len(labels) == 0:
         return matrix, labels
 
-    transformer = LabelBinarizer(sparse_output=sparse)
-    trans = transformer.fit_transform(labels)
-    if (trans.shape[1]) == 1:
-        trans = trans.toarray()
-        if len(transformer.classes_) == 1:
-            trans ^= 1
-        else:
-            trans = np.hstack([trans ^ 1, trans])
-        trans = scipy.sparse.csr_matrix(trans, dtype=np.float32, shape=trans.shape)
-    result = trans.T @ matrix @ trans
-    return result, transformer.classes_
+    # Map the row and column indices to label codes and let the conversion to
+    # csr sum the entries that land on the same pair of labels
+    unique_labels, label_codes = np.unique(labels, return_inverse=True)
+    matrix = scipy.sparse.coo_matrix(matrix)
+    result = scipy.sparse.coo_matrix(
+        (matrix.data, (label_codes[matrix.row], label_codes[matrix.col])),
+        shape=(unique_labels.shape[0], unique_labels.shape[0]),
+    ).tocsr()
+    if not sparse:
+        result = result.toarray()
+    return result, unique_labels
 
 
 def cast_tokens_to_strings(data):
@@ -162,29 +163,98 @@ def cast_tokens_to_strings(data):
     return result
 
 
-def validate_homogeneous_token_types(data):
+def _sequence_token_types(sequence):
+    """The set of token types in a single sequence; numpy arrays of a fixed dtype
+    are resolved from the dtype without touching the elements."""
+    if isinstance(sequence, np.ndarray) and sequence.dtype != object:
+        return {sequence.dtype.type} if sequence.size > 0 else set()
+    return set(map(type, sequence))
+
+
+def validate_homogeneous_token_types(data, sample_size=None, random_state=None):
     """Validate that all tokens are of homogeneous type.
 
+    Documents are checked one at a time and validation stops at the first
+    document that disagrees with the token type seen so far, so homogeneous data
+    costs a single pass and heterogeneous data is usually rejected early.
+
     Parameters
     ----------
     data: iterator of tokens or iterator of iterators of tokens
         The token data to convert to string based tokens
 
+    sample_size: int or None (optional, default=None)
+        If an int, only check the token types of a random sample of this many
+        documents. If None every document is checked.
+
+    random_state: int, numpy.random.RandomState or None (optional, default=None)
+        The random state used to select the sample of documents when
+        ``sample_size`` is set.
+
     Returns
     -------
     valid: True if valid; will raise an exception if tokens are heterogeneous.
     """
-    types = Counter([type(x) for x in flatten(data)])
-    if len(types) > 1:
-        warn(f"Non-homogeneous token types encountered. Token type counts are: {types}")
-        raise ValueError(
-            "Heterogeneous token types are not supported -- please cast "
-            "your tokens to a single type. You can use "
-            '"X = vectorizers.cast_tokens_to_string(X)" to achieve '
-            "this."
-        )
+    if len(data) == 0:
+        return True
+
+    if isinstance(data, np.ndarray) and data.dtype != object:
+        return True
+
+    if type(data[0]) in (list, tuple, np.ndarray):
+        sequences = data
+        if sample_size is not None and sample_size < len(data):
+            random_state = check_random_state(random_state)
+            sample = random_state.choice(len(data), sample_size, replace=False)
+            sequences = [data[i] for i in np.sort(sample)]
     else:
+        sequences = [data]
+
+    token_types = set()
+    for sequence in sequences:
+        token_types |= _sequence_token_types(sequence)
+        if len(token_types) > 1:
+            break
+    else:
+        return True
+
+    # Only count the types in full when reporting a failure
+    types = Counter()
+    for sequence in sequences:
+        types.update(map(type, sequence))
+    warn(f"Non-homogeneous token types encountered. Token type counts are: {types}")
+    raise ValueError(
+        "Heterogeneous token types are not supported -- please cast "
+        "your tokens to a single type. You can use "
+        '"X = vectorizers.cast_tokens_to_string(X)" to achieve '
+        "this."
+    )
+
+
+def validate_token_data(data, validate_data=True):
+    """Validate token data according to a vectorizer's ``validate_data`` setting.
+
+    Parameters
+    ----------
+    data: iterator of tokens or iterator of iterators of tokens
+        The token data to validate.
+
+    validate_data: bool or int (optional, default=True)
+        If True check the token types of every document; if an int only check a
+        random (but reproducible) sample of this many documents; if False do not
+        check anything.
+
+    Returns
+    -------
+    valid: True if valid; will raise an exception if tokens are heterogeneous.
+    """
+    if not validate_data:
         return True
+    if isinstance(validate_data, (bool, np.bool_)):
+        return validate_homogeneous_token_types(data)
+    return validate_homogeneous_token_types(
+        data, sample_size=int(validate_data), random_state=0
+    )
 
 
 def gmm_component_likelihood(